@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Microbenchmark of DurakCard construction and hashing.
+
+Compares the interned fast paths with the full parsing path that every
+DurakCard() call used to take.
+
+Usage:
+  python benchmarks/cards.py [<number>]
+"""
+import sys
+import timeit
+
+
+SETUP = '''
+from durak.utils.cards import DurakCard
+card = DurakCard('7H')
+
+def parse_and_lookup(value):
+    key = DurakCard._parse_suit_and_rank(value)
+    return DurakCard._INSTANCE_REGISTRY[key]
+'''
+
+CASES = (
+    # (name, statement, statement of the old path)
+    ('DurakCard(card)', 'DurakCard(card)', 'parse_and_lookup(card)'),
+    ("DurakCard('7H')", "DurakCard('7H')", "parse_and_lookup('7H')"),
+    ('hash(card)', 'hash(card)', 'hash(str(card))'),
+)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    for name, statement, old_statement in CASES:
+        new_time = min(timeit.repeat(statement, SETUP, number=number))
+        old_time = min(timeit.repeat(old_statement, SETUP, number=number))
+        sys.stdout.write(
+            '%-18s %7.1f ns (was %7.1f ns), x%.1f\n' % (
+                name,
+                new_time / number * 1e9,
+                old_time / number * 1e9,
+                old_time / new_time,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Games per second of durak.sim and of durak-autoplay with in-process
+DummyEngine, i.e. the cost of the engine protocol and logging, and of
+durak.sim.batch if numpy is installed.
+
+Usage:
+  python benchmarks/sim.py [<games>]
+"""
+import sys
+import time
+
+from durak.autoplay import _GameRunner
+from durak.sim import benchmark
+
+try:
+    from durak.sim import batch
+except ImportError:
+    batch = None
+
+
+DUMMY_ENGINE = 'py:durak.engine.dummy:DummyEngine'
+
+
+def autoplay_benchmark(n_games, seed=0):
+    runner = _GameRunner(DUMMY_ENGINE, DUMMY_ENGINE, False, seed, False, None)
+    started_at = time.time()
+    for game_index in xrange(n_games):
+        runner.play(game_index)
+    speed = n_games / (time.time() - started_at)
+    runner.close()
+    return speed
+
+
+def batch_benchmark(n_games, seed=0):
+    started_at = time.time()
+    batch.simulate_batch(
+        batch.lowest_batch_policy, batch.lowest_batch_policy, n_games, seed
+    )
+    return n_games / (time.time() - started_at)
+
+
+def main():
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    sim_speed = benchmark(n_games=n_games)
+    autoplay_speed = autoplay_benchmark(n_games)
+    sys.stdout.write(
+        'durak.sim      %7.1f games/s\n'
+        'durak-autoplay %7.1f games/s, x%.1f\n' % (
+            sim_speed, autoplay_speed, sim_speed / autoplay_speed
+        )
+    )
+    if batch is not None:
+        batch_speed = batch_benchmark(n_games * 10)
+        sys.stdout.write(
+            'durak.sim.batch %6.1f games/s, x%.1f\n' % (
+                batch_speed, batch_speed / sim_speed
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@
 """Durak Autoplay
 
 Usage:
-  durak-autoplay <path_to_engine1> <path_to_engine2> [--matches-number=<count>] [--match-size=<count>] [--log-file=<path_to_file>] [--debug]
+  durak-autoplay <path_to_engine1> <path_to_engine2> [--matches-number=<count>] [--match-size=<count>] [--log-file=<path_to_file>] [--compress-log] [--jobs=<count>] [--concurrency=<count>] [--seed=<seed>] [--duplicate] [--sprt=<bounds>] [--move-time=<seconds>] [--game-time=<seconds>] [--increment=<seconds>] [--latency] [--latency-file=<path_to_file>] [--debug]
   durak-autoplay (-h | --help)
   durak-autoplay --version
 
@@ -13,18 +13,48 @@ Options:
   --matches-number=<count>   Number of matches to play [default: 10].
   --match-size=<count>       Number of games per match [default: 100].
   --log-file=<path_to_file>  Path to save games log file.
+  --compress-log             Save the log compressed, in blocks of games
+                             (durak-logviewer reads it too).
+  --jobs=<count>             Number of games played in parallel [default: 1].
+  --concurrency=<count>      Number of games played at once in one process,
+                             can not be used with --jobs [default: 1].
+  --seed=<seed>              Integer seed to make the deals reproducible.
+  --duplicate                Play every deal twice, swapping the engines.
+  --sprt=<bounds>            Stop as soon as SPRT accepts one of hypotheses,
+                             bounds are "elo0,elo1[,alpha,beta]".
+  --move-time=<seconds>      Time limit for one command of an engine.
+  --game-time=<seconds>      Time budget of an engine for a game.
+  --increment=<seconds>      Time added to the budget after every move,
+                             respond and give_more [default: 0].
+  --latency                  Print round trip times of engine commands.
+  --latency-file=<path_to_file>
+                             Save round trip times of engine commands as
+                             JSON.
   --debug                    Print debug output.
 
 """
 from collections import Counter, defaultdict
+from functools import partial
+import json
 import logging
+import math
+import multiprocessing
+from multiprocessing.util import Finalize
 import os.path
+from random import Random
 import sys
+import time
 
 from docopt import docopt
 
 from durak.controller import GameController
-from durak.engine.wrapper import EngineWrapper
+from durak.engine.stats import LATENCY_BUCKETS, TimeStats
+from durak.engine.wrapper import (EngineMultiplexer, EngineOutputException,
+                                  EngineTimeoutException, TimeControl,
+                                  create_engine_wrapper)
+from durak.gamelogger import CompressedLogWriter, LogWriter
+from durak.utils.cards import BitCardSet
+from durak.utils.sprt import SPRT
 
 
 ENGINE1 = 1
@@ -32,92 +62,409 @@ ENGINE2 = 2
 DRAW = 3
 
 
-def _play_game(engine1_path, engine2_path, log_filename=''):
-    engine1 = EngineWrapper(engine1_path)
-    engine2 = EngineWrapper(engine2_path)
-    controller = GameController(
-        player1_name=engine1_path,
-        player2_name=engine2_path,
-        log_filename=log_filename,
-    )
+def _play_game_steps(engine1, engine2, controller):
+    # The game loop. It yields the results of engine commands and gets back
+    # their values, so the same loop is used for synchronous engines (see
+    # _run_game_loop) and for AsyncEngineWrapper (see EngineMultiplexer).
     new_game_data = controller.start_new_game()
 
-    engine1.init(new_game_data['trump'])
-    engine2.init(new_game_data['trump'])
+    try:
+        yield engine1.init(new_game_data['trump'])
+        yield engine2.init(new_game_data['trump'])
+
+        yield engine1.deal(
+            new_game_data['player1_cards'],
+            partial(controller.get_game_data_for, controller.PLAYER1)
+        )
+        yield engine2.deal(
+            new_game_data['player2_cards'],
+            partial(controller.get_game_data_for, controller.PLAYER2)
+        )
+
+        while True:
+            if controller.state == controller.States.MOVING:
+                if controller.is_player1_to_move():
+                    engine_to_move = engine1
+                else:
+                    engine_to_move = engine2
+
+                card = yield engine_to_move.move(
+                    controller.on_table,
+                    partial(controller.get_game_data_for, controller.MOVER)
+                )
+                controller.register_move(card)
+
+            elif controller.state == controller.States.RESPONDING:
+                if controller.is_player1_to_move():
+                    engine_to_respond = engine2
+                else:
+                    engine_to_respond = engine1
+
+                card = yield engine_to_respond.respond(
+                    controller.on_table,
+                    partial(
+                        controller.get_game_data_for, controller.RESPONDER
+                    )
+                )
+                controller.register_response(card)
+
+            elif controller.state == controller.States.GIVING_MORE:
+                if controller.is_player1_to_move():
+                    engine_to_give_more = engine1
+                else:
+                    engine_to_give_more = engine2
+
+                cards = yield engine_to_give_more.give_more(
+                    controller.on_table,
+                    partial(controller.get_game_data_for, controller.MOVER)
+                )
+                controller.register_give_more(cards)
+
+            elif controller.state == controller.States.DEALING:
+                deal_data = controller.deal()
+                yield engine1.deal(
+                    deal_data['player1_cards'],
+                    partial(controller.get_game_data_for, controller.PLAYER1)
+                )
+                yield engine2.deal(
+                    deal_data['player2_cards'],
+                    partial(controller.get_game_data_for, controller.PLAYER2)
+                )
+
+            if controller.is_game_over():
+                break
+    except EngineTimeoutException as e:
+        if e.engine is engine1:
+            controller.register_loss_on_time(controller.PLAYER1)
+        else:
+            controller.register_loss_on_time(controller.PLAYER2)
+    except EngineOutputException as e:
+        logging.warning(str(e))
+        if e.engine is engine1:
+            controller.register_forfeit(controller.PLAYER1)
+        else:
+            controller.register_forfeit(controller.PLAYER2)
+
+    engine1.game_end()
+    engine2.game_end()
+
+
+def _run_game_loop(game_loop):
+    # synchronous engines return the values of commands at once
+    value = None
+    try:
+        while True:
+            value = game_loop.send(value)
+    except StopIteration:
+        pass
+
 
-    engine1.deal(
-        new_game_data['player1_cards'],
-        controller.get_game_data_for(controller.PLAYER1)
+def _get_game_result(controller):
+    if controller.winner == controller.PLAYER1:
+        return ENGINE1
+    elif controller.winner == controller.PLAYER2:
+        return ENGINE2
+    else:
+        return DRAW
+
+
+def _get_game_seed(seed, game_index):
+    # every game gets its own seed, so its deal does not depend on which
+    # worker plays it and on how many games were played before
+    return seed * 2 ** 32 + game_index
+
+
+class _GameRunner(object):
+
+    def __init__(self, engine1_path, engine2_path, with_log=False,
+                 seed=None, duplicate=False, time_control=None,
+                 asynchronous=False):
+        # engines that support sessions play all the games in one process
+        self._engine1 = create_engine_wrapper(
+            engine1_path, asynchronous=asynchronous, time_control=time_control,
+            session=True, lazy_gamedata=True, compact=True
+        )
+        self._engine2 = create_engine_wrapper(
+            engine2_path, asynchronous=asynchronous, time_control=time_control,
+            session=True, lazy_gamedata=True, compact=True
+        )
+        self._controller = GameController(
+            player1_name=engine1_path,
+            player2_name=engine2_path,
+            card_set_class=BitCardSet,
+        )
+        # the same as self._controller, but engine2 is the first player
+        self._swapped_controller = GameController(
+            player1_name=engine2_path,
+            player2_name=engine1_path,
+            card_set_class=BitCardSet,
+        )
+        self._with_log = with_log
+        self._seed = seed
+        self._duplicate = duplicate
+        # (controller, swapped) of the game started by start_game
+        self._current_game = None
+
+    def play(self, game_index):
+        _run_game_loop(self.start_game(game_index))
+        return self.finish_game()
+
+    def start_game(self, game_index):
+        # Returns the game loop, see _play_game_steps. The result is
+        # returned by finish_game when the loop is over.
+
+        # in duplicate mode games 2k and 2k + 1 have the same deal, and in
+        # the second one the engines change their seats
+        if self._duplicate:
+            deal_index, swapped = divmod(game_index, 2)
+        else:
+            deal_index, swapped = game_index, False
+
+        if swapped:
+            controller = self._swapped_controller
+            engine1, engine2 = self._engine2, self._engine1
+        else:
+            controller = self._controller
+            engine1, engine2 = self._engine1, self._engine2
+
+        if self._seed is not None:
+            controller.set_seed(_get_game_seed(self._seed, deal_index))
+
+        self._engine1.time_stats = TimeStats()
+        self._engine2.time_stats = TimeStats()
+
+        self._current_game = (controller, swapped)
+        return _play_game_steps(engine1, engine2, controller)
+
+    def finish_game(self):
+        controller, swapped = self._current_game
+        self._current_game = None
+
+        game_result = _get_game_result(controller)
+        if swapped:
+            game_result = _SWAPPED_RESULTS[game_result]
+
+        game_log = controller.dump_log() if self._with_log else None
+        time_stats = (self._engine1.time_stats, self._engine2.time_stats)
+        return game_result, game_log, time_stats
+
+    def close(self):
+        self._engine1.close()
+        self._engine2.close()
+
+
+_SWAPPED_RESULTS = {ENGINE1: ENGINE2, ENGINE2: ENGINE1, DRAW: DRAW}
+
+# every worker process of the pool has its own engines and controller
+_worker_runner = None
+
+
+def _init_worker(*runner_args):
+    global _worker_runner
+    _worker_runner = _GameRunner(*runner_args)
+    Finalize(_worker_runner, _worker_runner.close, exitpriority=10)
+
+
+def _play_game_in_worker(game_index):
+    return _worker_runner.play(game_index)
+
+
+def _iter_game_results(runner_args, games_count, jobs=1, concurrency=1):
+    # yields (game_result, game_log, time_stats) in the order the games were
+    # started
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_worker, runner_args)
+        try:
+            for result in pool.imap(_play_game_in_worker, xrange(games_count)):
+                yield result
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    elif concurrency > 1:
+        for result in _iter_concurrent_game_results(
+                runner_args, games_count, concurrency):
+            yield result
+    else:
+        runner = _GameRunner(*runner_args)
+        try:
+            for game_index in xrange(games_count):
+                yield runner.play(game_index)
+        finally:
+            runner.close()
+
+
+def _iter_concurrent_game_results(runner_args, games_count, concurrency):
+    # Every runner has its own engines and plays one game at a time, the
+    # games of all the runners are played at once by EngineMultiplexer.
+    runners = [
+        _GameRunner(*runner_args, asynchronous=True)
+        for _ in xrange(min(concurrency, games_count))
+    ]
+    multiplexer = EngineMultiplexer()
+    finished = {}
+    game_indexes = iter(xrange(games_count))
+
+    def start_next_game(runner):
+        for game_index in game_indexes:
+            game_loop = runner.start_game(game_index)
+            if not multiplexer.add((runner, game_index), game_loop):
+                return
+            finished[game_index] = runner.finish_game()
+
+    try:
+        for runner in runners:
+            start_next_game(runner)
+
+        for game_index in xrange(games_count):
+            while game_index not in finished:
+                for runner, finished_index in multiplexer.wait():
+                    finished[finished_index] = runner.finish_game()
+                    start_next_game(runner)
+            yield finished.pop(game_index)
+    finally:
+        for runner in runners:
+            runner.close()
+
+
+_ENGINE1_POINTS = {ENGINE1: 1.0, DRAW: 0.5, ENGINE2: 0.0}
+
+
+def _write_pairs_summary(game_results):
+    # Engine1 gets from 0 to 2 points for every pair of games. The pairs
+    # are independent, while the games of one pair are not, so the
+    # confidence interval is computed over the pairs.
+    pair_points = [
+        _ENGINE1_POINTS[game_results[index]] +
+        _ENGINE1_POINTS[game_results[index + 1]]
+        for index in xrange(0, len(game_results) - 1, 2)
+    ]
+    if not pair_points:
+        return
+
+    pairs = Counter(pair_points)
+    sys.stdout.write(
+        'Pairs by Engine1 points - 2: %d, 1.5: %d, 1: %d, 0.5: %d, 0: %d\n' % (
+            pairs[2.0], pairs[1.5], pairs[1.0], pairs[0.5], pairs[0.0]
+        )
     )
-    engine2.deal(
-        new_game_data['player2_cards'],
-        controller.get_game_data_for(controller.PLAYER2)
+
+    count = len(pair_points)
+    mean = sum(pair_points) / count
+    if count > 1:
+        variance = sum((x - mean) ** 2 for x in pair_points) / (count - 1)
+    else:
+        variance = 0.0
+    error = 1.96 * math.sqrt(variance / count)
+    sys.stdout.write(
+        'Engine1 score: %.1f%% +- %.1f%% (95%%, %d pairs)\n' % (
+            mean * 50, error * 50, count
+        )
     )
 
-    while True:
-        if controller.state == controller.States.MOVING:
-            if controller.is_player1_to_move():
-                engine_to_move = engine1
-            else:
-                engine_to_move = engine2
 
-            card = engine_to_move.move(
-                controller.on_table,
-                controller.get_game_data_for(controller.MOVER)
-            )
-            controller.register_move(card)
+def _update_sprt(sprt, game_results, duplicate):
+    if not duplicate:
+        sprt.add(_ENGINE1_POINTS[game_results[-1]])
+    elif len(game_results) % 2 == 0:
+        sprt.add(
+            (_ENGINE1_POINTS[game_results[-2]] +
+             _ENGINE1_POINTS[game_results[-1]]) / 2
+        )
 
-        elif controller.state == controller.States.RESPONDING:
-            if controller.is_player1_to_move():
-                engine_to_respond = engine2
-            else:
-                engine_to_respond = engine1
 
-            card = engine_to_respond.respond(
-                controller.on_table,
-                controller.get_game_data_for(controller.RESPONDER)
+def _write_sprt_summary(sprt, games_played, total_games):
+    sys.stdout.write(
+        'SPRT (elo0 %g, elo1 %g): LLR %.2f (%.2f, %.2f)\n' % (
+            sprt.elo0, sprt.elo1,
+            sprt.llr, sprt.lower_bound, sprt.upper_bound
+        )
+    )
+    if sprt.decision is None:
+        sys.stdout.write('No decision after %d games\n' % games_played)
+    else:
+        sys.stdout.write(
+            '%s accepted after %d games, %d games saved\n' % (
+                sprt.decision, games_played, total_games - games_played
             )
-            controller.register_response(card)
+        )
 
-        elif controller.state == controller.States.GIVING_MORE:
-            if controller.is_player1_to_move():
-                engine_to_give_more = engine1
-            else:
-                engine_to_give_more = engine2
 
-            cards = engine_to_give_more.give_more(
-                controller.on_table,
-                controller.get_game_data_for(controller.MOVER)
-            )
-            controller.register_give_more(cards)
+def _write_time_stats(engine_name, time_stats):
+    sys.stdout.write(
+        '%s time: %.1f s, %.1f ms per command, max %.1f ms, '
+        'lost on time: %d\n' % (
+            engine_name,
+            time_stats.time_used,
+            time_stats.mean_command_time * 1000,
+            time_stats.max_command_time * 1000,
+            time_stats.losses_on_time,
+        )
+    )
 
-        elif controller.state == controller.States.DEALING:
-            deal_data = controller.deal()
-            engine1.deal(
-                deal_data['player1_cards'],
-                controller.get_game_data_for(controller.PLAYER1)
-            )
-            engine2.deal(
-                deal_data['player2_cards'],
-                controller.get_game_data_for(controller.PLAYER2)
-            )
 
-        if controller.is_game_over():
-            break
+def _format_latency(seconds):
+    if seconds < 0.001:
+        return '%gus' % (seconds * 1000000)
+    if seconds < 1:
+        return '%gms' % (seconds * 1000)
+    return '%gs' % seconds
 
-    engine1.game_end()
-    engine2.game_end()
 
-    if controller.winner == controller.PLAYER1:
-        return ENGINE1
-    elif controller.winner == controller.PLAYER2:
-        return ENGINE2
-    else:
-        return DRAW
+def _write_latency_stats(engine_name, time_stats):
+    sys.stdout.write('%s latency:\n' % engine_name)
+    for command in ('init', 'deal', 'move', 'respond', 'give_more'):
+        command_stats = time_stats.commands.get(command)
+        if command_stats is None:
+            continue
+
+        sys.stdout.write(
+            '  %-10s count %d, mean %.3f ms, max %.3f ms\n' % (
+                command,
+                command_stats.count,
+                command_stats.mean_time * 1000,
+                command_stats.max_time * 1000,
+            )
+        )
+        # only the buckets with some commands in them
+        buckets = []
+        for index, count in enumerate(command_stats.histogram):
+            if not count:
+                continue
+            if index < len(LATENCY_BUCKETS):
+                label = '<=' + _format_latency(LATENCY_BUCKETS[index])
+            else:
+                label = '>' + _format_latency(LATENCY_BUCKETS[-1])
+            buckets.append('%s: %d' % (label, count))
+        sys.stdout.write('    %s\n' % ', '.join(buckets))
+
+
+def _dump_latency_stats(filename, engine_paths, engine_time_stats,
+                        games_count, wall_time):
+    with open(filename, 'w') as f:
+        json.dump(
+            {
+                'games': games_count,
+                'wall_time': wall_time,
+                'engines': [
+                    dict(time_stats.to_dict(), path=path)
+                    for path, time_stats in zip(
+                        engine_paths, engine_time_stats
+                    )
+                ],
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
 
 
 def _do_autoplay(engine1_path, engine2_path, matches_number, match_size,
-                 log_filename=''):
+                 log_filename='', jobs=1, seed=None, duplicate=False,
+                 sprt=None, concurrency=1, time_control=None,
+                 latency=False, latency_filename='', compress_log=False):
     total_games = matches_number * match_size
     game_counter = 1
     matches = []
@@ -125,24 +472,69 @@ def _do_autoplay(engine1_path, engine2_path, matches_number, match_size,
     sys.stdout.write(
         'Playing %d matches, %d games each\n' % (matches_number, match_size)
     )
-    for _ in xrange(matches_number):
-        match = Counter()
-        for __ in xrange(match_size):
-            sys.stdout.write('\r%d of %d' % (game_counter, total_games))
-            sys.stdout.flush()
-
-            game_result = _play_game(engine1_path, engine2_path, log_filename)
-            match[game_result] += 1
-            game_counter += 1
-
-        if match[ENGINE1] > match[ENGINE2]:
-            match_score[ENGINE1] += 1.0
-        elif match[ENGINE1] < match[ENGINE2]:
-            match_score[ENGINE2] += 1.0
-        else:
-            match_score[ENGINE1] += 0.5
-            match_score[ENGINE2] += 0.5
-        matches.append(match)
+
+    if duplicate and seed is None:
+        # both games of a pair must get the same deal, even in different
+        # worker processes
+        seed = Random().getrandbits(32)
+        # printed, so the games can be played again with --seed
+        sys.stdout.write('Seed: %d\n' % seed)
+
+    started_at = time.time()
+    results = []
+    if not log_filename:
+        log_writer = None
+    elif compress_log:
+        log_writer = CompressedLogWriter(log_filename)
+    else:
+        log_writer = LogWriter(log_filename)
+    engine1_time_stats = TimeStats()
+    engine2_time_stats = TimeStats()
+    game_results = _iter_game_results(
+        (engine1_path, engine2_path, bool(log_filename), seed, duplicate,
+         time_control),
+        total_games,
+        jobs,
+        concurrency
+    )
+    try:
+        for _ in xrange(matches_number):
+            match = Counter()
+            for __ in xrange(match_size):
+                sys.stdout.write('\r%d of %d' % (game_counter, total_games))
+                sys.stdout.flush()
+
+                game_result, game_log, time_stats = next(game_results)
+                engine1_time_stats.update(time_stats[0])
+                engine2_time_stats.update(time_stats[1])
+                if log_writer is not None:
+                    log_writer.write(game_log)
+                match[game_result] += 1
+                results.append(game_result)
+                game_counter += 1
+
+                if sprt is not None:
+                    _update_sprt(sprt, results, duplicate)
+                    if sprt.decision is not None:
+                        break
+
+            if match[ENGINE1] > match[ENGINE2]:
+                match_score[ENGINE1] += 1.0
+            elif match[ENGINE1] < match[ENGINE2]:
+                match_score[ENGINE2] += 1.0
+            else:
+                match_score[ENGINE1] += 0.5
+                match_score[ENGINE2] += 0.5
+            matches.append(match)
+
+            if sprt is not None and sprt.decision is not None:
+                break
+    finally:
+        # the workers and the engines are stopped even after an exception
+        # or KeyboardInterrupt
+        game_results.close()
+        if log_writer is not None:
+            log_writer.close()
 
     sys.stdout.write('\n')
     sys.stdout.write(
@@ -159,6 +551,65 @@ def _do_autoplay(engine1_path, engine2_path, matches_number, match_size,
             )
         )
 
+    sys.stdout.write('\n')
+    _write_time_stats('Engine1', engine1_time_stats)
+    _write_time_stats('Engine2', engine2_time_stats)
+
+    if duplicate:
+        sys.stdout.write('\n')
+        _write_pairs_summary(results)
+
+    if sprt is not None:
+        sys.stdout.write('\n')
+        _write_sprt_summary(sprt, len(results), total_games)
+
+    wall_time = time.time() - started_at
+    if latency:
+        sys.stdout.write('\nWall time: %.1f s\n' % wall_time)
+        _write_latency_stats('Engine1', engine1_time_stats)
+        _write_latency_stats('Engine2', engine2_time_stats)
+
+    if latency_filename:
+        _dump_latency_stats(
+            latency_filename,
+            (engine1_path, engine2_path),
+            (engine1_time_stats, engine2_time_stats),
+            len(results),
+            wall_time
+        )
+
+
+def _parse_seed(seed):
+    if seed is None:
+        return None
+    return int(seed)
+
+
+def _parse_sprt(bounds):
+    if bounds is None:
+        return None
+    try:
+        args = map(float, bounds.split(','))
+        if len(args) not in (2, 4):
+            raise ValueError('elo0,elo1[,alpha,beta] expected')
+        return SPRT(*args)
+    except ValueError as e:
+        sys.exit('Invalid --sprt "%s": %s' % (bounds, e))
+
+
+def _parse_time(seconds):
+    if seconds is None:
+        return None
+    return float(seconds)
+
+
+def _parse_time_control(arguments):
+    move_time = _parse_time(arguments['--move-time'])
+    game_time = _parse_time(arguments['--game-time'])
+    if move_time is None and game_time is None:
+        return None
+    return TimeControl(move_time, game_time, float(arguments['--increment']))
+
 
 def main():
     arguments = docopt(__doc__, version='Durak Autoplay v0.1')
@@ -166,12 +617,26 @@ def main():
     if arguments['--debug']:
         logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
+    jobs = int(arguments['--jobs'])
+    concurrency = int(arguments['--concurrency'])
+    if jobs > 1 and concurrency > 1:
+        sys.exit('--jobs and --concurrency can not be used together')
+
     _do_autoplay(
         arguments['<path_to_engine1>'],
         arguments['<path_to_engine2>'],
         int(arguments['--matches-number']),
         int(arguments['--match-size']),
         os.path.expanduser(arguments.get('--log-file') or ''),
+        jobs,
+        _parse_seed(arguments['--seed']),
+        arguments['--duplicate'],
+        _parse_sprt(arguments['--sprt']),
+        concurrency,
+        _parse_time_control(arguments),
+        arguments['--latency'],
+        os.path.expanduser(arguments.get('--latency-file') or ''),
+        arguments['--compress-log'],
     )
 
 
@@ -1,14 +1,53 @@
 # -*- coding: utf-8 -*-
-from random import SystemRandom
+from collections import namedtuple
+from functools import wraps
+from itertools import combinations
+from random import Random, SystemRandom
 
 from durak.controller import exceptions as exes
 from durak.gamelogger import GameLogger
-from durak.utils.cards import DurakCard, CardSet
+from durak.utils.cards import BitCardSet, DurakCard, CardSet
 
 
 random = SystemRandom()
 
 
+# Everything GameController needs to continue a game, see
+# GameController.snapshot. Cards of the players are masks for BitCardSet and
+# frozensets otherwise, the other card collections are tuples, to_move and
+# winner are GameController.PLAYER1 or PLAYER2 (winner can be None).
+GameSnapshot = namedtuple('GameSnapshot', [
+    'state',
+    'trump',
+    'deck',
+    'player1_cards',
+    'player2_cards',
+    'to_move',
+    'on_table',
+    'given_more',
+    'discarded',
+    'no_response',
+    'winner',
+])
+
+
+def _undoable(method):
+    # with undo_enabled the state before a successful call is saved for
+    # GameController.undo, a call that raises anything saves nothing
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._undo_enabled:
+            return method(self, *args, **kwargs)
+
+        self._undo_stack.append(self.snapshot())
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            self._undo_stack.pop()
+            raise
+    return wrapper
+
+
 class Player(object):
 
     def __init__(self, name=''):
@@ -44,7 +83,12 @@ class GameController(object):
         GIVING_MORE = 'giving_more'
 
     def __init__(self, player1_name='', player2_name='', log_filename='',
-                 overwrite_log=False):
+                 overwrite_log=False, card_set_class=CardSet, seed=None,
+                 log_enabled=True, undo_enabled=False, log_writer=None):
+        self._card_set_class = card_set_class
+        self._mask_cards = issubclass(card_set_class, BitCardSet)
+        self._random = None
+        self.set_seed(seed)
         self._player1 = Player(player1_name)
         self._player2 = Player(player2_name)
         self._winner = None
@@ -52,14 +96,40 @@ class GameController(object):
 
         self._log_filename = log_filename
         self._overwrite_log = overwrite_log
+        # durak.gamelogger.LogWriter, which gets the logs instead of
+        # log_filename
+        self._log_writer = log_writer
         self._logger = GameLogger()
-        self._logger_enabled = True
+        self._logger_enabled = log_enabled
+
+        self._undo_enabled = undo_enabled
+        self._undo_stack = []
+
+        # caches of legal_cards and legal_actions for the current state
+        self._legal_cards = None
+        self._legal_actions = None
+
+    def set_seed(self, seed):
+        # with a seed the deals are reproducible, without it (None) the
+        # module-level SystemRandom is used, so forked processes (autoplay
+        # --jobs workers) do not deal the same decks
+        if seed is None:
+            self._random = None
+        else:
+            self._random = Random(seed)
+
+    def _get_random(self):
+        if self._random is None:
+            return random
+        return self._random
 
     def start_new_game(self, ignore_winner=True):
-        self._deck = list(DurakCard.all())
-        random.shuffle(self._deck)
+        self._reset_legal_actions()
+        self._deck = sorted(DurakCard.all())
+        self._get_random().shuffle(self._deck)
         self._trump = self._deck[-1]
 
+        self._undo_stack = []
         self._logger.reset()
         if self._logger_enabled:
             self._logger.log_before_game(
@@ -69,8 +139,10 @@ class GameController(object):
                 self._trump
             )
 
-        self._player1.cards = CardSet(cards=self._deck[:6], trump=self._trump)
-        self._player2.cards = CardSet(
+        self._player1.cards = self._card_set_class(
+            cards=self._deck[:6], trump=self._trump
+        )
+        self._player2.cards = self._card_set_class(
             cards=self._deck[6:12], trump=self._trump
         )
         self._deck = self._deck[12:]
@@ -96,11 +168,14 @@ class GameController(object):
             )
 
         return {
-            'player1_cards': CardSet(self._player1.cards, trump=self._trump),
-            'player2_cards': CardSet(self._player2.cards, trump=self._trump),
+            'player1_cards': self._copy_cards(self._player1.cards),
+            'player2_cards': self._copy_cards(self._player2.cards),
             'trump': DurakCard(self._trump),
         }
 
+    def _copy_cards(self, cards):
+        return self._card_set_class(cards, trump=self._trump)
+
     def _get_first_to_move_by_trump(self):
         lowest_trump1 = self._player1.cards.lowest_trump()
         lowest_trump2 = self._player2.cards.lowest_trump()
@@ -115,30 +190,171 @@ class GameController(object):
         elif lowest_trump1 is not None and lowest_trump2 is None:
             return self._player1
         else:
-            return random.choice([self._player1, self._player2])
+            return self._get_random().choice([self._player1, self._player2])
 
-    def _get_game_data_for(self, player):
-        return {
+    def _get_game_data_for(self, player, new_discarded_from=None):
+        game_data = {
             'trump': str(DurakCard(self._trump)),
             'deck_count': self.deck_count,
             'enemy_count': len(self._get_enemy_of(player).cards),
             'on_table': map(str, self._on_table),
-            'discarded': map(str, self._discarded),
         }
+        if new_discarded_from is None:
+            game_data['discarded'] = map(str, self._discarded)
+        else:
+            # for the discarded_delta engine option, only the cards
+            # discarded after the first new_discarded_from ones
+            game_data['new_discarded'] = map(
+                str, self._discarded[new_discarded_from:]
+            )
+        return game_data
 
-    def get_game_data_for(self, player):
+    def get_game_data_for(self, player, new_discarded_from=None):
         assert player in (
             self.MOVER, self.RESPONDER, self.PLAYER1, self.PLAYER2
         )
 
+        return self._get_game_data_for(
+            self._get_player(player), new_discarded_from
+        )
+
+    def get_state_for(self, player):
+        # The same as get_game_data_for plus the cards of the player, but
+        # the cards are not converted to strings and nothing is copied, so
+        # the result must not be modified. For Python code that plays
+        # without the engine protocol, e.g. durak.sim.
+        assert player in (
+            self.MOVER, self.RESPONDER, self.PLAYER1, self.PLAYER2
+        )
+
+        player = self._get_player(player)
+        return {
+            'trump': self._trump,
+            'cards': player.cards,
+            'deck_count': len(self._deck),
+            'enemy_count': len(self._get_enemy_of(player).cards),
+            'on_table': self._on_table,
+            'discarded': self._discarded,
+        }
+
+    def legal_cards(self):
+        # Cards that the player to act can play now: moves in MOVING, cards
+        # that beat the last card in RESPONDING, cards to give more in
+        # GIVING_MORE (in CardSet.sorted_cards order), nothing in DEALING
+        # and when the game is over. Cached until the state changes, must
+        # not be modified.
+        if self._legal_cards is None:
+            self._legal_cards = self._get_legal_cards()
+        return self._legal_cards
+
+    def _get_legal_cards(self):
+        if self._state == self.States.MOVING:
+            return self._to_move.cards.cards_that_can_be_added_to(
+                self._on_table
+            )
+        elif self._state == self.States.RESPONDING:
+            return self._to_respond.cards.cards_that_can_beat(
+                self._on_table[-1]
+            )
+        elif self._state == self.States.GIVING_MORE:
+            return self._to_move.cards.cards_that_can_be_added_to(
+                self._on_table
+            )
+        return []
+
+    def legal_actions(self):
+        # Every valid argument of the register_* method for the current
+        # state: cards and None (done or take) for register_move and
+        # register_response, tuples of cards up to the max count (the empty
+        # one too) for register_give_more. Empty in DEALING, when only
+        # deal() is valid, and when the game is over. Cached until the
+        # state changes, must not be modified.
+        if self._legal_actions is None:
+            self._legal_actions = self._get_legal_actions()
+        return self._legal_actions
+
+    def _get_legal_actions(self):
+        cards = self.legal_cards()
+
+        if self._state == self.States.MOVING:
+            if self._on_table:
+                return cards + [None]
+            return cards[:]
+        elif self._state == self.States.RESPONDING:
+            return cards + [None]
+        elif self._state == self.States.GIVING_MORE:
+            max_cards = max(
+                min(len(cards), len(self._to_respond.cards) - 1), 0
+            )
+            return [
+                subset
+                for count in xrange(max_cards + 1)
+                for subset in combinations(cards, count)
+            ]
+        return []
+
+    def _reset_legal_actions(self):
+        self._legal_cards = None
+        self._legal_actions = None
+
+    def snapshot(self):
+        # The state of the game as an immutable GameSnapshot, which can be
+        # restored any number of times. The log is not a part of it, so
+        # controllers for search should be created with log_enabled=False.
+        return GameSnapshot(
+            state=self._state,
+            trump=self._trump,
+            deck=tuple(self._deck),
+            player1_cards=self._freeze_cards(self._player1.cards),
+            player2_cards=self._freeze_cards(self._player2.cards),
+            to_move=self.to_move,
+            on_table=tuple(self._on_table),
+            given_more=frozenset(self._on_table.given_more),
+            discarded=tuple(self._discarded),
+            no_response=self._no_response,
+            winner=self.winner,
+        )
+
+    def restore(self, snapshot):
+        self._reset_legal_actions()
+        self._state = snapshot.state
+        self._trump = snapshot.trump
+        self._deck = list(snapshot.deck)
+        self._player1.cards = self._thaw_cards(snapshot.player1_cards)
+        self._player2.cards = self._thaw_cards(snapshot.player2_cards)
+        self._to_move = self._get_player(snapshot.to_move)
+        self._on_table = Table(snapshot.on_table)
+        self._on_table.given_more = set(snapshot.given_more)
+        self._discarded = list(snapshot.discarded)
+        self._no_response = snapshot.no_response
+        self._winner = self._get_player(snapshot.winner)
+
+    def _freeze_cards(self, cards):
+        if self._mask_cards:
+            return cards.mask
+        return frozenset(cards)
+
+    def _thaw_cards(self, frozen_cards):
+        if self._mask_cards:
+            return self._card_set_class.from_mask(frozen_cards, self._trump)
+        return self._card_set_class(frozen_cards, trump=self._trump)
+
+    def undo(self):
+        # takes back the last register_move, register_response,
+        # register_give_more or deal, needs undo_enabled
+        if not self._undo_stack:
+            raise exes.NothingToUndo
+        self.restore(self._undo_stack.pop())
+
+    def _get_player(self, player):
         if player == self.MOVER:
-            return self._get_game_data_for(self._to_move)
+            return self._to_move
         elif player == self.RESPONDER:
-            return self._get_game_data_for(self._to_respond)
+            return self._to_respond
         elif player == self.PLAYER1:
-            return self._get_game_data_for(self._player1)
+            return self._player1
         elif player == self.PLAYER2:
-            return self._get_game_data_for(self._player2)
+            return self._player2
 
     def _get_enemy_of(self, player):
         assert player in (self._player1, self._player2)
@@ -155,7 +371,9 @@ class GameController(object):
     def is_player1_to_move(self):
         return (self._to_move is self._player1)
 
+    @_undoable
     def register_move(self, card):
+        self._reset_legal_actions()
         if self._state != self.States.MOVING:
             raise exes.InvalidAction(
                 expected=self._state, got=self.States.MOVING
@@ -171,8 +389,7 @@ class GameController(object):
         if card not in self._to_move.cards:
             raise exes.PlayerDoesNotHaveCard(card)
 
-        if card not in (self._to_move.cards
-                            .cards_that_can_be_added_to(self._on_table)):
+        if not card.can_be_added_to(self._on_table):
             raise exes.InvalidCard(
                 'Can not move with card %s (on table: %s)' % (
                     card, self._on_table
@@ -185,7 +402,9 @@ class GameController(object):
 
         self._check_for_game_over()
 
+    @_undoable
     def register_response(self, card):
+        self._reset_legal_actions()
         if self._state != self.States.RESPONDING:
             raise exes.InvalidAction(
                 expected=self._state, got=self.States.RESPONDING
@@ -205,8 +424,7 @@ class GameController(object):
         if card not in self._to_respond.cards:
             raise exes.PlayerDoesNotHaveCard(card)
 
-        if card not in (self._to_respond.cards
-                            .cards_that_can_beat(card_to_beat)):
+        if not card.can_beat(card_to_beat, self._trump):
             raise exes.InvalidCard(
                 'Card %s can not beat card %s (trump is %s)' % (
                     card, card_to_beat, self._trump
@@ -223,7 +441,9 @@ class GameController(object):
 
         self._check_for_game_over()
 
+    @_undoable
     def register_give_more(self, cards):
+        self._reset_legal_actions()
         assert self._no_response
 
         if self._state != self.States.GIVING_MORE:
@@ -245,10 +465,9 @@ class GameController(object):
         if invalid_cards:
             raise exes.PlayerDoesNotHaveCard(*invalid_cards)
 
-        allowed_cards = self._to_move.cards.cards_that_can_be_added_to(
-            self._on_table
-        )
-        invalid_cards = cards - set(allowed_cards)
+        invalid_cards = {
+            x for x in cards if not x.can_be_added_to(self._on_table)
+        }
         if invalid_cards:
             raise exes.InvalidCard(
                 'Can not give more cards %s (on table: %s)' % (
@@ -263,7 +482,9 @@ class GameController(object):
 
         self._check_for_game_over()
 
+    @_undoable
     def deal(self):
+        self._reset_legal_actions()
         if self._state != self.States.DEALING:
             raise exes.InvalidAction(
                 expected=self._state, got=self.States.DEALING
@@ -275,8 +496,8 @@ class GameController(object):
                 self._on_table.given_more
             )
 
-        player1_cards_before = CardSet(self._player1.cards, trump=self._trump)
-        player2_cards_before = CardSet(self._player2.cards, trump=self._trump)
+        player1_cards_before = self._copy_cards(self._player1.cards)
+        player2_cards_before = self._copy_cards(self._player2.cards)
 
         if self._no_response:
             self._to_respond.cards.update(self._on_table)
@@ -311,12 +532,10 @@ class GameController(object):
 
         return {
             'player1_cards': (
-                CardSet(self._player1.cards, trump=self._trump) -
-                player1_cards_before
+                self._copy_cards(self._player1.cards) - player1_cards_before
             ),
             'player2_cards': (
-                CardSet(self._player2.cards, trump=self._trump) -
-                player2_cards_before
+                self._copy_cards(self._player2.cards) - player2_cards_before
             ),
         }
 
@@ -345,19 +564,49 @@ class GameController(object):
         elif not self._player2.cards:
             self._winner = self._player2
 
+        self._finish_game()
+
+    def register_loss_on_time(self, player):
+        # the player has run out of time, so the game is over and the
+        # enemy wins
+        self._register_loss(player, lost_on_time=True)
+
+    def register_forfeit(self, player):
+        # the player can't go on playing (e.g. its engine has written an
+        # invalid output), so the game is over and the enemy wins
+        self._register_loss(player, forfeited=True)
+
+    def _register_loss(self, player, **reason):
+        assert player in (
+            self.MOVER, self.RESPONDER, self.PLAYER1, self.PLAYER2
+        )
+
+        if self.is_game_over():
+            raise exes.InvalidAction(expected=None, got=self._state)
+
+        self._reset_legal_actions()
+        self._winner = self._get_enemy_of(self._get_player(player))
+        self._finish_game(**reason)
+
+    def _finish_game(self, lost_on_time=False, forfeited=False):
         self._state = None
 
         if self._logger_enabled:
-            if self._on_table:
+            if self._on_table or lost_on_time or forfeited:
                 self._logger.log_after_move(
                     self._on_table, self._on_table.given_more
                 )
-            self._logger.log_after_game(self.winner)
-            if self._log_filename:
+            self._logger.log_after_game(self.winner, lost_on_time, forfeited)
+            if self._log_writer is not None:
+                self._log_writer.write(self._logger.dumps())
+            elif self._log_filename:
                 self._logger.write_to_file(
                     self._log_filename, self._overwrite_log
                 )
 
+    def dump_log(self):
+        return self._logger.dumps()
+
     @property
     def state(self):
         return self._state
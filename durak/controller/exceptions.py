@@ -17,6 +17,10 @@ class CardIsExpected(GameControllerError):
     pass
 
 
+class NothingToUndo(GameControllerError):
+    pass
+
+
 class PlayerDoesNotHaveCard(GameControllerError):
 
     def __init__(self, *args):
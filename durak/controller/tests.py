@@ -3,7 +3,7 @@ import unittest
 
 from mock import patch
 
-from durak.utils.cards import DurakCard, CardSet
+from durak.utils.cards import BitCardSet, DurakCard, CardSet
 from durak.controller import Table, GameController
 import durak.controller.exceptions as exes
 
@@ -169,6 +169,17 @@ class GameControllerTest(unittest.TestCase):
                 'discarded': map(str, controller._discarded),
             }
         )
+        self.assertDictEqual(
+            controller._get_game_data_for(
+                controller._player1, new_discarded_from=1
+            ), {
+                'trump': str(controller._trump),
+                'deck_count': len(controller._deck),
+                'enemy_count': len(controller._player2.cards),
+                'on_table': map(str, controller._on_table),
+                'new_discarded': ['QS'],
+            }
+        )
 
     def test_game_data_for_public(self):
         controller = GameController()
@@ -201,6 +212,301 @@ class GameControllerTest(unittest.TestCase):
             controller._get_game_data_for(controller._player2)
         )
 
+    def test_get_state_for(self):
+        controller = GameController()
+        controller._trump = DurakCard('6H')
+        controller._deck = [DurakCard('7S'), DurakCard('8D')]
+        controller._on_table = [DurakCard('9C'), DurakCard('TH')]
+        controller._discarded = [DurakCard('JD'), DurakCard('QS')]
+        controller._player1.cards = CardSet(
+            cards=(DurakCard('AC'), DurakCard('8S'), DurakCard('KS')),
+            trump=controller._trump
+        )
+        controller._player2.cards = CardSet(
+            cards=(DurakCard('KD'),), trump=controller._trump
+        )
+        controller._to_move = controller._player2
+
+        state = controller.get_state_for(controller.RESPONDER)
+        self.assertDictEqual(state, {
+            'trump': controller._trump,
+            'cards': controller._player1.cards,
+            'deck_count': 2,
+            'enemy_count': 1,
+            'on_table': controller._on_table,
+            'discarded': controller._discarded,
+        })
+        self.assertIs(state['cards'], controller._player1.cards)
+
+    def test_log_enabled(self):
+        self.assertTrue(GameController()._logger_enabled)
+        self.assertFalse(GameController(log_enabled=False)._logger_enabled)
+
+        controller = GameController(log_enabled=False)
+        with patch.object(controller, '_logger') as logger_mock:
+            controller.start_new_game()
+            self.assertFalse([
+                call for call in logger_mock.method_calls
+                if call[0].startswith('log_')
+            ])
+
+    def _get_full_state(self, controller):
+        return (
+            controller._state,
+            controller._trump,
+            list(controller._deck),
+            set(controller._player1.cards),
+            set(controller._player2.cards),
+            controller._to_move,
+            list(controller._on_table),
+            set(controller._on_table.given_more),
+            list(controller._discarded),
+            controller._no_response,
+            controller._winner,
+        )
+
+    def _play_lowest_card(self, controller):
+        # one action of DummyEngine-like play
+        state = controller.state
+        if state == controller.States.MOVING:
+            cards = controller._to_move.cards.cards_that_can_be_added_to(
+                controller._on_table
+            )
+            controller.register_move(cards[0] if cards else None)
+        elif state == controller.States.RESPONDING:
+            cards = controller._to_respond.cards.cards_that_can_beat(
+                controller._on_table[-1]
+            )
+            controller.register_response(cards[0] if cards else None)
+        elif state == controller.States.GIVING_MORE:
+            controller.register_give_more(
+                controller._to_move.cards.cards_that_can_be_added_to(
+                    controller._on_table
+                )[:len(controller._to_respond.cards) - 1]
+            )
+        elif state == controller.States.DEALING:
+            controller.deal()
+
+    def test_snapshot_and_restore(self):
+        for card_set_class in (CardSet, BitCardSet):
+            controller = GameController(
+                card_set_class=card_set_class, seed=1, log_enabled=False
+            )
+            controller.start_new_game()
+            snapshots = []
+            while not controller.is_game_over():
+                snapshots.append(
+                    (controller.snapshot(), self._get_full_state(controller))
+                )
+                self._play_lowest_card(controller)
+            final_state = self._get_full_state(controller)
+
+            for snapshot, expected_state in reversed(snapshots):
+                controller.restore(snapshot)
+                self.assertEqual(
+                    self._get_full_state(controller), expected_state
+                )
+                self.assertIsInstance(
+                    controller._player1.cards, card_set_class
+                )
+
+            # a snapshot can be restored many times
+            controller.restore(snapshots[0][0])
+            while not controller.is_game_over():
+                self._play_lowest_card(controller)
+            self.assertEqual(self._get_full_state(controller), final_state)
+            controller.restore(snapshots[0][0])
+            self.assertEqual(
+                self._get_full_state(controller), snapshots[0][1]
+            )
+
+    def test_snapshot_does_not_share_the_deck(self):
+        controller = GameController(seed=1, log_enabled=False)
+        controller.start_new_game()
+        snapshot = controller.snapshot()
+        self.assertIsInstance(snapshot.deck, tuple)
+
+        controller.restore(snapshot)
+        controller._deck.pop()
+        self.assertEqual(len(snapshot.deck), 24)
+
+    def test_undo(self):
+        controller = GameController(
+            card_set_class=BitCardSet, seed=2, log_enabled=False,
+            undo_enabled=True
+        )
+        controller.start_new_game()
+        states = []
+        while not controller.is_game_over():
+            states.append(self._get_full_state(controller))
+            self._play_lowest_card(controller)
+
+        while states:
+            controller.undo()
+            self.assertEqual(self._get_full_state(controller), states.pop())
+
+        with self.assertRaises(exes.NothingToUndo):
+            controller.undo()
+
+    def test_undo_is_disabled_by_default(self):
+        controller = GameController()
+        controller.start_new_game()
+        controller.register_move(controller._to_move.cards.sorted_cards()[0])
+        with self.assertRaises(exes.NothingToUndo):
+            controller.undo()
+
+    def test_failed_action_is_not_undone(self):
+        controller = GameController(undo_enabled=True)
+        controller.start_new_game()
+        card = controller._to_move.cards.sorted_cards()[0]
+        controller.register_move(card)
+        with self.assertRaises(exes.InvalidAction):
+            controller.register_move(card)
+
+        controller.undo()
+        self.assertIn(card, controller._to_move.cards)
+        with self.assertRaises(exes.NothingToUndo):
+            controller.undo()
+
+    def test_action_with_any_exception_is_not_undone(self):
+        controller = GameController(undo_enabled=True)
+        controller.start_new_game()
+        card = controller._to_move.cards.sorted_cards()[0]
+        controller.register_move(card)
+        with self.assertRaises(AssertionError):
+            controller.register_give_more([])
+
+        controller.undo()
+        self.assertIn(card, controller._to_move.cards)
+        with self.assertRaises(exes.NothingToUndo):
+            controller.undo()
+
+    def test_start_new_game_clears_undo(self):
+        controller = GameController(undo_enabled=True)
+        controller.start_new_game()
+        controller.register_move(controller._to_move.cards.sorted_cards()[0])
+        controller.start_new_game()
+        with self.assertRaises(exes.NothingToUndo):
+            controller.undo()
+
+    def _set_up_legal_actions(self, state):
+        controller = GameController()
+        controller._trump = DurakCard('6H')
+        controller._deck = []
+        controller._state = state
+        controller._to_move = controller._player1
+        controller._player1.cards = CardSet(
+            cards=(
+                DurakCard('7S'), DurakCard('7C'), DurakCard('7H'),
+                DurakCard('8D'),
+            ),
+            trump=controller._trump
+        )
+        controller._player2.cards = CardSet(
+            cards=(DurakCard('9S'), DurakCard('6H'), DurakCard('AC')),
+            trump=controller._trump
+        )
+        controller._on_table = Table()
+        return controller
+
+    def test_legal_actions_moving_on_empty_table(self):
+        controller = self._set_up_legal_actions(GameController.States.MOVING)
+        self.assertEqual(
+            controller.legal_actions(),
+            [
+                DurakCard('7C'), DurakCard('7S'), DurakCard('8D'),
+                DurakCard('7H'),
+            ]
+        )
+        self.assertEqual(controller.legal_cards(), controller.legal_actions())
+
+    def test_legal_actions_moving(self):
+        controller = self._set_up_legal_actions(GameController.States.MOVING)
+        controller._on_table = Table([DurakCard('7D'), DurakCard('9D')])
+        self.assertEqual(
+            controller.legal_actions(),
+            [DurakCard('7C'), DurakCard('7S'), DurakCard('7H'), None]
+        )
+
+    def test_legal_actions_responding(self):
+        controller = self._set_up_legal_actions(
+            GameController.States.RESPONDING
+        )
+        controller._on_table = Table([DurakCard('7S')])
+        self.assertEqual(
+            controller.legal_actions(),
+            [DurakCard('9S'), DurakCard('6H'), None]
+        )
+
+    def test_legal_actions_giving_more(self):
+        controller = self._set_up_legal_actions(
+            GameController.States.GIVING_MORE
+        )
+        controller._on_table = Table([DurakCard('7D')])
+        seven_c, seven_s, seven_h = (
+            DurakCard('7C'), DurakCard('7S'), DurakCard('7H')
+        )
+        # the responder has 3 cards, so at most 2 can be given
+        self.assertEqual(
+            controller.legal_actions(),
+            [
+                (),
+                (seven_c,), (seven_s,), (seven_h,),
+                (seven_c, seven_s), (seven_c, seven_h), (seven_s, seven_h),
+            ]
+        )
+
+    def test_legal_actions_dealing_and_game_over(self):
+        controller = self._set_up_legal_actions(GameController.States.DEALING)
+        self.assertEqual(controller.legal_actions(), [])
+        self.assertEqual(controller.legal_cards(), [])
+
+        controller = self._set_up_legal_actions(None)
+        self.assertEqual(controller.legal_actions(), [])
+
+    def test_legal_actions_are_cached_until_state_changes(self):
+        controller = GameController(seed=1)
+        controller.start_new_game()
+        legal_actions = controller.legal_actions()
+        self.assertIs(controller.legal_actions(), legal_actions)
+        self.assertIs(controller.legal_cards(), controller.legal_cards())
+
+        controller.register_move(legal_actions[0])
+        self.assertIsNot(controller.legal_actions(), legal_actions)
+        self.assertEqual(
+            controller.legal_actions(),
+            controller._to_respond.cards.cards_that_can_beat(
+                legal_actions[0]
+            ) + [None]
+        )
+
+    def test_every_legal_action_is_valid(self):
+        for seed in xrange(20):
+            controller = GameController(
+                card_set_class=BitCardSet, seed=seed, log_enabled=False,
+                undo_enabled=True
+            )
+            controller.start_new_game()
+            register = {
+                controller.States.MOVING: controller.register_move,
+                controller.States.RESPONDING: controller.register_response,
+                controller.States.GIVING_MORE: (
+                    controller.register_give_more
+                ),
+            }
+            while not controller.is_game_over():
+                if controller.state == controller.States.DEALING:
+                    controller.deal()
+                    continue
+
+                legal_actions = controller.legal_actions()
+                for action in legal_actions:
+                    register[controller.state](action)
+                    controller.undo()
+                register[controller.state](
+                    legal_actions[seed % len(legal_actions)]
+                )
+
     def test_start_new_game_players_and_deck_cards(self):
         controller = GameController()
         controller.start_new_game()
@@ -216,7 +522,44 @@ class GameControllerTest(unittest.TestCase):
         controller = GameController()
         with patch('durak.controller.random') as random_mock:
             controller.start_new_game()
-            random_mock.shuffle.assert_called_once_with(list(DurakCard.all()))
+            random_mock.shuffle.assert_called_once_with(
+                sorted(DurakCard.all())
+            )
+
+    def test_start_new_game_with_seed_is_reproducible(self):
+        controller1 = GameController(seed=42)
+        controller2 = GameController(seed=42)
+        for _ in xrange(3):
+            result1 = controller1.start_new_game()
+            result2 = controller2.start_new_game()
+            self.assertEqual(controller1._deck, controller2._deck)
+            self.assertEqual(result1, result2)
+
+        controller1.set_seed(7)
+        controller2.set_seed(7)
+        controller1.start_new_game()
+        controller2.start_new_game()
+        self.assertEqual(controller1._deck, controller2._deck)
+
+    def test_seeded_controller_does_not_use_module_random(self):
+        controller = GameController(seed=42)
+        with patch('durak.controller.random') as random_mock:
+            controller.start_new_game()
+            self.assertFalse(random_mock.shuffle.called)
+
+        controller.set_seed(None)
+        with patch('durak.controller.random') as random_mock:
+            controller.start_new_game()
+            self.assertTrue(random_mock.shuffle.called)
+
+    def test_start_new_game_uses_card_set_class(self):
+        controller = GameController(card_set_class=BitCardSet)
+        result = controller.start_new_game()
+
+        self.assertTrue(isinstance(controller._player1.cards, BitCardSet))
+        self.assertTrue(isinstance(controller._player2.cards, BitCardSet))
+        self.assertTrue(isinstance(result['player1_cards'], BitCardSet))
+        self.assertEqual(result['player1_cards'], controller._player1.cards)
 
     def test_if_winner_is_none_first_move_is_selected_by_trump(self):
         controller = GameController()
@@ -338,6 +681,50 @@ class GameControllerTest(unittest.TestCase):
         self.assertTrue(controller._state is None)
         self.assertEqual(controller._winner, controller._player2)
 
+    def test_register_loss_on_time(self):
+        controller = GameController()
+        controller.start_new_game()
+        controller.register_move(
+            controller._to_move.cards.sorted_cards()[0]
+        )
+
+        controller.register_loss_on_time(controller.RESPONDER)
+
+        self.assertTrue(controller.is_game_over())
+        self.assertEqual(controller._winner, controller._to_move)
+        log = controller._logger._log
+        self.assertTrue(log['lost_on_time'])
+        self.assertEqual(len(log['moves'][-1]['moves_and_responds']), 1)
+
+        with self.assertRaises(exes.InvalidAction):
+            controller.register_loss_on_time(controller.PLAYER1)
+
+    def test_register_forfeit(self):
+        controller = GameController()
+        controller.start_new_game()
+
+        controller.register_forfeit(controller.PLAYER2)
+
+        self.assertTrue(controller.is_game_over())
+        self.assertEqual(controller.winner, controller.PLAYER1)
+        log = controller._logger._log
+        self.assertTrue(log['forfeited'])
+        self.assertFalse('lost_on_time' in log)
+
+        with self.assertRaises(exes.InvalidAction):
+            controller.register_forfeit(controller.PLAYER1)
+
+    def test_register_loss_on_time_before_first_move(self):
+        controller = GameController()
+        controller.start_new_game()
+
+        controller.register_loss_on_time(controller.PLAYER1)
+
+        self.assertEqual(controller.winner, controller.PLAYER2)
+        log = controller._logger._log
+        self.assertEqual(log['moves'][-1]['moves_and_responds'], [])
+        self.assertEqual(log['result'], '0-1')
+
     def test_register_move_is_error_if_state_is_not_moving(self):
         controller = GameController()
         controller._state = controller.States.RESPONDING
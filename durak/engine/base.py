@@ -2,8 +2,28 @@
 import json
 import sys
 
+from durak.engine import compact
+
 
 class BaseEngine(object):
+    # protocol options the engine can accept, see docs/README.md
+    SUPPORTED_OPTIONS = ()
+
+    SESSION = 'session'
+    NO_GAMEDATA = 'no_gamedata'
+    DISCARDED_DELTA = 'discarded_delta'
+    COMPACT = 'compact'
+
+    # options handled by BaseEngine itself, whatever the subclass supports
+    BUILTIN_OPTIONS = (DISCARDED_DELTA, COMPACT)
+
+    # commands with cards in the output
+    CARDS_OUTPUT_COMMANDS = ('move', 'respond', 'give_more')
+
+    # options accepted in the last init
+    _options = frozenset()
+    # discarded cards of the current game, for the discarded_delta option
+    _discarded = ()
 
     def init(self, trump):
         raise NotImplementedError
@@ -22,11 +42,24 @@ class BaseEngine(object):
 
     def run(self):
         while True:
-            line = sys.stdin.readline().strip()
-            command_name, args, gamedata = self._parse_line(line)
+            line = sys.stdin.readline()
+            if not line:  # stdin is closed
+                return
+
+            line = line.strip()
+            is_compact = (
+                self.COMPACT in self._options and
+                line[:1] in compact.COMMAND_NAMES
+            )
+            if is_compact:
+                command_name, args, gamedata = self._parse_compact_line(line)
+            else:
+                command_name, args, gamedata = self._parse_line(line)
+            if 'new_discarded' in gamedata:
+                gamedata = self._expand_discarded(gamedata)
 
             if command_name == 'init':
-                output = self.init(args[0])
+                output = self._init(args[0], gamedata.get('options', []))
             elif command_name == 'deal':
                 output = self.deal(args, gamedata=gamedata)
             elif command_name == 'move':
@@ -36,20 +69,52 @@ class BaseEngine(object):
             elif command_name == 'give_more':
                 output = self.give_more(args, gamedata=gamedata)
             elif command_name == 'game_end':
+                if self.SESSION not in self._options:
+                    return
+                output = None
+            elif command_name == 'quit':
                 return
             else:
                 output = u'Error: Unknown command "%s"' % command_name
 
-            self._output(output)
+            if is_compact and command_name in self.CARDS_OUTPUT_COMMANDS:
+                output = compact.encode_card_strings(str(output).split())
+
+            if output is not None:
+                self._output(output)
 
             if hasattr(self, 'only_one_iteration'):  # for unit testing
                 break
 
+    def _init(self, trump, requested_options):
+        output = self.init(trump)
+
+        self._options = set(requested_options) & (
+            set(self.SUPPORTED_OPTIONS) | set(self.BUILTIN_OPTIONS)
+        )
+        self._discarded = []
+        if output == 'ok' and self._options:
+            output = ' '.join(['ok'] + sorted(self._options))
+
+        return output
+
+    def _expand_discarded(self, gamedata):
+        # with discarded_delta only the cards discarded since the previous
+        # command are sent, the engine methods still get the full list
+        self._discarded.extend(gamedata.pop('new_discarded'))
+        gamedata['discarded'] = list(self._discarded)
+        return gamedata
+
     @staticmethod
     def _output(data):
         sys.stdout.write(str(data) + '\n')
         sys.stdout.flush()
 
+    def _parse_compact_line(self, line):
+        if self.DISCARDED_DELTA in self._options:
+            return compact.decode_command(line, 'new_discarded')
+        return compact.decode_command(line)
+
     @staticmethod
     def _parse_line(line):
         if '##' in line:
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Encoders and decoders for the "compact" protocol option, see
+# docs/README.md. Every card is one printable byte, gamedata is a line of
+# fixed fields, so there is no json and no splitting on the hot path.
+#
+# Command: <code><cards>[|<trump><deck><enemy><on_table>|<discarded>]
+# Output:  <cards> for move, respond and give_more, "ok" for deal
+#
+# The lines are still separated by "\n", which is never used by the encoding.
+from durak.utils.cards import CARDS_BY_ORDINAL, DurakCard
+
+
+BYTE_OFFSET = ord('0')
+FIELDS_SEPARATOR = '|'
+
+COMMAND_CODES = {
+    'deal': 'D',
+    'move': 'M',
+    'respond': 'R',
+    'give_more': 'G',
+}
+COMMAND_NAMES = dict((code, name) for name, code in COMMAND_CODES.items())
+
+_BYTE_TO_STRING = dict(
+    (chr(BYTE_OFFSET + ordinal), str(card))
+    for ordinal, card in enumerate(CARDS_BY_ORDINAL)
+)
+_STRING_TO_BYTE = dict(
+    (string, byte) for byte, string in _BYTE_TO_STRING.items()
+)
+
+
+def encode_count(count):
+    return chr(BYTE_OFFSET + count)
+
+
+def decode_count(byte):
+    return ord(byte) - BYTE_OFFSET
+
+
+def encode_cards(cards):
+    # cards are DurakCard instances or their string representations
+    return ''.join(
+        chr(BYTE_OFFSET + DurakCard(card).ordinal) for card in cards
+    )
+
+
+def encode_card_strings(cards):
+    # faster version of encode_cards for string representations only
+    return ''.join(map(_STRING_TO_BYTE.__getitem__, cards))
+
+
+def decode_cards(data):
+    # returns string representations, as the text protocol does
+    return map(_BYTE_TO_STRING.__getitem__, data)
+
+
+def encode_gamedata(gamedata, discarded_key='discarded'):
+    return (
+        encode_cards([gamedata['trump']]) +
+        encode_count(gamedata['deck_count']) +
+        encode_count(gamedata['enemy_count']) +
+        encode_cards(gamedata['on_table']) +
+        FIELDS_SEPARATOR +
+        encode_cards(gamedata[discarded_key])
+    )
+
+
+def decode_gamedata(data, discarded_key='discarded'):
+    head, discarded = data.split(FIELDS_SEPARATOR)
+    return {
+        'trump': _BYTE_TO_STRING[head[0]],
+        'deck_count': decode_count(head[1]),
+        'enemy_count': decode_count(head[2]),
+        'on_table': decode_cards(head[3:]),
+        discarded_key: decode_cards(discarded),
+    }
+
+
+def encode_command(command, cards, gamedata=None, discarded_key='discarded'):
+    line = COMMAND_CODES[command] + encode_cards(cards)
+    if gamedata is not None:
+        line += FIELDS_SEPARATOR + encode_gamedata(gamedata, discarded_key)
+    return line
+
+
+def decode_command(line, discarded_key='discarded'):
+    # returns (command_name, args, gamedata) like BaseEngine._parse_line
+    command_name = COMMAND_NAMES[line[0]]
+    if FIELDS_SEPARATOR in line:
+        cards, gamedata = line[1:].split(FIELDS_SEPARATOR, 1)
+        gamedata = decode_gamedata(gamedata, discarded_key)
+    else:
+        cards = line[1:]
+        gamedata = {}
+    return command_name, decode_cards(cards), gamedata
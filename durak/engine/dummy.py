@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from durak.engine.base import BaseEngine
-from durak.utils.cards import CardSet
+from durak.utils.cards import BitCardSet
 
 
 class DummyEngine(BaseEngine):
+    SUPPORTED_OPTIONS = (BaseEngine.SESSION,)
 
     def init(self, trump):
-        self._cards = CardSet([], trump)
+        self._cards = BitCardSet([], trump)
         return 'ok'
 
     def deal(self, cards, gamedata):
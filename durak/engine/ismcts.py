@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Durak ISMCTS Engine
+
+Information set Monte Carlo tree search, the tree is kept between the
+commands of a game.
+
+Usage:
+  durak-ismcts [--move-time=<seconds>] [--max-nodes=<count>] [--seed=<seed>]
+  durak-ismcts (-h | --help)
+
+Options:
+  -h --help               Show this help.
+  --move-time=<seconds>   Time for one command [default: 0.1].
+  --max-nodes=<count>     Max nodes in the tree [default: 200000].
+  --seed=<seed>           Integer seed to make the engine reproducible.
+
+"""
+# Single observer ISMCTS: every iteration samples the unknown cards (see
+# durak.engine.mc.sample_position and durak.engine.tracker) and walks down
+# one tree of actions of both players, choosing among the actions that are
+# legal in the sample by UCB with availability counts, adds one node and
+# plays the rest of the game out with durak.sim.dummy_policy. Dealing is not
+# a node: the children of a node are the actions after any deal.
+#
+# Actions are integer ids (see get_action_id), and the engine follows the
+# actions of the game in the tree: its own ones and the enemy ones it can
+# see on the table, in discarded and in the dealt cards. So the subtree of
+# the current position is kept with the statistics of the previous
+# searches. If an enemy action can not be told for sure (the cards given
+# more after the engine took may be mixed up with the dealt ones), the tree
+# is dropped.
+from random import Random
+import math
+import time
+
+from docopt import docopt
+
+from durak.controller import GameController
+from durak.engine.base import BaseEngine
+from durak.engine.solver import EndgameSolverMixin
+from durak.engine.mc import register_action, sample_position
+from durak.engine.tracker import CardTracker
+from durak.sim import dummy_policy, play_out
+from durak.utils.cards import (
+    BitCardSet, CARDS_BY_ORDINAL, DurakCard, iter_mask, to_mask
+)
+
+
+# None (done or take) in move and respond
+PASS = len(CARDS_BY_ORDINAL)
+# the flag of give_more actions, the rest is the mask of the cards
+GIVE_MORE = 1 << (PASS + 1)
+
+ENGINE = GameController.PLAYER1
+ENEMY = GameController.PLAYER2
+
+
+def get_action_id(action):
+    # action is one of GameController.legal_actions
+    if action is None:
+        return PASS
+    # DurakCard is a tuple too
+    if isinstance(action, DurakCard):
+        return action.ordinal
+    return GIVE_MORE | to_mask(action)
+
+
+def get_action(action_id):
+    if action_id == PASS:
+        return None
+    if action_id & GIVE_MORE:
+        return tuple(iter_mask(action_id ^ GIVE_MORE))
+    return CARDS_BY_ORDINAL[action_id]
+
+
+class Node(object):
+    # player has made the action, score is the sum of the results (1 for
+    # a win, 0.5 for a draw) for that player
+    __slots__ = ('action', 'player', 'children', 'visits', 'available',
+                 'score')
+
+    def __init__(self, action=None, player=None):
+        self.action = action
+        self.player = player
+        self.children = []
+        self.visits = 0
+        self.available = 0
+        self.score = 0.0
+
+    def get_child(self, action):
+        for child in self.children:
+            if child.action == action:
+                return child
+        return None
+
+
+def count_nodes(node):
+    count = 0
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        count += 1
+        nodes.extend(node.children)
+    return count
+
+
+class ISMCTSEngine(EndgameSolverMixin, BaseEngine):
+    SUPPORTED_OPTIONS = (BaseEngine.SESSION,)
+
+    # see MonteCarloEngine.ENDGAME_SOLVER_CARDS
+    ENDGAME_SOLVER_CARDS = 10
+    EXPLORATION = 0.7
+
+    def __init__(self, move_time=0.1, max_nodes=200000, seed=None):
+        self.move_time = move_time
+        self.max_nodes = max_nodes
+        self._random = Random(seed)
+        self._controller = GameController(
+            card_set_class=BitCardSet, log_enabled=False
+        )
+        self._cards = None
+        self._root = None
+
+    def init(self, trump):
+        self._cards = BitCardSet([], trump)
+        self._tracker = CardTracker(trump)
+        self._drop_tree()
+        # the last command and the action of the engine, None after deal
+        self._last_command = None
+        self._last_action = None
+        # the table after the last action and the gamedata of the last
+        # command
+        self._table = []
+        self._enemy_count = 0
+        self._deck_count = 0
+        self._discarded_count = 0
+        return 'ok'
+
+    def deal(self, cards, gamedata):
+        if self._last_command is not None:
+            self._observe_move_end(map(DurakCard, cards), gamedata)
+        self._cards.update(cards)
+        self._tracker.deal(cards, gamedata)
+        self._last_command = None
+        return 'ok'
+
+    def move(self, on_table, gamedata):
+        assert self._cards
+
+        if on_table:
+            # the enemy has beaten the card
+            self._observe(get_action_id(DurakCard(on_table[-1])))
+        card = self._choose_action('move', on_table, gamedata)
+        if card is None:
+            return ''
+        self._cards.remove(card)
+        self._tracker.play([card])
+        return card
+
+    def respond(self, on_table, gamedata):
+        assert self._cards
+
+        self._observe(get_action_id(DurakCard(on_table[-1])))
+        card = self._choose_action('respond', on_table, gamedata)
+        if card is None:
+            return ''
+        self._cards.remove(card)
+        self._tracker.play([card])
+        return card
+
+    def give_more(self, on_table, gamedata):
+        assert self._cards
+
+        # the enemy has taken the cards
+        self._observe(PASS)
+        cards = self._choose_action('give_more', on_table, gamedata)
+        self._cards.difference_update(cards)
+        self._tracker.play(cards)
+        return ' '.join(map(str, cards))
+
+    def _observe_move_end(self, cards, gamedata):
+        # follows the enemy action between the last action of the engine
+        # and the deal, if there was one; cards are the dealt cards
+        if self._last_command == 'move':
+            if self._last_action == PASS:
+                return
+            # the enemy has beaten the last card, or has taken the cards
+            # and the engine had nothing to give more
+            if len(gamedata['discarded']) > self._discarded_count:
+                self._observe(get_action_id(
+                    DurakCard(gamedata['discarded'][-1])
+                ))
+            else:
+                self._observe(PASS)
+        elif self._last_command == 'respond':
+            if self._last_action != PASS:
+                # the enemy has finished the move if both had cards
+                if self._cards and self._enemy_count:
+                    self._observe(PASS)
+            elif self._enemy_count:
+                given_more = self._get_given_more(cards)
+                if given_more is None:
+                    self._drop_tree()
+                else:
+                    self._observe(GIVE_MORE | to_mask(given_more))
+
+    def _get_given_more(self, cards):
+        # The cards given more by the enemy after the engine took the
+        # cards, None if they can not be told from the cards the engine
+        # got from the deck. The engine gets the deck cards first, up to 6.
+        new_cards = [card for card in cards if card not in self._table]
+        room = 6 - len(self._cards) - len(self._table)
+        if not self._deck_count or len(new_cards) > room:
+            return new_cards
+
+        ranks = {card.rank for card in self._table}
+        if any(card.rank in ranks for card in new_cards):
+            return None
+        return []
+
+    def _observe(self, action_id):
+        # moves the root of the tree to the child with the action
+        if self._root is not None:
+            self._root = self._root.get_child(action_id)
+            self._nodes_count = None
+
+    def _drop_tree(self):
+        self._root = None
+        self._nodes_count = None
+
+    def _choose_action(self, command, on_table, gamedata):
+        # a card or None for move and respond, a tuple of cards for
+        # give_more
+        self._tracker.observe(on_table, gamedata)
+        on_table = map(DurakCard, on_table)
+        gamedata = dict(gamedata, on_table=map(str, on_table))
+
+        if (gamedata['deck_count'] == 0 and
+                len(self._cards) + gamedata['enemy_count'] <=
+                self.ENDGAME_SOLVER_CARDS):
+            action = self.solve_endgame(
+                command, list(self._cards), on_table, gamedata
+            )[1]
+            if command == 'give_more':
+                action = tuple(action)
+        else:
+            action = self._search(command, gamedata)
+
+        self._last_command = command
+        self._last_action = get_action_id(action)
+        if command == 'give_more' or action is None:
+            self._table = on_table
+        else:
+            self._table = on_table + [action]
+        self._enemy_count = gamedata['enemy_count']
+        self._deck_count = gamedata['deck_count']
+        self._discarded_count = len(gamedata['discarded'])
+
+        self._observe(self._last_action)
+        return action
+
+    def _search(self, command, gamedata):
+        if self._root is None:
+            self._root = Node()
+        if self._nodes_count is None:
+            self._nodes_count = count_nodes(self._root)
+
+        cards = list(self._cards)
+        enemy_cards = self._tracker.get_enemy_cards()
+        deadline = time.time() + self.move_time
+        while True:
+            position = sample_position(
+                command, cards, gamedata, self._random, enemy_cards
+            )
+            self._iterate(position)
+            if time.time() >= deadline:
+                break
+
+        # the most visited action, the first one of the legal actions if
+        # there are several; they are the same in all the samples
+        self._controller.restore(position)
+        actions = self._controller.legal_actions()
+        visits = []
+        for action in actions:
+            child = self._root.get_child(get_action_id(action))
+            visits.append(child.visits if child is not None else 0)
+        return actions[visits.index(max(visits))]
+
+    def _iterate(self, position):
+        controller = self._controller
+        States = controller.States
+        controller.restore(position)
+
+        node = self._root
+        path = []
+        while not controller.is_game_over():
+            state = controller.state
+            if state == States.DEALING:
+                controller.deal()
+                continue
+
+            if state == States.RESPONDING:
+                is_engine = controller.to_move != ENGINE
+            else:
+                is_engine = controller.to_move == ENGINE
+
+            untried = []
+            best_child = best_action = None
+            best_value = None
+            for action in controller.legal_actions():
+                child = node.get_child(get_action_id(action))
+                if child is None:
+                    untried.append(action)
+                    continue
+
+                child.available += 1
+                value = child.score / child.visits + self.EXPLORATION * (
+                    math.sqrt(math.log(child.available) / child.visits)
+                )
+                if best_value is None or value > best_value:
+                    best_child, best_action, best_value = child, action, value
+
+            if untried and self._nodes_count < self.max_nodes:
+                action = self._random.choice(untried)
+                child = Node(
+                    get_action_id(action), ENGINE if is_engine else ENEMY
+                )
+                node.children.append(child)
+                self._nodes_count += 1
+                register_action(controller, action)
+                path.append(child)
+                break
+            if best_child is None:
+                # the tree is full
+                break
+
+            register_action(controller, best_action)
+            node = best_child
+            path.append(node)
+
+        winner = play_out(controller, dummy_policy, dummy_policy)
+        if winner == ENGINE:
+            result = 1.0
+        elif winner is None:
+            result = 0.5
+        else:
+            result = 0.0
+
+        self._root.visits += 1
+        for node in path:
+            node.visits += 1
+            node.score += result if node.player == ENGINE else 1 - result
+
+
+def main():
+    arguments = docopt(__doc__)
+    seed = arguments['--seed']
+    ISMCTSEngine(
+        move_time=float(arguments['--move-time']),
+        max_nodes=int(arguments['--max-nodes']),
+        seed=None if seed is None else int(seed),
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Durak Monte Carlo Engine
+
+Samples the unknown cards (the enemy hand and the deck) many times and
+evaluates every legal action by playing the rest of each sampled game out.
+
+Usage:
+  durak-mc [--move-time=<seconds>] [--jobs=<count>] [--seed=<seed>]
+  durak-mc (-h | --help)
+
+Options:
+  -h --help               Show this help.
+  --move-time=<seconds>   Time for one command [default: 0.1].
+  --jobs=<count>          Processes that play rollouts [default: 1].
+  --seed=<seed>           Integer seed to make the engine reproducible.
+
+"""
+# A sample ("determinization") puts the known enemy cards (see
+# durak.engine.tracker) and random unknown cards to the enemy hand and the
+# rest to the deck, the trump card is the last one while the deck is not
+# empty. The unknown cards are all the cards except own, on the table,
+# discarded and known enemy ones. Every action is played in the same
+# sample, and the rest of the game is played by durak.sim.dummy_policy for
+# both players, so the actions are compared in the same conditions. The
+# action with the best average score (1 for a win, 0.5 for a draw) is
+# chosen.
+#
+# Rollouts run in a multiprocessing pool (threads do not help because of
+# the GIL), every process samples on its own till the time is over. When
+# the deck is empty the game has perfect information and is solved exactly,
+# see EndgameSolverMixin.solve_endgame.
+from multiprocessing import Pool
+from random import Random
+import time
+
+from docopt import docopt
+
+from durak.controller import GameController, GameSnapshot
+from durak.engine.base import BaseEngine
+from durak.engine.solver import EndgameSolverMixin
+from durak.engine.tracker import CardTracker
+from durak.sim import dummy_policy, play_out
+from durak.utils.cards import BitCardSet, DurakCard
+
+
+def sample_position(command, cards, gamedata, random, enemy_cards=()):
+    # a GameSnapshot with the engine as PLAYER1 and the unknown cards dealt
+    # randomly, enemy_cards are the known cards of the enemy
+    trump = DurakCard(gamedata['trump'])
+    on_table = map(DurakCard, gamedata['on_table'])
+    enemy_cards = map(DurakCard, enemy_cards)
+    known = set(cards)
+    known.update(on_table)
+    known.update(enemy_cards)
+    known.update(map(DurakCard, gamedata['discarded']))
+    deck_count = gamedata['deck_count']
+    if deck_count:
+        known.add(trump)
+
+    unknown = [card for card in sorted(DurakCard.all()) if card not in known]
+    random.shuffle(unknown)
+    enemy_count = gamedata['enemy_count'] - len(enemy_cards)
+    deck = unknown[enemy_count:]
+    if deck_count:
+        deck.append(trump)
+
+    if command == 'move':
+        state = GameController.States.MOVING
+    elif command == 'respond':
+        state = GameController.States.RESPONDING
+    elif command == 'give_more':
+        state = GameController.States.GIVING_MORE
+    else:
+        raise ValueError('Unknown command "%s"' % command)
+
+    return GameSnapshot(
+        state=state,
+        trump=trump,
+        deck=tuple(deck),
+        player1_cards=BitCardSet(cards, trump).mask,
+        player2_cards=BitCardSet(
+            enemy_cards + unknown[:enemy_count], trump
+        ).mask,
+        to_move=(
+            GameController.PLAYER2 if command == 'respond'
+            else GameController.PLAYER1
+        ),
+        on_table=tuple(on_table),
+        given_more=frozenset(),
+        discarded=tuple(map(DurakCard, gamedata['discarded'])),
+        no_response=(command == 'give_more'),
+        winner=None,
+    )
+
+
+def register_action(controller, action):
+    # action is one of GameController.legal_actions
+    if controller.state == controller.States.MOVING:
+        controller.register_move(action)
+    elif controller.state == controller.States.RESPONDING:
+        controller.register_response(action)
+    elif controller.state == controller.States.GIVING_MORE:
+        controller.register_give_more(action)
+
+
+def run_rollouts(command, cards, enemy_cards, gamedata, move_time,
+                 seed=None):
+    # Samples and plays out the positions till move_time is over (at least
+    # once). Returns a list of [action, score, rollouts count] in the order
+    # of GameController.legal_actions, which is the same for all the
+    # samples. Module-level for multiprocessing, so cards are strings,
+    # enemy_cards are the known cards of the enemy.
+    deadline = time.time() + move_time
+    random = Random(seed)
+    controller = GameController(
+        card_set_class=BitCardSet, log_enabled=False
+    )
+    cards = map(DurakCard, cards)
+
+    position = sample_position(
+        command, cards, gamedata, random, enemy_cards
+    )
+    controller.restore(position)
+    results = [[action, 0.0, 0] for action in controller.legal_actions()]
+    while True:
+        for result in results:
+            controller.restore(position)
+            register_action(controller, result[0])
+            winner = play_out(controller, dummy_policy, dummy_policy)
+            if winner == controller.PLAYER1:
+                score = 1.0
+            elif winner is None:
+                score = 0.5
+            else:
+                score = 0.0
+            result[1] += score
+            result[2] += 1
+
+        if time.time() >= deadline:
+            return results
+        position = sample_position(
+            command, cards, gamedata, random, enemy_cards
+        )
+
+
+def _run_rollouts(args):
+    return run_rollouts(*args)
+
+
+class MonteCarloEngine(EndgameSolverMixin, BaseEngine):
+    SUPPORTED_OPTIONS = (BaseEngine.SESSION,)
+
+    # the endgame is solved exactly if both hands have at most this number
+    # of cards in total
+    ENDGAME_SOLVER_CARDS = 10
+
+    def __init__(self, move_time=0.1, jobs=1, seed=None):
+        self.move_time = move_time
+        self.jobs = jobs
+        self._random = Random(seed)
+        self._pool = None
+        self._cards = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = Pool(self.jobs)
+        return self._pool
+
+    def init(self, trump):
+        self._cards = BitCardSet([], trump)
+        self._tracker = CardTracker(trump)
+        return 'ok'
+
+    def deal(self, cards, gamedata):
+        self._cards.update(cards)
+        self._tracker.deal(cards, gamedata)
+        return 'ok'
+
+    def move(self, on_table, gamedata):
+        assert self._cards
+
+        card = self._choose_action('move', on_table, gamedata)
+        if card is None:
+            return ''
+        self._cards.remove(card)
+        self._tracker.play([card])
+        return card
+
+    def respond(self, on_table, gamedata):
+        assert self._cards
+
+        card = self._choose_action('respond', on_table, gamedata)
+        if card is None:
+            return ''
+        self._cards.remove(card)
+        self._tracker.play([card])
+        return card
+
+    def give_more(self, on_table, gamedata):
+        assert self._cards
+
+        cards = self._choose_action('give_more', on_table, gamedata)
+        self._cards.difference_update(cards)
+        self._tracker.play(cards)
+        return ' '.join(map(str, cards))
+
+    def _choose_action(self, command, on_table, gamedata):
+        # a card or None for move and respond, a list of cards for give_more
+        self._tracker.observe(on_table, gamedata)
+        on_table = map(DurakCard, on_table)
+        gamedata = dict(gamedata, on_table=map(str, on_table))
+
+        if (gamedata['deck_count'] == 0 and
+                len(self._cards) + gamedata['enemy_count'] <=
+                self.ENDGAME_SOLVER_CARDS):
+            return self.solve_endgame(
+                command, list(self._cards), on_table, gamedata
+            )[1]
+
+        results = self._run_rollouts(command, gamedata)
+        # the first of the best ones, so ties are broken by the order of
+        # legal_actions
+        best_action, _, _ = max(
+            results, key=lambda result: result[1] / result[2]
+        )
+        if command == 'give_more':
+            return list(best_action)
+        return best_action
+
+    def _run_rollouts(self, command, gamedata):
+        cards = map(str, self._cards)
+        enemy_cards = map(str, self._tracker.get_enemy_cards())
+        if self.jobs <= 1:
+            return run_rollouts(
+                command, cards, enemy_cards, gamedata, self.move_time,
+                self._random.getrandbits(32)
+            )
+
+        parts = self._get_pool().map(_run_rollouts, [
+            (command, cards, enemy_cards, gamedata, self.move_time,
+             self._random.getrandbits(32))
+            for _ in xrange(self.jobs)
+        ])
+        results = parts[0]
+        for part in parts[1:]:
+            for result, (_, score, count) in zip(results, part):
+                result[1] += score
+                result[2] += count
+        return results
+
+
+def main():
+    arguments = docopt(__doc__)
+    seed = arguments['--seed']
+    engine = MonteCarloEngine(
+        move_time=float(arguments['--move-time']),
+        jobs=int(arguments['--jobs']),
+        seed=None if seed is None else int(seed),
+    )
+    try:
+        engine.run()
+    finally:
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+# Exact solver of endgames. When the deck is empty, the cards of the enemy
+# are all the cards except own cards, the cards on the table and the
+# discarded ones, so the game has perfect information and can be searched to
+# the end. The rules are the same as in GameController.
+#
+# The search is negamax with alpha-beta over card masks (as in BitCardSet):
+# the value of a position is WIN, DRAW or LOSS for the player to act, and
+# the transposition table keeps bounds of the values by the masks of both
+# hands and the table. It is kept between calls, as the positions of one
+# trump suit stay the same.
+from durak.utils.cards import (
+    BEAT_MASKS, bit_count, CARDS_BY_ORDINAL, DurakCard, iter_mask, RANK_MASKS,
+    SUIT_MASKS, SUITS_COUNT, to_mask
+)
+
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+MOVING, RESPONDING, GIVING_MORE = range(3)
+
+_CARDS_COUNT = len(CARDS_BY_ORDINAL)
+_ALL_CARDS_MASK = (1 << _CARDS_COUNT) - 1
+# the lowest bit of every rank
+_RANK_BITS = sum(mask & -mask for mask in RANK_MASKS)
+_RANK_MASK = (1 << SUITS_COUNT) - 1
+
+
+def get_enemy_cards(cards, on_table, discarded):
+    # the enemy cards when the deck is empty
+    return list(iter_mask(
+        _ALL_CARDS_MASK &
+        ~(to_mask(cards) | to_mask(on_table) | to_mask(discarded))
+    ))
+
+
+def _same_rank_mask(mask):
+    # all the cards of the ranks that are in mask
+    folded = mask | mask >> 1 | mask >> 2 | mask >> 3
+    return (folded & _RANK_BITS) * _RANK_MASK
+
+
+class EndgameSolver(object):
+
+    # the transposition table is cleared when it gets larger
+    MAX_TABLE_SIZE = 2000000
+
+    def __init__(self, trump, tablebase=None):
+        self.trump = DurakCard(trump)
+        # durak.engine.tablebase.Tablebase for the positions at the start
+        # of a move
+        self.tablebase = tablebase
+        self._beat_masks = BEAT_MASKS[self.trump.suit]
+        self._trump_mask = SUIT_MASKS[self.trump.suit]
+        self._table = {}
+        self.nodes = 0
+
+    def clear(self):
+        self._table = {}
+
+    def solve_move(self, cards, enemy_cards, on_table=()):
+        # returns (result, card), card is None to finish the move
+        return self._solve(
+            MOVING, to_mask(cards), to_mask(enemy_cards), to_mask(on_table)
+        )
+
+    def solve_response(self, cards, enemy_cards, on_table):
+        # returns (result, card), card is None to take the cards
+        return self._solve(
+            RESPONDING, to_mask(enemy_cards), to_mask(cards),
+            to_mask(on_table), DurakCard(on_table[-1]).ordinal
+        )
+
+    def solve_give_more(self, cards, enemy_cards, on_table):
+        # returns (result, cards to give more)
+        result, cards = self._solve(
+            GIVING_MORE, to_mask(cards), to_mask(enemy_cards),
+            to_mask(on_table)
+        )
+        return result, list(iter_mask(cards))
+
+    def solve_masks(self, attacker, defender):
+        # the result of the player to move with the empty table, the cards
+        # are masks
+        return self._search(MOVING, attacker, defender, 0, 0, LOSS, WIN)
+
+    def _solve(self, phase, attacker, defender, table, last=0):
+        if len(self._table) > self.MAX_TABLE_SIZE:
+            self.clear()
+
+        best_result = None
+        best_action = None
+        alpha = LOSS
+        for action, sign, child in self._iter_children(
+                phase, attacker, defender, table, last):
+            if child is None:
+                result = sign
+            elif sign < 0:
+                result = -self._search(*(child + (-WIN, -alpha)))
+            else:
+                result = self._search(*(child + (alpha, WIN)))
+
+            if best_result is None or result > best_result:
+                best_result = result
+                best_action = action
+                alpha = max(alpha, result)
+                if result == WIN:
+                    break
+
+        return best_result, self._get_action(phase, best_action)
+
+    @staticmethod
+    def _get_action(phase, action):
+        if phase == GIVING_MORE:
+            return action
+        if action is None:
+            return None
+        return CARDS_BY_ORDINAL[action.bit_length() - 1]
+
+    def _iter_children(self, phase, attacker, defender, table, last):
+        # Yields (action, sign, child) for every action of the player to
+        # act. child is the next position as the _search arguments, without
+        # alpha and beta, and sign is -1 if the enemy acts there, 1 if the
+        # same player does. If the game is over, child is None and sign is
+        # the result. Actions are card masks, None to finish the move or to
+        # take, and the masks of cards given more.
+        if phase == MOVING:
+            if table:
+                candidates = attacker & _same_rank_mask(table)
+            else:
+                candidates = attacker
+            for card in self._iter_cards(candidates):
+                rest = attacker ^ card
+                # the defender may still beat the last card with the last
+                # card, otherwise the game is over
+                if rest or (
+                        not defender & (defender - 1) and
+                        defender & self._beat_masks[card.bit_length() - 1]):
+                    yield card, -1, (
+                        RESPONDING, rest, defender, table | card,
+                        card.bit_length() - 1
+                    )
+                else:
+                    yield card, WIN, None
+            if table:
+                # the cards are beaten, so the defender moves next
+                yield None, -1, (MOVING, defender, attacker, 0, 0)
+
+        elif phase == RESPONDING:
+            for card in self._iter_cards(defender & self._beat_masks[last]):
+                rest = defender ^ card
+                if rest and attacker:
+                    yield card, -1, (MOVING, attacker, rest, table | card, 0)
+                elif rest:
+                    yield card, LOSS, None
+                elif attacker:
+                    yield card, WIN, None
+                else:
+                    yield card, DRAW, None
+            if attacker:
+                yield None, -1, (GIVING_MORE, attacker, defender, table, 0)
+            else:
+                yield None, LOSS, None
+
+        elif phase == GIVING_MORE:
+            candidates = attacker & _same_rank_mask(table)
+            max_count = bit_count(defender) - 1
+            defender |= table
+            # all the submasks of candidates, from the largest
+            cards = candidates
+            while True:
+                if bit_count(cards) <= max_count:
+                    rest = attacker ^ cards
+                    if rest:
+                        yield cards, 1, (
+                            MOVING, rest, defender | cards, 0, 0
+                        )
+                    else:
+                        yield cards, WIN, None
+                if not cards:
+                    break
+                cards = (cards - 1) & candidates
+
+    def _iter_cards(self, mask):
+        # single card masks, not trumps first, the lowest first
+        for part in (mask & ~self._trump_mask, mask & self._trump_mask):
+            while part:
+                card = part & -part
+                yield card
+                part ^= card
+
+    def _search(self, phase, attacker, defender, table, last, alpha, beta):
+        self.nodes += 1
+        if phase == MOVING and not table and self.tablebase is not None:
+            result = self.tablebase.probe_masks(attacker, defender, self.trump)
+            if result is not None:
+                return result
+
+        key = (
+            attacker | defender << _CARDS_COUNT |
+            table << 2 * _CARDS_COUNT | last << 3 * _CARDS_COUNT |
+            phase << (3 * _CARDS_COUNT + 6)
+        )
+        lower, upper = self._table.get(key, (LOSS, WIN))
+        if lower >= beta or lower == upper:
+            return lower
+        if upper <= alpha:
+            return upper
+        alpha = max(alpha, lower)
+        beta = min(beta, upper)
+        searched_alpha = alpha
+
+        best = None
+        for _, sign, child in self._iter_children(
+                phase, attacker, defender, table, last):
+            if child is None:
+                result = sign
+            elif sign < 0:
+                result = -self._search(*(child + (-beta, -alpha)))
+            else:
+                result = self._search(*(child + (alpha, beta)))
+
+            if best is None or result > best:
+                best = result
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+
+        # with a fail low the value is at most best, with a fail high at
+        # least best, otherwise it is exact
+        if best <= searched_alpha:
+            upper = best
+        elif best >= beta:
+            lower = best
+        else:
+            lower = upper = best
+        self._table[key] = (lower, upper)
+        return best
+
+
+class EndgameSolverMixin(object):
+    # For engines: class MyEngine(EndgameSolverMixin, BaseEngine). It is
+    # not a part of BaseEngine, so the engines that do not search do not
+    # depend on the solver.
+
+    # see solve_endgame, engines can set a Tablebase instance from
+    # durak.engine.tablebase to probe it instead of searching
+    endgame_tablebase = None
+    _endgame_solver = None
+
+    def solve_endgame(self, command, cards, on_table, gamedata):
+        # When the deck is empty, the enemy has all the cards that are not
+        # own, on the table or discarded, so the rest of the game is solved
+        # exactly by EndgameSolver. command is 'move', 'respond' or
+        # 'give_more', cards are own cards of the engine. Returns (result, action), where result is WIN, DRAW or
+        # LOSS and action is a card or None for move and respond and a list
+        # of cards for give_more. Returns None if the deck is not empty or
+        # there is no gamedata (the no_gamedata option).
+        if gamedata.get('deck_count') != 0:
+            return None
+
+        trump = DurakCard(gamedata['trump'])
+        # the transposition table stays valid while the trump suit is the
+        # same
+        solver = self._endgame_solver
+        if solver is None or solver.trump.suit != trump.suit:
+            solver = self._endgame_solver = EndgameSolver(
+                trump, self.endgame_tablebase
+            )
+
+        enemy_cards = get_enemy_cards(
+            cards, on_table, gamedata['discarded']
+        )
+        if command == 'move':
+            return solver.solve_move(cards, enemy_cards, on_table)
+        elif command == 'respond':
+            return solver.solve_response(cards, enemy_cards, on_table)
+        elif command == 'give_more':
+            return solver.solve_give_more(cards, enemy_cards, on_table)
+        raise ValueError('Unknown command "%s"' % command)
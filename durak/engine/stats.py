@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+
+
+# upper bounds of latency histogram buckets in seconds, the last bucket
+# is for everything slower
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.0002, 0.0005,
+    0.001, 0.002, 0.005,
+    0.01, 0.02, 0.05,
+    0.1, 0.2, 0.5,
+    1.0, 2.0, 5.0, 10.0,
+)
+
+
+class CommandStats(object):
+    # round-trip times of one command of an engine
+
+    def __init__(self):
+        self.count = 0
+        self.time_used = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, command_time):
+        self.count += 1
+        self.time_used += command_time
+        if command_time > self.max_time:
+            self.max_time = command_time
+        self.histogram[bisect_left(LATENCY_BUCKETS, command_time)] += 1
+
+    def update(self, other):
+        self.count += other.count
+        self.time_used += other.time_used
+        self.max_time = max(self.max_time, other.max_time)
+        self.histogram = [
+            count + other_count
+            for count, other_count in zip(self.histogram, other.histogram)
+        ]
+
+    @property
+    def mean_time(self):
+        if not self.count:
+            return 0.0
+        return self.time_used / self.count
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'time_used': self.time_used,
+            'mean_time': self.mean_time,
+            'max_time': self.max_time,
+            'histogram': self.histogram,
+        }
+
+
+class TimeStats(object):
+    # time used by an engine, in total and by commands
+
+    def __init__(self):
+        self.time_used = 0.0
+        self.commands_count = 0
+        self.max_command_time = 0.0
+        self.losses_on_time = 0
+        self.commands = {}
+
+    def add(self, command, command_time):
+        self.time_used += command_time
+        self.commands_count += 1
+        if command_time > self.max_command_time:
+            self.max_command_time = command_time
+
+        command_stats = self.commands.get(command)
+        if command_stats is None:
+            command_stats = self.commands[command] = CommandStats()
+        command_stats.add(command_time)
+
+    def update(self, other):
+        self.time_used += other.time_used
+        self.commands_count += other.commands_count
+        self.max_command_time = max(
+            self.max_command_time, other.max_command_time
+        )
+        self.losses_on_time += other.losses_on_time
+
+        for command, other_stats in other.commands.iteritems():
+            self.commands.setdefault(command, CommandStats()).update(
+                other_stats
+            )
+
+    @property
+    def mean_command_time(self):
+        if not self.commands_count:
+            return 0.0
+        return self.time_used / self.commands_count
+
+    def to_dict(self):
+        return {
+            'time_used': self.time_used,
+            'commands_count': self.commands_count,
+            'mean_command_time': self.mean_command_time,
+            'max_command_time': self.max_command_time,
+            'losses_on_time': self.losses_on_time,
+            'latency_buckets': LATENCY_BUCKETS,
+            'commands': dict(
+                (command, command_stats.to_dict())
+                for command, command_stats in self.commands.iteritems()
+            ),
+        }
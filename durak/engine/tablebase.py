@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Durak Endgame Tablebase
+
+Solves all the endgames (the deck is empty, the table is empty, the player
+to move has at most <max_cards> cards, the enemy too) and saves the results
+to a file, which engines can probe instantly, see Tablebase.
+
+Usage:
+  durak-tablebase <path_to_file> [--max-cards=<count>]
+  durak-tablebase (-h | --help)
+
+Options:
+  -h --help             Show this help.
+  --max-cards=<count>   Max cards of each player, at most 4. 3 takes
+                        a minute, 4 takes many hours [default: 3].
+
+"""
+# Only the order of the ranks in the hands matters when the deck is empty,
+# and the suits can be renamed, so a position is stored once in canonical
+# form: the trump suit is renamed to the first one and the ranks are
+# "compressed", i.e. the lowest rank in the hands becomes 6, the next one 7
+# and so on. Then 8 ranks at most fit in 32 bits for each hand.
+#
+# The file is a header and an open addressing hash table of 9-byte slots
+# (attacker mask, defender mask, result), so a probe reads a slot or a few
+# from the mmap-ed file.
+from itertools import combinations
+import mmap
+import struct
+import sys
+
+from docopt import docopt
+
+from durak.engine.solver import EndgameSolver
+from durak.utils.cards import (
+    CARDS_BY_ORDINAL, DurakCard, RANK_MASKS, SUITS_COUNT, to_mask
+)
+
+
+MAGIC = 'DURAKTB1'
+# magic, max cards, slots count
+HEADER = struct.Struct('<8sBI')
+# attacker mask, defender mask, result; the attacker mask is never 0, so
+# 0 is an empty slot
+SLOT = struct.Struct('<IIb')
+
+MAX_CARDS = 4
+
+_RANKS_COUNT = len(RANK_MASKS)
+_RANK_MASK = (1 << SUITS_COUNT) - 1
+# the lowest bit of every rank
+_RANK_BITS = sum(mask & -mask for mask in RANK_MASKS)
+_FIRST_SUIT_MASK = _RANK_BITS
+
+
+def _get_compression_plan(rank_bits):
+    # (source shift, destination shift) of the ranks present in rank_bits
+    plan = []
+    for rank in xrange(_RANKS_COUNT):
+        if rank_bits >> (rank * SUITS_COUNT) & 1:
+            plan.append((rank * SUITS_COUNT, len(plan) * SUITS_COUNT))
+    return tuple(plan)
+
+
+_COMPRESSION_PLANS = {}
+
+
+def _swap_suits(mask, suit_index):
+    # swaps the first suit and the suit_index one
+    delta = ((mask >> suit_index) ^ mask) & _FIRST_SUIT_MASK
+    return mask ^ delta ^ (delta << suit_index)
+
+
+def get_canonical_position(attacker, defender, trump):
+    # (attacker, defender) masks in canonical form, see above
+    suit_index = DurakCard(trump).numeric_suit
+    if suit_index:
+        attacker = _swap_suits(attacker, suit_index)
+        defender = _swap_suits(defender, suit_index)
+
+    used = attacker | defender
+    rank_bits = (used | used >> 1 | used >> 2 | used >> 3) & _RANK_BITS
+    plan = _COMPRESSION_PLANS.get(rank_bits)
+    if plan is None:
+        plan = _COMPRESSION_PLANS[rank_bits] = _get_compression_plan(
+            rank_bits
+        )
+
+    canonical_attacker = canonical_defender = 0
+    for source_shift, destination_shift in plan:
+        canonical_attacker |= (
+            (attacker >> source_shift & _RANK_MASK) << destination_shift
+        )
+        canonical_defender |= (
+            (defender >> source_shift & _RANK_MASK) << destination_shift
+        )
+    return canonical_attacker, canonical_defender
+
+
+def _get_slot_index(attacker, defender, slots_count):
+    key = (attacker | defender << 32) * 0x9E3779B97F4A7C15
+    return ((key & 0xFFFFFFFFFFFFFFFF) >> 32) % slots_count
+
+
+class Tablebase(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.max_cards, self._slots_count = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a durak tablebase' % path)
+
+    def close(self):
+        self._mmap.close()
+
+    def probe(self, cards, enemy_cards, trump):
+        # the result (WIN, DRAW or LOSS) of the player to move with the
+        # empty deck and table, None if the position is not in the tablebase
+        return self.probe_masks(to_mask(cards), to_mask(enemy_cards), trump)
+
+    def probe_masks(self, attacker, defender, trump):
+        if not (0 < _bit_count(attacker) <= self.max_cards and
+                0 < _bit_count(defender) <= self.max_cards):
+            return None
+
+        attacker, defender = get_canonical_position(
+            attacker, defender, trump
+        )
+        index = _get_slot_index(attacker, defender, self._slots_count)
+        while True:
+            slot_attacker, slot_defender, result = SLOT.unpack_from(
+                self._mmap, HEADER.size + index * SLOT.size
+            )
+            if not slot_attacker:
+                return None
+            if slot_attacker == attacker and slot_defender == defender:
+                return result
+            index = (index + 1) % self._slots_count
+
+
+def _bit_count(mask):
+    return bin(mask).count('1')
+
+
+def iter_canonical_positions(max_cards):
+    # (attacker, defender) masks of all the canonical positions with the
+    # trump suit first, the fewer cards the earlier
+    for cards_count in xrange(2, 2 * max_cards + 1):
+        for ranks_count in xrange(1, min(cards_count, _RANKS_COUNT) + 1):
+            all_ranks = (1 << ranks_count * SUITS_COUNT) - 1
+            for cards in combinations(
+                    CARDS_BY_ORDINAL[:ranks_count * SUITS_COUNT],
+                    cards_count):
+                used = to_mask(cards)
+                if (used | used >> 1 | used >> 2 | used >> 3) & _RANK_BITS \
+                        != _RANK_BITS & all_ranks:
+                    continue
+
+                for attacker_count in xrange(
+                        max(1, cards_count - max_cards),
+                        min(max_cards, cards_count - 1) + 1):
+                    for attacker_cards in combinations(cards, attacker_count):
+                        attacker = to_mask(attacker_cards)
+                        yield attacker, used ^ attacker
+
+
+def generate_tablebase(path, max_cards=3):
+    if not 0 < max_cards <= MAX_CARDS:
+        raise ValueError('max_cards should be from 1 to %d' % MAX_CARDS)
+
+    # the load factor is 0.5, results go right to the slots
+    positions_count = sum(1 for _ in iter_canonical_positions(max_cards))
+    slots_count = 2 * positions_count + 1
+    slots = bytearray(slots_count * SLOT.size)
+
+    solver = EndgameSolver(CARDS_BY_ORDINAL[0])
+    for attacker, defender in iter_canonical_positions(max_cards):
+        index = _get_slot_index(attacker, defender, slots_count)
+        while SLOT.unpack_from(slots, index * SLOT.size)[0]:
+            index = (index + 1) % slots_count
+        SLOT.pack_into(
+            slots, index * SLOT.size, attacker, defender,
+            solver.solve_masks(attacker, defender)
+        )
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, max_cards, slots_count))
+        f.write(slots)
+
+    return positions_count
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = generate_tablebase(
+        arguments['<path_to_file>'], int(arguments['--max-cards'])
+    )
+    sys.stdout.write('%d positions\n' % count)
+
+
+if __name__ == '__main__':
+    main()
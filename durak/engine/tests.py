@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
+import json
+import os.path
+from random import Random
+import shutil
+import tempfile
+import time
 import unittest
 
-from mock import patch
+from mock import Mock, patch
 
-from durak.utils.cards import DurakCard
+from durak.controller import GameController, Table
+from durak.utils.cards import (BitCardSet, bit_count, CARDS_BY_ORDINAL,
+                               DurakCard, to_mask)
+from durak.engine import compact, ismcts, mc, solver, tablebase, tracker
 from durak.engine.base import BaseEngine
-from durak.engine.wrapper import EngineWrapper, EngineWrapperException
+from durak.engine.dummy import DummyEngine
+from durak.engine.wrapper import (AsyncEngineWrapper, EngineMultiplexer,
+                                  EngineOutputException, EngineRequest,
+                                  EngineTimeoutException, EngineWrapper,
+                                  EngineWrapperException,
+                                  InProcessEngineWrapper, TimeControl,
+                                  create_engine_wrapper)
+from durak.engine.stats import LATENCY_BUCKETS, CommandStats, TimeStats
 
 
 class BaseEngineTest(unittest.TestCase):
@@ -84,6 +100,122 @@ class BaseEngineTest(unittest.TestCase):
         self.engine.run()
         self.assertFalse(self.stdout_mock.write.called)
 
+    def test_session_option_is_accepted_if_supported(self):
+        self.engine.SUPPORTED_OPTIONS = (BaseEngine.SESSION,)
+        self.stdin_mock.readline.return_value = (
+            'init 7H ## {"options": ["session", "unknown"]}'
+        )
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine.run()
+
+        self.stdout_mock.write.assert_called_once_with('ok session\n')
+        self.assertEqual(self.engine._options, {BaseEngine.SESSION})
+
+    def test_session_option_is_ignored_if_not_supported(self):
+        self.stdin_mock.readline.return_value = (
+            'init 7H ## {"options": ["session"]}'
+        )
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine.run()
+
+        self.stdout_mock.write.assert_called_once_with('ok\n')
+        self.assertEqual(self.engine._options, set())
+
+    def test_discarded_delta_option_is_always_accepted(self):
+        self.stdin_mock.readline.return_value = (
+            'init 7H ## {"options": ["no_gamedata", "discarded_delta"]}'
+        )
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine.run()
+
+        self.stdout_mock.write.assert_called_once_with('ok discarded_delta\n')
+
+    def test_discarded_delta_is_expanded_to_full_list(self):
+        self.engine._init = BaseEngine._init.__get__(self.engine)
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine._init('7H', [BaseEngine.DISCARDED_DELTA])
+
+        self.stdin_mock.readline.side_effect = [
+            'move ## {"new_discarded": ["7S", "8S"], "enemy_count": 6}',
+            'move ## {"new_discarded": [], "enemy_count": 6}',
+            'move ## {"new_discarded": ["9S"], "enemy_count": 5}',
+        ]
+        with patch.object(self.engine, 'move', return_value='') as move_mock:
+            for _ in xrange(3):
+                self.engine.run()
+
+        self.assertEqual(
+            [call[1]['gamedata'] for call in move_mock.call_args_list],
+            [
+                {'discarded': ['7S', '8S'], 'enemy_count': 6},
+                {'discarded': ['7S', '8S'], 'enemy_count': 6},
+                {'discarded': ['7S', '8S', '9S'], 'enemy_count': 5},
+            ]
+        )
+
+    def test_compact_commands(self):
+        self.engine._options = {BaseEngine.COMPACT}
+        gamedata = {
+            'trump': '7H', 'deck_count': 12, 'enemy_count': 6,
+            'on_table': ['6S'], 'discarded': ['AS', 'KS'],
+        }
+        self.stdin_mock.readline.return_value = compact.encode_command(
+            'move', [DurakCard('6S')], gamedata
+        )
+        with patch.object(self.engine, 'move', return_value=DurakCard('6D')):
+            self.engine.run()
+            self.engine.move.assert_called_once_with(['6S'], gamedata=gamedata)
+
+        self.stdout_mock.write.assert_called_once_with(
+            compact.encode_cards([DurakCard('6D')]) + '\n'
+        )
+
+    def test_compact_commands_with_discarded_delta(self):
+        self.engine._options = {BaseEngine.COMPACT, BaseEngine.DISCARDED_DELTA}
+        self.engine._discarded = ['AS']
+        self.stdin_mock.readline.return_value = compact.encode_command(
+            'deal', [], {
+                'trump': '7H', 'deck_count': 0, 'enemy_count': 6,
+                'on_table': [], 'new_discarded': ['KS'],
+            },
+            'new_discarded'
+        )
+        with patch.object(self.engine, 'deal', return_value='ok'):
+            self.engine.run()
+            gamedata = self.engine.deal.call_args[1]['gamedata']
+
+        self.assertEqual(gamedata['discarded'], ['AS', 'KS'])
+        self.stdout_mock.write.assert_called_once_with('ok\n')
+
+    def test_text_commands_in_compact_mode(self):
+        self.engine._options = {BaseEngine.COMPACT}
+        self.stdin_mock.readline.return_value = 'init 7H'
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine.run()
+            self.engine.init.assert_called_once_with('7H')
+
+    def test_game_end_command_in_session_waits_for_next_game(self):
+        self.engine._options = {BaseEngine.SESSION}
+        self.stdin_mock.readline.side_effect = ['game_end', 'init 7H']
+        with patch.object(self.engine, 'init', return_value='ok'):
+            self.engine.run()  # stops after game_end because of unit testing
+            self.engine.run()
+            self.assertEqual(self.engine.init.call_count, 1)
+
+        self.stdout_mock.write.assert_called_once_with('ok\n')
+
+    def test_quit_command(self):
+        self.engine._options = {BaseEngine.SESSION}
+        self.stdin_mock.readline.return_value = 'quit'
+        self.engine.run()
+        self.assertFalse(self.stdout_mock.write.called)
+
+    def test_run_returns_if_stdin_is_closed(self):
+        del self.engine.only_one_iteration
+        self.stdin_mock.readline.return_value = ''
+        self.engine.run()
+        self.assertFalse(self.stdout_mock.write.called)
+
     def test_unknown_command(self):
         self.stdin_mock.readline.return_value = 'hahaha arg1 arg2'
         self.engine.run()
@@ -137,13 +269,26 @@ class EngineWrapperTest(unittest.TestCase):
         self.process.stdout.readline.return_value = 'hi there!   '
         self.assertEqual(self.wrapper._get_output(), 'hi there!')
 
-    def test_game_end_finishes_game_and_kills_process(self):
+    def test_game_end_finishes_game_and_stops_process(self):
         self.assertFalse(self.wrapper._process is None)
+        self.process.poll.return_value = 0
 
         self.wrapper.game_end()
 
-        self.assertTrue(self.process.kill.called)
         self.process.stdin.write.assert_called_once_with('game_end\n')
+        self.assertTrue(self.process.stdin.close.called)
+        self.assertFalse(self.process.kill.called)
+        self.assertTrue(self.process.wait.called)
+        self.assertTrue(self.wrapper._process is None)
+
+    def test_process_is_killed_if_it_does_not_exit(self):
+        self.process.poll.return_value = None
+
+        with patch.object(EngineWrapper, 'EXIT_TIMEOUT', 0.01):
+            self.wrapper.close()
+
+        self.assertTrue(self.process.kill.called)
+        self.assertTrue(self.process.wait.called)
         self.assertTrue(self.wrapper._process is None)
 
     def test_game_end_is_idempotent(self):
@@ -151,7 +296,7 @@ class EngineWrapperTest(unittest.TestCase):
 
         self.wrapper.game_end()
 
-        self.assertTrue(self.process.kill.called)
+        self.assertTrue(self.process.wait.called)
         self.assertTrue(self.wrapper._process is None)
 
         self.wrapper.game_end()
@@ -163,6 +308,213 @@ class EngineWrapperTest(unittest.TestCase):
         self.process.stdin.write.assert_called_once_with('init 7H\n')
         self.assertTrue(self.process.stdout.readline.called)
 
+    def test_init_requests_session_if_asked(self):
+        wrapper = EngineWrapper('path_to_engine', session=True)
+        self.process.stdin.write.reset_mock()
+        self.process.stdout.readline.return_value = 'ok session'
+
+        wrapper.init(DurakCard('7H'))
+
+        self.process.stdin.write.assert_called_once_with(
+            'init 7H ## {"options": ["session"]}\n'
+        )
+        self.assertEqual(wrapper.options, {EngineWrapper.SESSION})
+
+    def test_init_falls_back_if_session_is_not_accepted(self):
+        wrapper = EngineWrapper('path_to_engine', session=True)
+        wrapper.init(DurakCard('7H'))
+        self.assertEqual(wrapper.options, set())
+
+        wrapper.game_end()
+        self.assertTrue(self.process.wait.called)
+        self.assertTrue(wrapper._process is None)
+
+    def test_no_gamedata_option_skips_gamedata(self):
+        wrapper = EngineWrapper('path_to_engine', lazy_gamedata=True)
+        self.process.stdout.readline.return_value = 'ok no_gamedata'
+        wrapper.init(DurakCard('7H'))
+        self.process.stdin.write.reset_mock()
+        self.process.stdout.readline.return_value = ''
+
+        def get_gamedata():
+            self.fail('gamedata should not be built')
+        wrapper.move([DurakCard('7S')], get_gamedata)
+
+        self.process.stdin.write.assert_called_once_with('move 7S\n')
+
+    def test_discarded_delta_option_sends_new_discarded_cards(self):
+        wrapper = EngineWrapper('path_to_engine', lazy_gamedata=True)
+        self.process.stdout.readline.return_value = 'ok discarded_delta'
+        wrapper.init(DurakCard('7H'))
+        self.process.stdout.readline.return_value = ''
+
+        gamedata = {'discarded': ['7S', '8S']}
+        wrapper.move([DurakCard('7S')], gamedata)
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"new_discarded": ["7S", "8S"]}\n'
+        )
+        self.assertEqual(gamedata, {'discarded': ['7S', '8S']})
+
+        wrapper.move(
+            [DurakCard('7S')],
+            lambda new_discarded_from: {'discarded': ['7S', '8S', '9S']}
+        )
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"new_discarded": ["9S"]}\n'
+        )
+
+        # a function gets the number of the sent cards and builds only the
+        # new ones
+        get_gamedata = Mock(return_value={'new_discarded': ['TS']})
+        wrapper.move([DurakCard('7S')], get_gamedata)
+        get_gamedata.assert_called_once_with(new_discarded_from=3)
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"new_discarded": ["TS"]}\n'
+        )
+        wrapper.move(
+            [DurakCard('7S')], {'discarded': ['7S', '8S', '9S', 'TS', 'JS']}
+        )
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"new_discarded": ["JS"]}\n'
+        )
+
+        # gamedata without discarded cards is sent as it is
+        wrapper.move([DurakCard('7S')], {})
+        self.process.stdin.write.assert_called_with('move 7S ## {}\n')
+
+        self.process.stdout.readline.return_value = 'ok discarded_delta'
+        wrapper.init(DurakCard('7H'))
+        self.process.stdout.readline.return_value = ''
+        wrapper.move([DurakCard('7S')], {'discarded': ['7S']})
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"new_discarded": ["7S"]}\n'
+        )
+
+    def test_gamedata_is_sent_as_is_without_lazy_options(self):
+        self.wrapper.init(DurakCard('7H'))
+        self.process.stdout.readline.return_value = ''
+
+        self.wrapper.move([DurakCard('7S')], lambda: {'discarded': ['7S']})
+        self.process.stdin.write.assert_called_with(
+            'move 7S ## {"discarded": ["7S"]}\n'
+        )
+
+    def test_compact_option(self):
+        wrapper = EngineWrapper('path_to_engine', compact=True)
+        self.process.stdout.readline.return_value = 'ok compact'
+        wrapper.init(DurakCard('7H'))
+        self.assertEqual(wrapper.options, {EngineWrapper.COMPACT})
+
+        gamedata = {
+            'trump': '7H', 'deck_count': 12, 'enemy_count': 6,
+            'on_table': ['6S', '7S'], 'discarded': [],
+        }
+        self.process.stdout.readline.return_value = compact.encode_cards(
+            [DurakCard('8S'), DurakCard('8D')]
+        )
+        result = wrapper.give_more(
+            [DurakCard('6S'), DurakCard('7S')], gamedata
+        )
+
+        self.assertEqual(result, [DurakCard('8S'), DurakCard('8D')])
+        self.process.stdin.write.assert_called_with(compact.encode_command(
+            'give_more', [DurakCard('6S'), DurakCard('7S')], gamedata
+        ) + '\n')
+
+        self.process.stdout.readline.return_value = 'error'
+        with self.assertRaises(EngineWrapperException):
+            wrapper.move([], gamedata)
+
+    def test_engine_loses_on_time(self):
+        wrapper = EngineWrapper(
+            'path_to_engine', time_control=TimeControl(move_time=0.5)
+        )
+        self.process.stdout.fileno.return_value = 0
+        self.process.poll.return_value = None
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([], [], [])
+            with self.assertRaises(EngineTimeoutException) as context:
+                wrapper.init(DurakCard('7H'))
+            self.assertTrue(select_mock.select.call_args[0][3] <= 0.5)
+
+        self.assertTrue(context.exception.engine is wrapper)
+        # the engine is killed at once, without waiting for it to exit
+        self.assertTrue(self.process.kill.called)
+        self.assertTrue(self.process.wait.called)
+        self.assertTrue(wrapper._process is None)
+        self.assertEqual(wrapper.time_stats.losses_on_time, 1)
+
+    def test_output_in_time(self):
+        wrapper = EngineWrapper(
+            'path_to_engine', time_control=TimeControl(move_time=0.5)
+        )
+        with patch('durak.engine.wrapper.select') as select_mock, \
+                patch('durak.engine.wrapper.os') as os_mock:
+            select_mock.select.return_value = ([wrapper], [], [])
+            os_mock.read.side_effect = ['o', 'k\n']
+            wrapper.init(DurakCard('7H'))
+
+        self.assertFalse(self.process.stdout.readline.called)
+        self.assertEqual(wrapper.time_stats.commands_count, 1)
+        self.assertEqual(wrapper.time_stats.losses_on_time, 0)
+
+    def test_game_time_with_increment(self):
+        wrapper = EngineWrapper('path_to_engine', time_control=TimeControl(
+            move_time=5.0, game_time=10.0, increment=1.0
+        ))
+        wrapper._start_clock()
+        self.assertEqual(wrapper._get_time_limit(), 5.0)
+
+        wrapper._register_time('move', 7.0)
+        self.assertEqual(wrapper._get_time_limit(), 4.0)
+        wrapper._register_time('deal', 3.0)
+        self.assertEqual(wrapper._get_time_limit(), 1.0)
+        wrapper._register_time('deal', 3.0)
+        self.assertEqual(wrapper._get_time_limit(), 0.0)
+
+        wrapper._start_clock()
+        self.assertEqual(wrapper._get_time_limit(), 5.0)
+        self.assertEqual(wrapper.time_stats.commands_count, 3)
+        self.assertEqual(wrapper.time_stats.time_used, 13.0)
+        self.assertEqual(wrapper.time_stats.max_command_time, 7.0)
+
+    def test_no_time_limit_without_time_control(self):
+        self.assertTrue(self.wrapper._get_time_limit() is None)
+        wrapper = EngineWrapper(
+            'path_to_engine', time_control=TimeControl(increment=1.0)
+        )
+        wrapper._start_clock()
+        self.assertTrue(wrapper._get_time_limit() is None)
+
+    def test_game_end_in_session_keeps_process(self):
+        wrapper = EngineWrapper('path_to_engine', session=True)
+        self.process.stdout.readline.return_value = 'ok session'
+        wrapper.init(DurakCard('7H'))
+        self.process.stdin.write.reset_mock()
+
+        wrapper.game_end()
+
+        self.process.stdin.write.assert_called_once_with('game_end\n')
+        self.assertFalse(self.process.kill.called)
+        self.assertFalse(wrapper._process is None)
+
+        wrapper.close()
+
+        self.process.stdin.write.assert_called_with('quit\n')
+        self.assertTrue(self.process.stdin.close.called)
+        self.assertFalse(self.process.kill.called)
+        self.assertTrue(self.process.wait.called)
+        self.assertTrue(wrapper._process is None)
+
+    def test_init_restarts_process_after_game_end(self):
+        self.wrapper.game_end()
+        self.assertEqual(self.subprocess_mock.Popen.call_count, 1)
+
+        self.wrapper.init(DurakCard('7H'))
+
+        self.assertEqual(self.subprocess_mock.Popen.call_count, 2)
+        self.assertFalse(self.wrapper._process is None)
+
     def test_init_raises_exception_if_engine_response_is_not_ok(self):
         self.process.stdout.readline.return_value = 'error!'
         with self.assertRaises(EngineWrapperException):
@@ -202,6 +554,15 @@ class EngineWrapperTest(unittest.TestCase):
         with self.assertRaises(EngineWrapperException):
             self.wrapper.move([DurakCard('7H'), DurakCard('8H')])
 
+    def test_invalid_output_stops_engine(self):
+        self.process.stdout.readline.return_value = 'error'
+        with self.assertRaises(EngineOutputException) as context:
+            self.wrapper.move([DurakCard('7H')])
+
+        self.assertTrue(context.exception.engine is self.wrapper)
+        self.assertTrue(self.wrapper._process is None)
+        self.assertTrue(self.process.wait.called)
+
     def test_respond_converts_output_to_card(self):
         self.process.stdout.readline.return_value = '8H'
 
@@ -247,3 +608,1054 @@ class EngineWrapperTest(unittest.TestCase):
         self.process.stdout.readline.return_value = 'error'
         with self.assertRaises(EngineWrapperException):
             self.wrapper.give_more([DurakCard('7H')])
+
+
+class CommandStatsTest(unittest.TestCase):
+
+    def test_histogram(self):
+        stats = CommandStats()
+        for command_time in (0.00001, 0.00005, 0.0003, 0.0003, 100.0):
+            stats.add(command_time)
+
+        self.assertEqual(stats.count, 5)
+        self.assertEqual(stats.max_time, 100.0)
+        self.assertEqual(len(stats.histogram), len(LATENCY_BUCKETS) + 1)
+        self.assertEqual(stats.histogram[0], 2)
+        self.assertEqual(stats.histogram[3], 2)
+        self.assertEqual(stats.histogram[-1], 1)
+        self.assertEqual(sum(stats.histogram), 5)
+
+    def test_update(self):
+        stats1 = CommandStats()
+        stats1.add(0.001)
+        stats2 = CommandStats()
+        stats2.add(0.003)
+        stats2.add(0.003)
+
+        stats1.update(stats2)
+
+        self.assertEqual(stats1.count, 3)
+        self.assertAlmostEqual(stats1.mean_time, 0.007 / 3)
+        self.assertEqual(stats1.max_time, 0.003)
+        self.assertEqual(sum(stats1.histogram), 3)
+
+
+class TimeStatsTest(unittest.TestCase):
+
+    def test_update(self):
+        stats1 = TimeStats()
+        stats1.add('move', 1.0)
+        stats1.add('deal', 3.0)
+        stats2 = TimeStats()
+        stats2.add('move', 2.0)
+        stats2.add('respond', 2.0)
+        stats2.losses_on_time = 1
+
+        stats1.update(stats2)
+
+        self.assertEqual(stats1.time_used, 8.0)
+        self.assertEqual(stats1.commands_count, 4)
+        self.assertEqual(stats1.max_command_time, 3.0)
+        self.assertEqual(stats1.mean_command_time, 2.0)
+        self.assertEqual(stats1.losses_on_time, 1)
+        self.assertEqual(TimeStats().mean_command_time, 0.0)
+
+        self.assertItemsEqual(stats1.commands, ['move', 'deal', 'respond'])
+        self.assertEqual(stats1.commands['move'].count, 2)
+        self.assertEqual(stats1.commands['move'].time_used, 3.0)
+        self.assertEqual(stats2.commands['move'].count, 1)
+
+    def test_to_dict_is_json_serializable(self):
+        stats = TimeStats()
+        stats.add('move', 0.01)
+
+        data = json.loads(json.dumps(stats.to_dict()))
+
+        self.assertEqual(data['commands_count'], 1)
+        self.assertEqual(data['commands']['move']['count'], 1)
+        self.assertEqual(
+            len(data['commands']['move']['histogram']),
+            len(data['latency_buckets']) + 1
+        )
+
+
+class CompactTest(unittest.TestCase):
+
+    def test_cards_are_single_printable_bytes(self):
+        cards = DurakCard.all()
+        encoded = compact.encode_cards(cards)
+        self.assertEqual(len(encoded), len(cards))
+        self.assertFalse(set(encoded) & {' ', '\n', compact.FIELDS_SEPARATOR})
+        self.assertEqual(
+            compact.encode_card_strings(map(str, cards)), encoded
+        )
+        self.assertEqual(compact.decode_cards(encoded), map(str, cards))
+
+    def test_command_round_trip(self):
+        gamedata = {
+            'trump': 'TD', 'deck_count': 22, 'enemy_count': 6,
+            'on_table': ['6C', '7C'], 'discarded': ['AH', '6H'],
+        }
+        line = compact.encode_command(
+            'respond', [DurakCard('6C'), DurakCard('7C')], gamedata
+        )
+        self.assertEqual(
+            compact.decode_command(line),
+            ('respond', ['6C', '7C'], gamedata)
+        )
+
+    def test_command_without_gamedata(self):
+        line = compact.encode_command('move', [])
+        self.assertEqual(line, 'M')
+        self.assertEqual(compact.decode_command(line), ('move', [], {}))
+
+
+class AsyncEngineWrapperTest(unittest.TestCase):
+
+    def setUp(self):
+        self._subprocess_patcher = patch('durak.engine.wrapper.subprocess')
+        self.subprocess_mock = self._subprocess_patcher.start()
+        self.process = self.subprocess_mock.Popen.return_value
+        self._os_patcher = patch('durak.engine.wrapper.os')
+        self.os_mock = self._os_patcher.start()
+
+        self.wrapper = AsyncEngineWrapper('path_to_engine')
+
+    def tearDown(self):
+        self._subprocess_patcher.stop()
+        self._os_patcher.stop()
+
+    def test_create_engine_wrapper(self):
+        self.assertTrue(isinstance(
+            create_engine_wrapper('path_to_engine', asynchronous=True),
+            AsyncEngineWrapper
+        ))
+        self.assertTrue(isinstance(
+            create_engine_wrapper(
+                'py:durak.engine.dummy:DummyEngine', asynchronous=True
+            ),
+            InProcessEngineWrapper
+        ))
+
+    def test_commands_do_not_wait_for_output(self):
+        request = self.wrapper.move([DurakCard('7H')])
+
+        self.assertTrue(isinstance(request, EngineRequest))
+        self.assertTrue(request.engine is self.wrapper)
+        self.process.stdin.write.assert_called_once_with('move 7H\n')
+        self.assertFalse(self.process.stdout.readline.called)
+
+        self.assertEqual(request.get_result('8H'), DurakCard('8H'))
+        with self.assertRaises(EngineOutputException) as context:
+            request.get_result('error')
+        self.assertTrue(context.exception.engine is self.wrapper)
+        self.assertTrue(self.wrapper._process is None)
+
+    def test_command_time_is_counted_until_output_is_read(self):
+        with patch('durak.engine.wrapper.time') as time_mock:
+            time_mock.time.side_effect = [10.0, 30.0]
+            request = self.wrapper.move([DurakCard('7H')])
+            request.get_result('8H', read_at=12.5)
+
+        self.assertEqual(self.wrapper.time_stats.time_used, 2.5)
+
+    def test_init_request_sets_options(self):
+        wrapper = AsyncEngineWrapper('path_to_engine', session=True)
+        request = wrapper.init(DurakCard('7H'))
+        self.assertEqual(wrapper.options, set())
+
+        request.get_result('ok session')
+        self.assertEqual(wrapper.options, {AsyncEngineWrapper.SESSION})
+
+    def test_output_is_split_to_lines(self):
+        self.os_mock.read.side_effect = ['o', 'k\n8', 'H\n']
+
+        self.wrapper.read_available()
+        self.assertTrue(self.wrapper.pop_output() is None)
+        self.wrapper.read_available()
+        self.assertEqual(self.wrapper.pop_output(), 'ok')
+        self.assertTrue(self.wrapper.pop_output() is None)
+        self.wrapper.read_available()
+        self.assertEqual(self.wrapper.pop_output(), '8H')
+
+    def test_lines_keep_the_time_they_are_read_at(self):
+        self.os_mock.read.side_effect = ['ok\n8', 'H\n']
+
+        with patch('durak.engine.wrapper.time') as time_mock:
+            time_mock.time.side_effect = [1.0, 2.0]
+            self.wrapper.read_available()
+            self.wrapper.read_available()
+
+        self.assertEqual(self.wrapper.pop_output(), 'ok')
+        self.assertEqual(self.wrapper.output_read_at, 1.0)
+        self.assertEqual(self.wrapper.pop_output(), '8H')
+        self.assertEqual(self.wrapper.output_read_at, 2.0)
+
+    def test_closed_output_raises_exception(self):
+        self.os_mock.read.return_value = ''
+        with self.assertRaises(EngineWrapperException):
+            self.wrapper.read_available()
+
+
+class EngineMultiplexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.multiplexer = EngineMultiplexer()
+        self.results = []
+
+    def _game_loop(self, engine, on_table):
+        self.results.append((yield engine.respond(on_table)))
+
+    def test_game_loop_with_in_process_engine_finishes_at_once(self):
+        engine = InProcessEngineWrapper('py:durak.engine.dummy:DummyEngine')
+        engine.init(DurakCard('7H'))
+        engine.deal([DurakCard('8S')])
+
+        finished = self.multiplexer.add(
+            'game', self._game_loop(engine, [DurakCard('7S')])
+        )
+
+        self.assertTrue(finished)
+        self.assertEqual(len(self.multiplexer), 0)
+        self.assertEqual(self.results, [DurakCard('8S')])
+
+    def test_game_loops_get_outputs_of_ready_engines(self):
+        engine1 = Mock(spec=AsyncEngineWrapper)
+        engine1._get_time_limit.return_value = None
+        engine1.respond.return_value = EngineRequest(
+            engine1, 'respond', AsyncEngineWrapper._parse_respond_output
+        )
+        engine1._decode_output.side_effect = lambda command, output: output
+        engine1.pop_output.side_effect = ['8S', None]
+        engine1.output_read_at = None
+        engine2 = Mock(spec=AsyncEngineWrapper)
+        engine2._get_time_limit.return_value = None
+        engine2.respond.return_value = EngineRequest(
+            engine2, 'respond', AsyncEngineWrapper._parse_respond_output
+        )
+
+        self.assertFalse(self.multiplexer.add(
+            'game1', self._game_loop(engine1, [DurakCard('7S')])
+        ))
+        self.assertFalse(self.multiplexer.add(
+            'game2', self._game_loop(engine2, [DurakCard('7D')])
+        ))
+        self.assertEqual(len(self.multiplexer), 2)
+
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([engine1], [], [])
+            self.assertEqual(self.multiplexer.wait(), ['game1'])
+
+        self.assertTrue(engine1.read_available.called)
+        self.assertEqual(self.results, [DurakCard('8S')])
+        self.assertEqual(len(self.multiplexer), 1)
+
+    def _failing_game_loop(self, engine, on_table):
+        try:
+            yield engine.respond(on_table)
+        except EngineOutputException as e:
+            self.results.append(e.engine)
+
+    def _create_engine(self, outputs):
+        engine = Mock(spec=AsyncEngineWrapper)
+        engine._get_time_limit.return_value = None
+        engine.respond.return_value = EngineRequest(
+            engine, 'respond', AsyncEngineWrapper._parse_respond_output
+        )
+        engine._decode_output.side_effect = lambda command, output: output
+        engine.pop_output.side_effect = outputs
+        engine.output_read_at = None
+        engine._invalid_output.side_effect = (
+            lambda error: EngineOutputException(engine, str(error))
+        )
+        return engine
+
+    def test_invalid_output_is_thrown_into_game_loop(self):
+        engine1 = self._create_engine(['error', None])
+        engine2 = self._create_engine(['8D', None])
+
+        self.multiplexer.add(
+            'game1', self._failing_game_loop(engine1, [DurakCard('7S')])
+        )
+        self.multiplexer.add(
+            'game2', self._game_loop(engine2, [DurakCard('7D')])
+        )
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([engine1, engine2], [], [])
+            self.assertEqual(
+                sorted(self.multiplexer.wait()), ['game1', 'game2']
+            )
+
+        self.assertEqual(self.results[0], engine1)
+        self.assertEqual(self.results[1], DurakCard('8D'))
+        self.assertEqual(len(self.multiplexer), 0)
+
+    def test_closed_output_is_thrown_into_game_loop(self):
+        engine = self._create_engine([None])
+        engine.read_available.side_effect = EngineWrapperException('closed')
+
+        self.multiplexer.add(
+            'game', self._failing_game_loop(engine, [DurakCard('7S')])
+        )
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([engine], [], [])
+            self.assertEqual(self.multiplexer.wait(), ['game'])
+
+        self.assertEqual(self.results, [engine])
+
+    def test_outputs_are_read_before_game_loops_are_resumed(self):
+        engine1 = self._create_engine(['8S', None])
+        engine2 = self._create_engine(['8D', None])
+        calls = []
+        engine1.read_available.side_effect = lambda: calls.append('read1')
+        engine2.read_available.side_effect = lambda: calls.append('read2')
+        engine1._register_time.side_effect = (
+            lambda *args: calls.append('result1')
+        )
+
+        self.multiplexer.add(
+            'game1', self._game_loop(engine1, [DurakCard('7S')])
+        )
+        self.multiplexer.add(
+            'game2', self._game_loop(engine2, [DurakCard('7D')])
+        )
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([engine1, engine2], [], [])
+            self.multiplexer.wait()
+
+        self.assertEqual(calls[:3], ['read1', 'read2', 'result1'])
+
+
+    def test_game_loop_gets_exception_if_engine_is_out_of_time(self):
+        engine = Mock(spec=AsyncEngineWrapper)
+        engine._get_time_limit.return_value = 0.0
+        engine.respond.return_value = EngineRequest(
+            engine, 'respond', AsyncEngineWrapper._parse_respond_output
+        )
+        engine._time_out.return_value = EngineTimeoutException(engine, '')
+
+        self.multiplexer.add(
+            'game', self._game_loop(engine, [DurakCard('7S')])
+        )
+        with patch('durak.engine.wrapper.select') as select_mock:
+            select_mock.select.return_value = ([], [], [])
+            with self.assertRaises(EngineTimeoutException):
+                self.multiplexer.wait()
+
+        self.assertEqual(engine._time_out.call_args[0][0], 'respond')
+        self.assertEqual(len(self.multiplexer), 0)
+
+
+class InProcessEngineWrapperTest(unittest.TestCase):
+    ENGINE_PATH = 'py:durak.engine.dummy:DummyEngine'
+
+    def setUp(self):
+        self.wrapper = InProcessEngineWrapper(self.ENGINE_PATH)
+
+    def test_create_engine_wrapper(self):
+        self.assertTrue(isinstance(
+            create_engine_wrapper(self.ENGINE_PATH), InProcessEngineWrapper
+        ))
+        with patch('durak.engine.wrapper.subprocess'):
+            self.assertTrue(isinstance(
+                create_engine_wrapper('path_to_engine'), EngineWrapper
+            ))
+
+    def test_invalid_engine_path(self):
+        for path in ('py:durak.engine.dummy', 'py:durak.nothing:Engine',
+                     'py:durak.engine.dummy:Nothing',
+                     'py:durak.sim:RandomPolicy', 'py:durak.sim:play_out'):
+            with self.assertRaises(EngineWrapperException):
+                InProcessEngineWrapper(path)
+
+    def test_engine_gets_same_arguments_as_from_run(self):
+        self.wrapper.init(DurakCard('7H'))
+        engine = self.wrapper._engine
+        self.assertTrue(isinstance(engine, DummyEngine))
+
+        with patch.object(engine, 'move', return_value='8S') as move_mock:
+            result = self.wrapper.move(
+                [DurakCard('7S')], {'on_table': ['7S']}
+            )
+            move_mock.assert_called_once_with(
+                ['7S'], gamedata={'on_table': ['7S']}
+            )
+        self.assertEqual(result, DurakCard('8S'))
+
+        with patch.object(engine, 'deal', return_value='ok') as deal_mock:
+            self.wrapper.deal([DurakCard('7S')])
+            deal_mock.assert_called_once_with(['7S'], gamedata={})
+
+    def test_commands(self):
+        self.wrapper.init(DurakCard('7H'))
+        self.wrapper.deal([DurakCard('6S'), DurakCard('6C'), DurakCard('8H')])
+
+        self.assertEqual(self.wrapper.move([]), DurakCard('6C'))
+        self.assertEqual(
+            self.wrapper.respond([DurakCard('TS')]), DurakCard('8H')
+        )
+        self.assertTrue(self.wrapper.respond([DurakCard('AH')]) is None)
+        self.assertEqual(
+            self.wrapper.give_more([DurakCard('6D')], {'enemy_count': 6}),
+            [DurakCard('6S')]
+        )
+
+    def test_invalid_output(self):
+        self.wrapper.init(DurakCard('7H'))
+        engine = self.wrapper._engine
+        with patch.object(engine, 'move', return_value='error'):
+            with self.assertRaises(EngineWrapperException):
+                self.wrapper.move([])
+
+    def test_lazy_gamedata_requests_only_no_gamedata(self):
+        wrapper = InProcessEngineWrapper(self.ENGINE_PATH, lazy_gamedata=True)
+        wrapper.init(DurakCard('7H'))
+        self.assertEqual(wrapper.options, set())
+        self.assertEqual(
+            wrapper._requested_options, [InProcessEngineWrapper.NO_GAMEDATA]
+        )
+
+    def test_engine_loses_on_time_when_command_returns(self):
+        wrapper = InProcessEngineWrapper(
+            self.ENGINE_PATH, time_control=TimeControl(move_time=1.0)
+        )
+        with patch('durak.engine.wrapper.time') as time_mock:
+            time_mock.time.side_effect = [0.0, 0.5, 10.0, 12.0]
+            wrapper.init(DurakCard('7H'))
+            with self.assertRaises(EngineTimeoutException):
+                wrapper.deal([DurakCard('7S')])
+
+        self.assertTrue(wrapper._engine is None)
+        self.assertEqual(wrapper.time_stats.time_used, 2.5)
+        self.assertEqual(wrapper.time_stats.losses_on_time, 1)
+
+    def test_engine_is_recreated_for_every_game_without_session(self):
+        self.wrapper.init(DurakCard('7H'))
+        engine = self.wrapper._engine
+
+        self.wrapper.game_end()
+        self.wrapper.init(DurakCard('7H'))
+
+        self.assertFalse(self.wrapper._engine is engine)
+
+    def test_engine_is_reused_in_session(self):
+        wrapper = InProcessEngineWrapper(self.ENGINE_PATH, session=True)
+        wrapper.init(DurakCard('7H'))
+        self.assertEqual(wrapper.options, {InProcessEngineWrapper.SESSION})
+        engine = wrapper._engine
+
+        wrapper.game_end()
+        wrapper.init(DurakCard('7H'))
+
+        self.assertTrue(wrapper._engine is engine)
+
+        wrapper.close()
+        self.assertTrue(wrapper._engine is None)
+
+
+class EndgameSolverTest(unittest.TestCase):
+
+    def _set_up_controller(self, trump, state, cards1, cards2, on_table=()):
+        # player1 is to move, the deck is empty
+        controller = GameController(
+            card_set_class=BitCardSet, log_enabled=False, undo_enabled=True
+        )
+        controller._trump = trump
+        controller._deck = []
+        controller._discarded = []
+        controller._on_table = Table(on_table)
+        controller._player1.cards = BitCardSet(cards1, trump)
+        controller._player2.cards = BitCardSet(cards2, trump)
+        controller._to_move = controller._player1
+        controller._state = state
+        controller._no_response = (
+            state == GameController.States.GIVING_MORE
+        )
+        return controller
+
+    def _brute_force(self, controller):
+        # the result for player1 by minimax over all legal actions
+        if controller.is_game_over():
+            return {
+                controller.PLAYER1: solver.WIN,
+                controller.PLAYER2: solver.LOSS,
+                None: solver.DRAW,
+            }[controller.winner]
+
+        states = controller.States
+        if controller.state == states.DEALING:
+            controller.deal()
+            result = self._brute_force(controller)
+            controller.undo()
+            return result
+
+        register = {
+            states.MOVING: controller.register_move,
+            states.RESPONDING: controller.register_response,
+            states.GIVING_MORE: controller.register_give_more,
+        }[controller.state]
+        results = []
+        for action in list(controller.legal_actions()):
+            register(action)
+            results.append(self._brute_force(controller))
+            controller.undo()
+
+        if controller.is_player1_to_move() != (
+                controller.state == states.RESPONDING):
+            return max(results)
+        return -max(-x for x in results)
+
+    def _iter_positions(self, count, cards_count):
+        # (trump, cards1, cards2, one more card), the brute force is slow
+        # if one of the players has much more cards
+        random = Random(count)
+        for _ in xrange(count):
+            cards = random.sample(CARDS_BY_ORDINAL, cards_count)
+            trump = random.choice(CARDS_BY_ORDINAL)
+            split = random.randint(2, cards_count - 3)
+            yield trump, cards[:split], cards[split:-1], cards[-1]
+
+    def test_solve_move(self):
+        for trump, cards1, cards2, extra_card in self._iter_positions(30, 6):
+            cards2.append(extra_card)
+            controller = self._set_up_controller(
+                trump, GameController.States.MOVING, cards1, cards2
+            )
+            expected = self._brute_force(controller)
+            result, card = solver.EndgameSolver(trump).solve_move(
+                cards1, cards2
+            )
+            self.assertEqual(result, expected)
+
+            controller.register_move(card)
+            self.assertEqual(self._brute_force(controller), result)
+
+    def test_solve_response(self):
+        for trump, cards1, cards2, card in self._iter_positions(30, 6):
+            controller = self._set_up_controller(
+                trump, GameController.States.RESPONDING, cards1, cards2,
+                [card]
+            )
+            expected = -self._brute_force(controller)
+            result, response = solver.EndgameSolver(trump).solve_response(
+                cards2, cards1, [card]
+            )
+            self.assertEqual(result, expected)
+
+            controller.register_response(response)
+            self.assertEqual(-self._brute_force(controller), result)
+
+    def test_solve_give_more(self):
+        for trump, cards1, cards2, card in self._iter_positions(30, 6):
+            controller = self._set_up_controller(
+                trump, GameController.States.GIVING_MORE, cards1, cards2,
+                [card]
+            )
+            expected = self._brute_force(controller)
+            result, cards = solver.EndgameSolver(trump).solve_give_more(
+                cards1, cards2, [card]
+            )
+            self.assertEqual(result, expected)
+
+            controller.register_give_more(cards)
+            self.assertEqual(self._brute_force(controller), result)
+
+    def test_transposition_table_is_kept(self):
+        trump, cards1, cards2, card = next(self._iter_positions(1, 13))
+        endgame_solver = solver.EndgameSolver(trump)
+        expected = endgame_solver.solve_move(cards1, cards2 + [card])
+        nodes = endgame_solver.nodes
+        self.assertEqual(
+            endgame_solver.solve_move(cards1, cards2 + [card]), expected
+        )
+        self.assertLess(endgame_solver.nodes - nodes, nodes)
+
+    def test_6_on_6(self):
+        for trump, cards1, cards2, card in self._iter_positions(5, 13):
+            started_at = time.time()
+            solver.EndgameSolver(trump).solve_move(cards1[:6], cards2[:6])
+            self.assertLess(time.time() - started_at, 1)
+
+    def test_get_enemy_cards(self):
+        cards = set(CARDS_BY_ORDINAL)
+        cards.difference_update(map(DurakCard, ['6H', '7H', 'AS']))
+        self.assertEqual(
+            solver.get_enemy_cards(['6H'], ['7H'], map(str, cards)),
+            [DurakCard('AS')]
+        )
+
+
+class SolvingEngine(solver.EndgameSolverMixin, BaseEngine):
+    pass
+
+
+class EndgameSolverMixinTest(unittest.TestCase):
+
+    def test_deck_is_not_empty(self):
+        gamedata = {
+            'trump': '6H', 'deck_count': 1, 'enemy_count': 6,
+            'on_table': [], 'discarded': [],
+        }
+        self.assertIsNone(
+            SolvingEngine().solve_endgame('move', ['7S'], [], gamedata)
+        )
+
+    def test_no_gamedata(self):
+        self.assertIsNone(SolvingEngine().solve_endgame('move', ['7S'], [], {}))
+
+    def _get_gamedata(self, trump, *cards):
+        # all the cards except the given ones are discarded
+        cards = set(map(DurakCard, cards))
+        return {
+            'trump': trump, 'deck_count': 0, 'enemy_count': 0,
+            'on_table': [],
+            'discarded': [
+                str(x) for x in CARDS_BY_ORDINAL if x not in cards
+            ],
+        }
+
+    def test_solve(self):
+        engine = SolvingEngine()
+        gamedata = self._get_gamedata('6H', '7S', 'TD')
+        # the enemy can not beat 7S with the last card
+        self.assertEqual(
+            engine.solve_endgame('move', ['7S'], [], gamedata),
+            (solver.WIN, DurakCard('7S'))
+        )
+        self.assertEqual(
+            engine.solve_endgame('respond', ['TD'], ['7S'], gamedata),
+            (solver.LOSS, None)
+        )
+
+        gamedata = self._get_gamedata('6H', '7S', '9S', '9C', 'TD', 'JD')
+        self.assertEqual(
+            engine.solve_endgame('give_more', ['7S', '9S'], ['9C'], gamedata),
+            solver.EndgameSolver('6H').solve_give_more(
+                ['7S', '9S'], ['TD', 'JD'], ['9C']
+            )
+        )
+
+    def test_solver_is_kept_for_the_same_trump_suit(self):
+        engine = SolvingEngine()
+        for trump, is_kept in (('6H', False), ('AH', True), ('AS', False)):
+            endgame_solver = engine._endgame_solver
+            engine.solve_endgame(
+                'move', ['7S'], [], self._get_gamedata(trump, '7S', 'TD')
+            )
+            self.assertEqual(engine._endgame_solver is endgame_solver, is_kept)
+
+
+class TablebaseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'tablebase.bin')
+        cls.positions_count = tablebase.generate_tablebase(cls.path, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.tablebase = tablebase.Tablebase(self.path)
+
+    def tearDown(self):
+        self.tablebase.close()
+
+    def test_positions_count(self):
+        self.assertEqual(self.tablebase.max_cards, 2)
+        self.assertEqual(
+            self.positions_count,
+            len(set(tablebase.iter_canonical_positions(2)))
+        )
+
+    def test_probe_is_the_same_as_solver(self):
+        random = Random(1)
+        for _ in xrange(300):
+            cards_count = random.randint(1, 2)
+            cards = random.sample(CARDS_BY_ORDINAL, cards_count + 2)
+            cards, enemy_cards = cards[:cards_count], cards[cards_count:]
+            trump = random.choice(CARDS_BY_ORDINAL)
+            self.assertEqual(
+                self.tablebase.probe(cards, enemy_cards, trump),
+                solver.EndgameSolver(trump).solve_move(cards, enemy_cards)[0]
+            )
+
+    def test_canonical_position(self):
+        # the trump suit and the ranks between the cards do not matter
+        self.assertEqual(
+            tablebase.get_canonical_position(
+                to_mask(['7S', 'AS']), to_mask(['9D']), DurakCard('6S')
+            ),
+            tablebase.get_canonical_position(
+                to_mask(['6C', '8C']), to_mask(['7D']), DurakCard('TC')
+            )
+        )
+
+    def test_not_in_tablebase(self):
+        self.assertIsNone(
+            self.tablebase.probe(['6S', '7S', '8S'], ['9S'], '6H')
+        )
+        self.assertIsNone(self.tablebase.probe([], ['9S'], '6H'))
+
+    def test_invalid_file(self):
+        path = os.path.join(self.directory, 'invalid.bin')
+        with open(path, 'wb') as f:
+            f.write('\0' * 64)
+        with self.assertRaises(ValueError):
+            tablebase.Tablebase(path)
+
+    def test_solver_with_tablebase(self):
+        random = Random(2)
+        for _ in xrange(20):
+            cards = random.sample(CARDS_BY_ORDINAL, 8)
+            trump = random.choice(CARDS_BY_ORDINAL)
+            endgame_solver = solver.EndgameSolver(trump, self.tablebase)
+            self.assertEqual(
+                endgame_solver.solve_move(cards[:4], cards[4:])[0],
+                solver.EndgameSolver(trump).solve_move(
+                    cards[:4], cards[4:]
+                )[0]
+            )
+
+
+class MonteCarloEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = mc.MonteCarloEngine(move_time=0.01, seed=0)
+        self.engine.init('6H')
+        self.engine.deal(['7S', '8S', 'TD', 'QC', 'AH', '9H'], {})
+        self.gamedata = {
+            'trump': '6H', 'deck_count': 11, 'enemy_count': 6,
+            'on_table': [], 'discarded': [
+                '6C', '7C', '8C', '9C', 'TC', 'JC', '6D', '7D', '8D', '9D',
+                '6S', '9S',
+            ],
+        }
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_sample_position(self):
+        gamedata = dict(self.gamedata, on_table=['QS'])
+        cards = map(DurakCard, ['7S', '8S', 'TD', 'QC', 'AH', '9H'])
+        position = mc.sample_position('respond', cards, gamedata, Random(0))
+
+        self.assertEqual(position.to_move, GameController.PLAYER2)
+        self.assertEqual(position.on_table, (DurakCard('QS'),))
+        self.assertEqual(position.player1_cards, to_mask(cards))
+        self.assertEqual(len(position.deck), 11)
+        self.assertEqual(position.deck[-1], DurakCard('6H'))
+        enemy_cards = list(
+            BitCardSet.from_mask(position.player2_cards, '6H')
+        )
+        self.assertEqual(len(enemy_cards), 6)
+        self.assertEqual(
+            len(
+                set(enemy_cards) | set(position.deck) | set(cards) |
+                set(position.on_table) | set(position.discarded)
+            ),
+            36
+        )
+
+    def test_sample_position_with_known_enemy_cards(self):
+        cards = map(DurakCard, ['7S', '8S', 'TD', 'QC', 'AH', '9H'])
+        random = Random(0)
+        for _ in xrange(10):
+            position = mc.sample_position(
+                'move', cards, dict(self.gamedata, deck_count=12), random,
+                ['KS', 'QH']
+            )
+            enemy_cards = BitCardSet.from_mask(position.player2_cards, '6H')
+            self.assertEqual(len(enemy_cards), 6)
+            self.assertTrue({DurakCard('KS'), DurakCard('QH')} <= enemy_cards)
+            self.assertNotIn(DurakCard('KS'), position.deck)
+            self.assertEqual(len(position.deck), 12)
+
+    def test_run_rollouts_plays_every_legal_action(self):
+        results = mc.run_rollouts(
+            'move', ['7S', '8S', 'TD', 'QC', 'AH', '9H'], [], self.gamedata,
+            0.01, seed=0
+        )
+        self.assertItemsEqual(
+            [action for action, _, _ in results],
+            map(DurakCard, ['7S', '8S', 'TD', 'QC', 'AH', '9H'])
+        )
+        for _, score, count in results:
+            self.assertGreater(count, 0)
+            self.assertTrue(0 <= score <= count)
+
+    def test_commands(self):
+        card = self.engine.move([], self.gamedata)
+        self.assertIn(
+            card, map(DurakCard, ['7S', '8S', 'TD', 'QC', 'AH', '9H'])
+        )
+        self.assertNotIn(card, self.engine._cards)
+
+        gamedata = dict(self.gamedata, enemy_count=5)
+        card = self.engine.respond(['AS'], gamedata)
+        self.assertIn(str(card), ['', 'AH', '9H'])
+
+        gamedata = dict(self.gamedata, on_table=['8H'], enemy_count=5)
+        cards = self.engine.give_more(['8H'], gamedata)
+        self.assertIn(cards, ('', '8S'))
+
+    def test_endgame_is_solved(self):
+        gamedata = dict(self.gamedata, deck_count=0, enemy_count=1)
+        with patch.object(
+                mc.MonteCarloEngine, 'solve_endgame',
+                return_value=(solver.WIN, DurakCard('7S'))) as solve_endgame:
+            self.assertEqual(
+                self.engine.move([], gamedata), DurakCard('7S')
+            )
+        self.assertEqual(solve_endgame.call_args[0][0], 'move')
+
+    def test_rollouts_in_pool(self):
+        engine = mc.MonteCarloEngine(move_time=0.01, jobs=2, seed=0)
+        try:
+            engine.init('6H')
+            engine.deal(['7S', '8S', 'TD', 'QC', 'AH', '9H'], {})
+            results = engine._run_rollouts('move', self.gamedata)
+            self.assertEqual(len(results), 6)
+            self.assertGreaterEqual(min(count for _, _, count in results), 2)
+        finally:
+            engine.close()
+
+
+def play_against_dummy(engine, seed, check=None):
+    # engine plays for PLAYER1 against DummyEngine, all its actions must be
+    # valid; check(controller) is called after every command
+    controller = GameController(seed=seed, log_enabled=False)
+    new_game_data = controller.start_new_game()
+    engines = {controller.PLAYER1: engine, controller.PLAYER2: DummyEngine()}
+    for player, player_engine in engines.iteritems():
+        player_engine.init(str(new_game_data['trump']))
+        player_engine.deal(
+            map(str, new_game_data[player + '_cards']),
+            controller.get_game_data_for(player)
+        )
+
+    while not controller.is_game_over():
+        if check is not None:
+            check(controller)
+
+        on_table = map(str, controller.on_table)
+        if controller.state == controller.States.DEALING:
+            deal_data = controller.deal()
+            for player, player_engine in engines.iteritems():
+                player_engine.deal(
+                    map(str, deal_data[player + '_cards']),
+                    controller.get_game_data_for(player)
+                )
+        elif controller.state == controller.States.RESPONDING:
+            player_engine = engines[
+                controller.PLAYER2 if controller.is_player1_to_move()
+                else controller.PLAYER1
+            ]
+            controller.register_response(player_engine.respond(
+                on_table, controller.get_game_data_for(controller.RESPONDER)
+            ) or None)
+        elif controller.state == controller.States.MOVING:
+            player_engine = engines[controller.to_move]
+            controller.register_move(player_engine.move(
+                on_table, controller.get_game_data_for(controller.MOVER)
+            ) or None)
+        else:
+            player_engine = engines[controller.to_move]
+            controller.register_give_more(player_engine.give_more(
+                on_table, controller.get_game_data_for(controller.MOVER)
+            ).split())
+
+
+class ISMCTSEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ismcts.ISMCTSEngine(move_time=0.01, seed=0)
+        self.engine.init('6H')
+        self.engine.deal(['7S', '8S', 'TD', 'QC', 'AH', '9H'], {})
+        self.gamedata = {
+            'trump': '6H', 'deck_count': 11, 'enemy_count': 6,
+            'on_table': [], 'discarded': [
+                '6C', '7C', '8C', '9C', 'TC', 'JC', '6D', '7D', '8D', '9D',
+                '6S', '9S',
+            ],
+        }
+
+    def test_action_ids(self):
+        for action in (None, DurakCard('6C'), DurakCard('AS'), (),
+                       (DurakCard('7H'), DurakCard('7S'))):
+            action_id = ismcts.get_action_id(action)
+            self.assertTrue(isinstance(action_id, (int, long)))
+            self.assertEqual(ismcts.get_action(action_id), action)
+        action_ids = {
+            ismcts.get_action_id(x) for x in (None, (), DurakCard('AS'))
+        }
+        self.assertEqual(len(action_ids), 3)
+
+    def test_nodes_have_slots(self):
+        self.assertFalse(hasattr(ismcts.Node(), '__dict__'))
+
+    def test_node_budget(self):
+        self.engine.max_nodes = 5
+        self.engine.move([], self.gamedata)
+        self.assertLessEqual(
+            ismcts.count_nodes(self.engine._root), self.engine.max_nodes
+        )
+
+    def test_tree_is_kept_between_commands(self):
+        roots = []
+        search = self.engine._search
+
+        def search_mock(*args):
+            roots.append(self.engine._root)
+            return search(*args)
+
+        with patch.object(self.engine, '_search', side_effect=search_mock):
+            for seed in xrange(2):
+                play_against_dummy(self.engine, seed)
+
+        self.assertGreater(len(roots), 10)
+        # the number depends on the time, but the previous searches must
+        # have visited some of the positions
+        self.assertTrue(any(
+            root is not None and root.visits for root in roots
+        ))
+
+    def test_tree_follows_actions(self):
+        card = self.engine.move([], self.gamedata)
+        root = self.engine._root
+        self.assertEqual(root.action, ismcts.get_action_id(card))
+
+        child = root.children[0]
+        on_table = [str(card), str(ismcts.get_action(child.action))]
+        with patch.object(self.engine, '_search', return_value=None) as \
+                search_mock:
+            self.engine.move(on_table, self.gamedata)
+        search_mock.assert_called_once_with('move', dict(
+            self.gamedata, on_table=on_table
+        ))
+        self.assertIs(self.engine._root, child.get_child(ismcts.PASS))
+
+    def test_given_more_cards(self):
+        engine = self.engine
+        engine._table = map(DurakCard, ['7S', '8S'])
+        engine._cards = BitCardSet(['7D', '9D', 'TD', 'JD'], '6H')
+        engine._deck_count = 10
+        cards = map(DurakCard, ['7S', '8S', '8C', 'AS', 'KS'])
+        # 8C and AS are more than the deck would give
+        self.assertEqual(engine._get_given_more(cards[:4]), cards[2:4])
+
+        engine._cards = BitCardSet(['7D', '9D'], '6H')
+        # the deck has given both cards
+        self.assertEqual(engine._get_given_more(cards[:2] + cards[3:]), [])
+        # 8C may be given more or be from the deck
+        self.assertIsNone(engine._get_given_more(cards[:4]))
+        engine._deck_count = 0
+        self.assertEqual(engine._get_given_more(cards[:3]), cards[2:3])
+
+
+class TrackingEngine(DummyEngine):
+
+    def init(self, trump):
+        self.tracker = tracker.CardTracker(trump)
+        return super(TrackingEngine, self).init(trump)
+
+    def deal(self, cards, gamedata):
+        self.tracker.deal(cards, gamedata)
+        return super(TrackingEngine, self).deal(cards, gamedata)
+
+    def move(self, on_table, gamedata):
+        self.tracker.observe(on_table, gamedata)
+        card = super(TrackingEngine, self).move(on_table, gamedata)
+        self.tracker.play([card] if card else [])
+        return card
+
+    def respond(self, on_table, gamedata):
+        self.tracker.observe(on_table, gamedata)
+        card = super(TrackingEngine, self).respond(on_table, gamedata)
+        self.tracker.play([card] if card else [])
+        return card
+
+    def give_more(self, on_table, gamedata):
+        self.tracker.observe(on_table, gamedata)
+        cards = super(TrackingEngine, self).give_more(on_table, gamedata)
+        self.tracker.play(cards.split())
+        return cards
+
+
+class CardTrackerTest(unittest.TestCase):
+
+    def test_tracker_agrees_with_game(self):
+        engine = TrackingEngine()
+        enemy_known_counts = []
+
+        def check(controller):
+            card_tracker = engine.tracker
+            own = to_mask(controller._player1.cards)
+            enemy = to_mask(controller._player2.cards)
+            deck = to_mask(controller._deck)
+
+            self.assertEqual(card_tracker.own, own)
+            # the cards played by the enemy since the last command of the
+            # engine are on the table
+            on_table = to_mask(controller._on_table)
+            self.assertEqual(card_tracker.enemy & ~(enemy | on_table), 0)
+            self.assertEqual(
+                enemy & ~(card_tracker.enemy | card_tracker.unknown), 0
+            )
+            self.assertEqual(
+                deck & ~(card_tracker.unknown | card_tracker.deck_known), 0
+            )
+            self.assertEqual(
+                card_tracker.discarded, to_mask(controller._discarded)
+            )
+            self.assertEqual(
+                bit_count(card_tracker.unknown),
+                card_tracker.enemy_unknown_count + len(controller._deck) -
+                (1 if controller._deck else 0)
+            )
+            enemy_known_counts.append(bit_count(card_tracker.enemy))
+
+        for seed in xrange(5):
+            play_against_dummy(engine, seed, check)
+        self.assertTrue(any(enemy_known_counts))
+
+    def test_taken_cards_are_known(self):
+        card_tracker = tracker.CardTracker('6H')
+        gamedata = {
+            'trump': '6H', 'deck_count': 24, 'enemy_count': 6,
+            'on_table': [], 'discarded': [],
+        }
+        card_tracker.deal(['7S', '8S', 'TD', 'QC', 'AH', '9H'], gamedata)
+        card_tracker.play(['7S'])
+        # the enemy has taken 7S, and 7C is given more
+        card_tracker.observe(['7S'], dict(gamedata, enemy_count=6))
+        card_tracker.play(['7C'])
+        card_tracker.deal(
+            ['JS'], dict(gamedata, deck_count=23, enemy_count=8)
+        )
+
+        self.assertEqual(
+            card_tracker.get_enemy_cards(), map(DurakCard, ['7C', '7S'])
+        )
+        self.assertEqual(card_tracker.enemy_unknown_count, 6)
+        self.assertEqual(card_tracker.on_table, 0)
+        self.assertEqual(
+            card_tracker.own, to_mask(['8S', 'TD', 'QC', 'AH', '9H', 'JS'])
+        )
+        self.assertNotIn(DurakCard('JS'), card_tracker.get_unknown_cards())
+        self.assertNotIn(DurakCard('6H'), card_tracker.get_unknown_cards())
+
+    def test_empty_deck(self):
+        card_tracker = tracker.CardTracker('6H')
+        discarded = [
+            str(card) for card in CARDS_BY_ORDINAL
+            if card not in map(DurakCard, ['7S', '8S', '6H', 'AS'])
+        ]
+        card_tracker.deal(['7S', '8S'], {
+            'trump': '6H', 'deck_count': 0, 'enemy_count': 2,
+            'on_table': [], 'discarded': discarded,
+        })
+        self.assertEqual(card_tracker.unknown, 0)
+        self.assertEqual(card_tracker.enemy, to_mask(['6H', 'AS']))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Tracks what the engine knows about the cards: own cards, the enemy cards
+# it has seen (taken from the table, the trump card drawn by the enemy),
+# the cards on the table, the discarded ones and the unknown ones, which
+# are either in the enemy hand or in the deck. The trump card is not
+# unknown while the deck is not empty: it is the last card of the deck.
+#
+# Every set is a card mask (as in BitCardSet), and an update only looks at
+# the cards of the command (new discarded cards, the table, dealt cards),
+# not at the whole history. An engine calls deal from its deal method,
+# observe at the start of move, respond and give_more and play with the
+# cards it puts on the table.
+from durak.utils.cards import (
+    bit_count, CARDS_BY_ORDINAL, DurakCard, iter_mask, to_mask
+)
+
+
+_ALL_CARDS_MASK = (1 << len(CARDS_BY_ORDINAL)) - 1
+
+
+class CardTracker(object):
+
+    def __init__(self, trump):
+        self.trump = DurakCard(trump)
+        self._trump_mask = 1 << self.trump.ordinal
+
+        self.own = 0
+        self.enemy = 0
+        self.on_table = 0
+        self.discarded = 0
+        self.unknown = _ALL_CARDS_MASK ^ self._trump_mask
+
+        self.deck_count = len(CARDS_BY_ORDINAL) - 12
+        self.enemy_count = 6
+        self._discarded_count = 0
+
+    @property
+    def deck_known(self):
+        # the known cards of the deck: the trump card if it is not empty
+        return self._trump_mask if self.deck_count else 0
+
+    @property
+    def enemy_unknown_count(self):
+        # the number of the enemy cards that are not known
+        return self.enemy_count - bit_count(self.enemy)
+
+    def get_enemy_cards(self):
+        return list(iter_mask(self.enemy))
+
+    def get_unknown_cards(self):
+        return list(iter_mask(self.unknown))
+
+    def deal(self, cards, gamedata=None):
+        # cards are the new own cards
+        self._update(gamedata)
+        mask = to_mask(cards)
+        if self.on_table:
+            # the move is over, and the cards on the table that are neither
+            # discarded nor taken by the engine are taken by the enemy
+            self.enemy |= self.on_table & ~(self.discarded | mask)
+            self.on_table = 0
+
+        self._remove(mask)
+        self.own |= mask
+        self._check_deck()
+
+    def observe(self, on_table, gamedata=None):
+        # the new cards on the table are played by the enemy
+        self._update(gamedata)
+        mask = to_mask(on_table)
+        self._remove(mask & ~self.on_table)
+        self.on_table = mask
+        self._check_deck()
+
+    def play(self, cards):
+        mask = to_mask(cards)
+        self.own &= ~mask
+        self.on_table |= mask
+
+    def _remove(self, mask):
+        # the cards are seen, so they are not in the enemy hand any more or
+        # not unknown
+        self.enemy &= ~mask
+        self.unknown &= ~mask
+
+    def _update(self, gamedata):
+        if not gamedata:
+            return
+
+        discarded = gamedata['discarded']
+        mask = to_mask(discarded[self._discarded_count:])
+        self._discarded_count = len(discarded)
+        self._remove(mask)
+        self.discarded |= mask
+
+        self.enemy_count = gamedata['enemy_count']
+        self.deck_count = gamedata['deck_count']
+
+    def _check_deck(self):
+        if self.deck_count:
+            return
+        # when the deck is empty, the trump card is in the enemy hand if it
+        # is not seen, and so are all the unknown cards
+        seen = self.own | self.enemy | self.on_table | self.discarded
+        self.enemy |= self.unknown | (self._trump_mask & ~seen)
+        self.unknown = 0
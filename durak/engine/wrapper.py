@@ -1,44 +1,252 @@
 # -*- coding: utf-8 -*-
+import collections
+from functools import wraps
+import importlib
 import logging
 import json
+import os
+import select
 import subprocess
+import time
 
+from durak.engine import compact
+from durak.engine.base import BaseEngine
+from durak.engine.stats import TimeStats
 from durak.utils.cards import DurakCard
 
 
 logger = logging.getLogger(__name__)
 
+# engine paths like "py:durak.engine.dummy:DummyEngine" are BaseEngine
+# subclasses that are run in the same process
+IN_PROCESS_PREFIX = 'py:'
+
 
 class EngineWrapperException(Exception):
     pass
 
 
-class EngineWrapper(object):
+class EngineTimeoutException(EngineWrapperException):
 
-    def __init__(self, engine_path):
-        self._process = subprocess.Popen(
-            engine_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE
-        )
+    def __init__(self, engine, message):
+        super(EngineTimeoutException, self).__init__(message)
+        self.engine = engine
+
+
+class EngineOutputException(EngineWrapperException):
+    # the engine has written something that is not a valid output of the
+    # command or has closed its output
+
+    def __init__(self, engine, message):
+        super(EngineOutputException, self).__init__(message)
+        self.engine = engine
+
+
+def _checks_output(method):
+    # an invalid output of the engine raises EngineOutputException, see
+    # BaseEngineWrapper._invalid_output
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except (EngineTimeoutException, EngineOutputException):
+            raise
+        except EngineWrapperException as e:
+            raise self._invalid_output(e)
+    return wrapper
+
+
+class TimeControl(object):
+    # Time limits of an engine in seconds, None means no limit: move_time is
+    # the limit for one command, game_time is the budget for the whole game
+    # and increment is added to it after every move, respond and give_more.
+
+    def __init__(self, move_time=None, game_time=None, increment=0.0):
+        self.move_time = move_time
+        self.game_time = game_time
+        self.increment = increment
+
+
+def create_engine_wrapper(engine_path, asynchronous=False, **kwargs):
+    # in-process engines answer at once, so they are never asynchronous,
+    # EngineMultiplexer accepts them too
+    if engine_path.startswith(IN_PROCESS_PREFIX):
+        return InProcessEngineWrapper(engine_path, **kwargs)
+    if asynchronous:
+        return AsyncEngineWrapper(engine_path, **kwargs)
+    return EngineWrapper(engine_path, **kwargs)
+
+
+class BaseEngineWrapper(object):
+    SESSION = 'session'
+    NO_GAMEDATA = 'no_gamedata'
+    DISCARDED_DELTA = 'discarded_delta'
+    COMPACT = 'compact'
+
+    LAZY_GAMEDATA_OPTIONS = (NO_GAMEDATA, DISCARDED_DELTA)
+
+    # commands with cards in the output
+    CARDS_OUTPUT_COMMANDS = ('move', 'respond', 'give_more')
+
+    def __init__(self, session=False, lazy_gamedata=False, compact=False,
+                 time_control=None):
+        # if session is True, the engine is asked to play all the games in
+        # one process; engines that don't accept it are restarted every game
+        self._requested_options = []
+        if session:
+            self._requested_options.append(self.SESSION)
+        # if lazy_gamedata is True, engines can ask for no gamedata at all
+        # or only for the cards discarded since the previous command
+        if lazy_gamedata:
+            self._requested_options.extend(self.LAZY_GAMEDATA_OPTIONS)
+        # if compact is True, engines can ask for the compact encoding of
+        # commands instead of text and json
+        if compact:
+            self._requested_options.append(self.COMPACT)
+        self._options = set()
+        self._sent_discarded_count = 0
+
+        self._time_control = time_control
+        self._game_time_left = None
+        self.time_stats = TimeStats()
+
+    @property
+    def options(self):
+        return frozenset(self._options)
 
+    def _init(self, trump):
+        raise NotImplementedError
+
+    def _call(self, command, cards, gamedata=None):
+        raise NotImplementedError
+
+    def game_end(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def _kill(self):
+        # stops the engine at once, e.g. after it has lost on time
+        self.close()
+
+    @_checks_output
     def init(self, trump):
-        self._write_command('init', [trump])
-        output = self._get_output()
-        if output != 'ok':
+        self._start_clock()
+        self._parse_init_output(self._init(trump))
+
+    def _start_clock(self):
+        if self._time_control is not None:
+            self._game_time_left = self._time_control.game_time
+
+    def _get_time_limit(self):
+        if self._time_control is None:
+            return None
+
+        limits = [
+            limit
+            for limit in (self._time_control.move_time, self._game_time_left)
+            if limit is not None
+        ]
+        if not limits:
+            return None
+        return max(min(limits), 0.0)
+
+    def _register_time(self, command, command_time):
+        self.time_stats.add(command, command_time)
+        if self._game_time_left is not None:
+            self._game_time_left -= command_time
+            if command in self.CARDS_OUTPUT_COMMANDS:
+                self._game_time_left += self._time_control.increment
+
+    def _time_out(self, command, command_time):
+        # The engine has lost on time. It is stopped, so that its late
+        # output is not taken for the output of the next command.
+        self.time_stats.add(command, command_time)
+        self.time_stats.losses_on_time += 1
+        self._kill()
+        return EngineTimeoutException(
+            self, 'No output of %s in time (%.3f s)' % (command, command_time)
+        )
+
+    def _invalid_output(self, error):
+        # The engine has lost because of an invalid output. It is stopped
+        # too, as its next outputs can't be trusted.
+        self._kill()
+        return EngineOutputException(self, str(error))
+
+    def _parse_init_output(self, output):
+        output = output.split()
+        if not output or output[0] != 'ok':
             raise EngineWrapperException(
-                'Init should return "ok", got %s instead' % output
+                'Init should return "ok", got %s instead' % ' '.join(output)
+            )
+        self._options = set(output[1:]) & set(self._requested_options)
+        self._sent_discarded_count = 0
+
+    def _prepare_gamedata(self, gamedata):
+        # gamedata can be a dict or a function that returns it, so that it
+        # is not built at all for engines that don't need it. With
+        # discarded_delta the function gets new_discarded_from (see
+        # GameController.get_game_data_for) and can return only the new
+        # discarded cards as new_discarded instead of the full discarded.
+        if self.NO_GAMEDATA in self._options:
+            return None
+
+        if callable(gamedata):
+            if self.DISCARDED_DELTA in self._options:
+                gamedata = gamedata(
+                    new_discarded_from=self._sent_discarded_count
+                )
+            else:
+                gamedata = gamedata()
+
+        if gamedata is not None and self.DISCARDED_DELTA in self._options:
+            if 'discarded' in gamedata:
+                gamedata = dict(gamedata)
+                gamedata['new_discarded'] = (
+                    gamedata.pop('discarded')[self._sent_discarded_count:]
+                )
+            # discarded cards are only added during a game
+            self._sent_discarded_count += len(
+                gamedata.get('new_discarded', ())
             )
 
+        return gamedata
+
+    @_checks_output
     def deal(self, cards, gamedata=None):
-        self._write_command('deal', cards, gamedata)
-        output = self._get_output()
+        self._parse_deal_output(
+            self._call('deal', cards, self._prepare_gamedata(gamedata))
+        )
+
+    @_checks_output
+    def move(self, on_table, gamedata=None):
+        return self._parse_move_output(
+            self._call('move', on_table, self._prepare_gamedata(gamedata))
+        )
+
+    @_checks_output
+    def respond(self, on_table, gamedata=None):
+        return self._parse_respond_output(
+            self._call('respond', on_table, self._prepare_gamedata(gamedata))
+        )
+
+    @_checks_output
+    def give_more(self, on_table, gamedata=None):
+        return self._parse_give_more_output(
+            self._call('give_more', on_table, self._prepare_gamedata(gamedata))
+        )
+
+    @staticmethod
+    def _parse_deal_output(output):
         if output != 'ok':
             raise EngineWrapperException(
                 'Deal should return "ok", got %s instead' % output
             )
 
-    def move(self, on_table, gamedata=None):
-        self._write_command('move', on_table, gamedata)
-        output = self._get_output()
+    @staticmethod
+    def _parse_move_output(output):
         if not output:
             return None
 
@@ -51,9 +259,8 @@ class EngineWrapper(object):
 
         return card
 
-    def respond(self, on_table, gamedata=None):
-        self._write_command('respond', on_table, gamedata)
-        output = self._get_output()
+    @staticmethod
+    def _parse_respond_output(output):
         if not output:
             return None
 
@@ -66,9 +273,8 @@ class EngineWrapper(object):
 
         return card
 
-    def give_more(self, on_table, gamedata=None):
-        self._write_command('give_more', on_table, gamedata)
-        output = self._get_output()
+    @staticmethod
+    def _parse_give_more_output(output):
         if not output:
             return None
 
@@ -82,11 +288,131 @@ class EngineWrapper(object):
 
         return cards
 
+
+class EngineWrapper(BaseEngineWrapper):
+    # seconds for the engine to exit after quit or game_end, then it is
+    # killed
+    EXIT_TIMEOUT = 1.0
+
+    def __init__(self, engine_path, session=False, lazy_gamedata=False,
+                 compact=False, time_control=None):
+        super(EngineWrapper, self).__init__(
+            session=session, lazy_gamedata=lazy_gamedata, compact=compact,
+            time_control=time_control
+        )
+        self._engine_path = engine_path
+        # output read from the engine but not parsed yet: the incomplete
+        # last line and the full lines with the times they were read at
+        self._buffer = ''
+        self._lines = collections.deque()
+        # the time the last line returned by pop_output was read at
+        self.output_read_at = None
+
+        self._process = None
+        self._start()
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            self._engine_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self._buffer = ''
+        self._lines.clear()
+
+    def fileno(self):
+        return self._process.stdout.fileno()
+
+    def _init(self, trump):
+        started_at = time.time()
+        self._send_init(trump)
+        return self._wait_output('init', started_at)
+
+    def _send_init(self, trump):
+        if self._process is None:
+            self._start()
+
+        if self._requested_options:
+            self._write_command(
+                'init', [trump], {'options': self._requested_options}
+            )
+        else:
+            self._write_command('init', [trump])
+
+    def _call(self, command, cards, gamedata=None):
+        started_at = time.time()
+        self._send(command, cards, gamedata)
+        return self._decode_output(
+            command, self._wait_output(command, started_at)
+        )
+
+    def _wait_output(self, command, started_at):
+        # the round trip time of the command is counted from started_at
+        output = self._get_output(self._get_time_limit())
+        command_time = time.time() - started_at
+
+        if output is None:
+            raise self._time_out(command, command_time)
+        self._register_time(command, command_time)
+        return output
+
+    def _send(self, command, cards, gamedata=None):
+        if self.COMPACT not in self._options:
+            self._write_command(command, cards, gamedata)
+        elif self.DISCARDED_DELTA in self._options:
+            self._write(compact.encode_command(
+                command, cards, gamedata, 'new_discarded'
+            ))
+        else:
+            self._write(compact.encode_command(command, cards, gamedata))
+
+    def _decode_output(self, command, output):
+        if (self.COMPACT not in self._options or
+                command not in self.CARDS_OUTPUT_COMMANDS):
+            return output
+
+        try:
+            return ' '.join(compact.decode_cards(output))
+        except KeyError:
+            raise EngineWrapperException(
+                'Can not decode compact result of %s: %s' % (command, output)
+            )
+
     def game_end(self):
         if self._process is not None:
             self._write('game_end')
-            self._process.kill()
-            self._process = None
+            if self.SESSION not in self._options:
+                self.close()
+
+    def close(self):
+        # the engine gets quit (in a session) and EOF and can run its
+        # shutdown code, it is killed only if it does not exit in time
+        self._stop(kill=False)
+
+    def _kill(self):
+        self._stop(kill=True)
+
+    def _stop(self, kill):
+        if self._process is None:
+            return
+
+        process = self._process
+        try:
+            if not kill and self.SESSION in self._options:
+                self._write('quit')
+            process.stdin.close()
+        except IOError:
+            # the engine has already exited
+            pass
+        self._process = None
+        self._options = set()
+
+        if not kill:
+            deadline = time.time() + self.EXIT_TIMEOUT
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.001)
+        if process.poll() is None:
+            process.kill()
+        # the exited process is reaped, so that it does not stay a zombie
+        process.wait()
 
     def _write(self, line):
         logger.debug('sending: (' + str(id(self)) + '): %s' % line)
@@ -98,7 +424,303 @@ class EngineWrapper(object):
             line += (' ## ' + json.dumps(gamedata))
         self._write(line.strip())
 
-    def _get_output(self):
+    def _get_output(self, time_limit=None):
+        # returns None if there is no output in time_limit seconds
+        if time_limit is not None:
+            return self._read_output(time_limit)
+
         result = self._process.stdout.readline().strip()
         logger.debug('receiving: (' + str(id(self)) + '): %s' % result)
         return result
+
+    def _read_output(self, time_limit):
+        deadline = time.time() + time_limit
+        output = self.pop_output()
+        while output is None:
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([self], [], [], timeout)[0]:
+                return None
+            self.read_available()
+            output = self.pop_output()
+        return output
+
+    def read_available(self):
+        # reads what the engine has written without blocking on a full line,
+        # should be called only when select says the output is ready
+        data = os.read(self.fileno(), 65536)
+        read_at = time.time()
+        if not data:
+            raise EngineWrapperException(
+                'Engine %s closed its output' % self._engine_path
+            )
+
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()
+        self._lines.extend((line, read_at) for line in lines)
+
+    def pop_output(self):
+        # returns the next full line of the output or None
+        if not self._lines:
+            return None
+
+        result, self.output_read_at = self._lines.popleft()
+        result = result.strip()
+        logger.debug('receiving: (' + str(id(self)) + '): %s' % result)
+        return result
+
+
+class InProcessEngineWrapper(BaseEngineWrapper):
+    # Runs a BaseEngine subclass given as "py:package.module:ClassName"
+    # without a subprocess: commands are direct method calls and the engine
+    # gets the same arguments it would get from BaseEngine.run. There is no
+    # serialization, so only the no_gamedata option is requested and compact
+    # is ignored.
+
+    LAZY_GAMEDATA_OPTIONS = (BaseEngineWrapper.NO_GAMEDATA,)
+
+    def __init__(self, engine_path, session=False, lazy_gamedata=False,
+                 compact=False, time_control=None):
+        super(InProcessEngineWrapper, self).__init__(
+            session=session, lazy_gamedata=lazy_gamedata,
+            time_control=time_control
+        )
+        self._engine_class = self._load_engine_class(engine_path)
+        self._engine = None
+
+    @staticmethod
+    def _load_engine_class(engine_path):
+        try:
+            module_name, class_name = (
+                engine_path[len(IN_PROCESS_PREFIX):].split(':')
+            )
+            engine_class = getattr(
+                importlib.import_module(module_name), class_name
+            )
+        except (ValueError, ImportError, AttributeError):
+            raise EngineWrapperException(
+                'Can not load engine class %s' % engine_path
+            )
+
+        if not (isinstance(engine_class, type) and
+                issubclass(engine_class, BaseEngine)):
+            raise EngineWrapperException(
+                '%s is not a BaseEngine subclass' % engine_path
+            )
+        return engine_class
+
+    def _init(self, trump):
+        if self._engine is None:
+            self._engine = self._engine_class()
+
+        return self._timed_call(
+            'init', self._engine._init, str(trump), self._requested_options
+        )
+
+    def _call(self, command, cards, gamedata=None):
+        output = self._timed_call(
+            command, getattr(self._engine, command),
+            map(str, cards), gamedata=gamedata or {}
+        )
+        return str(output).strip()
+
+    def _timed_call(self, command, method, *args, **kwargs):
+        # the engine can't be stopped in the middle of a command, so the
+        # time limit is checked when it returns
+        time_limit = self._get_time_limit()
+        started_at = time.time()
+        output = method(*args, **kwargs)
+        command_time = time.time() - started_at
+
+        if time_limit is not None and command_time > time_limit:
+            raise self._time_out(command, command_time)
+        self._register_time(command, command_time)
+        return output
+
+    def game_end(self):
+        if self.SESSION not in self._options:
+            self.close()
+
+    def close(self):
+        self._engine = None
+        self._options = set()
+
+
+class EngineRequest(object):
+    # A command sent by AsyncEngineWrapper whose output is not read yet
+
+    def __init__(self, engine, command, parse_output):
+        self.engine = engine
+        self._command = command
+        self._parse_output = parse_output
+
+        self._started_at = time.time()
+        time_limit = engine._get_time_limit()
+        if time_limit is None:
+            self.deadline = None
+        else:
+            self.deadline = self._started_at + time_limit
+
+    def get_result(self, output, read_at=None):
+        # read_at is the time the output was read at, the current time by
+        # default; an invalid output raises EngineOutputException
+        if read_at is None:
+            read_at = time.time()
+        self.engine._register_time(self._command, read_at - self._started_at)
+        try:
+            return self._parse_output(
+                self.engine._decode_output(self._command, output)
+            )
+        except EngineWrapperException as e:
+            raise self.engine._invalid_output(e)
+
+    def time_out(self):
+        return self.engine._time_out(
+            self._command, time.time() - self._started_at
+        )
+
+
+class AsyncEngineWrapper(EngineWrapper):
+    # The same as EngineWrapper, but init, deal, move, respond and give_more
+    # don't wait for the engine: they send the command and return an
+    # EngineRequest. The outputs are read by EngineMultiplexer, so one
+    # process can play many games at once.
+
+    def init(self, trump):
+        self._start_clock()
+        request = EngineRequest(self, 'init', self._parse_init_output)
+        self._send_init(trump)
+        return request
+
+    def deal(self, cards, gamedata=None):
+        request = EngineRequest(self, 'deal', self._parse_deal_output)
+        self._send('deal', cards, self._prepare_gamedata(gamedata))
+        return request
+
+    def move(self, on_table, gamedata=None):
+        request = EngineRequest(self, 'move', self._parse_move_output)
+        self._send('move', on_table, self._prepare_gamedata(gamedata))
+        return request
+
+    def respond(self, on_table, gamedata=None):
+        request = EngineRequest(self, 'respond', self._parse_respond_output)
+        self._send('respond', on_table, self._prepare_gamedata(gamedata))
+        return request
+
+    def give_more(self, on_table, gamedata=None):
+        request = EngineRequest(
+            self, 'give_more', self._parse_give_more_output
+        )
+        self._send('give_more', on_table, self._prepare_gamedata(gamedata))
+        return request
+
+
+class EngineMultiplexer(object):
+    # Plays games concurrently in one process. A game loop is a generator
+    # that yields the results of engine commands and gets back their
+    # values: EngineRequest objects are resolved when the engine answers,
+    # everything else (e.g. results of in-process engines) is sent back at
+    # once.
+
+    def __init__(self):
+        # engine -> (key, game_loop, request)
+        self._waiting = {}
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def add(self, key, game_loop):
+        # returns True if the game loop has already finished
+        finished = []
+        self._advance(key, game_loop, None, finished)
+        return bool(finished)
+
+    def wait(self):
+        # blocks until some game loops finish and returns their keys
+        finished = []
+        while not finished and self._waiting:
+            ready, _, _ = select.select(
+                list(self._waiting), [], [], self._get_timeout()
+            )
+            # everything ready is read before any game loop is resumed, so
+            # the time a game loop takes is not counted for other engines
+            self._read(ready, finished)
+            for engine in ready:
+                self._dispatch(engine, finished)
+            self._check_deadlines(finished)
+        return finished
+
+    def _read(self, engines, finished):
+        for engine in engines:
+            try:
+                engine.read_available()
+            except EngineWrapperException as e:
+                self._fail(engine, engine._invalid_output(e), finished)
+
+    def _get_timeout(self):
+        deadlines = [
+            request.deadline
+            for _, _, request in self._waiting.itervalues()
+            if request.deadline is not None
+        ]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.time(), 0.0)
+
+    def _check_deadlines(self, finished):
+        # the game loops of engines that have lost on time get
+        # EngineTimeoutException
+        now = time.time()
+        expired = [
+            engine
+            for engine, (_, _, request) in self._waiting.iteritems()
+            if request.deadline is not None and request.deadline <= now
+        ]
+        if not expired:
+            return
+
+        # the output could have come while the other game loops were run
+        ready, _, _ = select.select(expired, [], [], 0)
+        self._read(ready, finished)
+        for engine in ready:
+            self._dispatch(engine, finished)
+
+        for engine in expired:
+            if engine not in self._waiting:
+                continue
+            request = self._waiting[engine][2]
+            if request.deadline is not None and request.deadline <= now:
+                self._fail(engine, request.time_out(), finished)
+
+    def _fail(self, engine, exception, finished):
+        # throws the exception into the game loop waiting for the engine
+        if engine in self._waiting:
+            key, game_loop, _ = self._waiting.pop(engine)
+            self._advance(key, game_loop, None, finished, exception)
+
+    def _dispatch(self, engine, finished):
+        while engine in self._waiting:
+            output = engine.pop_output()
+            if output is None:
+                return
+
+            key, game_loop, request = self._waiting.pop(engine)
+            try:
+                result = request.get_result(output, engine.output_read_at)
+            except EngineOutputException as e:
+                self._advance(key, game_loop, None, finished, e)
+            else:
+                self._advance(key, game_loop, result, finished)
+
+    def _advance(self, key, game_loop, value, finished, exception=None):
+        try:
+            if exception is None:
+                request = game_loop.send(value)
+            else:
+                request = game_loop.throw(exception)
+            while not isinstance(request, EngineRequest):
+                request = game_loop.send(request)
+        except StopIteration:
+            finished.append(key)
+            return
+
+        self._waiting[request.engine] = (key, game_loop, request)
@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 from durak.gamelogger.logger import GameLogger
-from durak.gamelogger.log_viewer import LogViewer
\ No newline at end of file
+from durak.gamelogger.log_viewer import LogViewer
+from durak.gamelogger.writer import LogWriter
+from durak.gamelogger.compressed import CompressedLogWriter
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Compressed game logs. The file is MAGIC and then blocks, each of them is
+# a header (the sizes of the next two parts), the zlib-compressed JSON list
+# of the titles of the games and the zlib-compressed game logs in the usual
+# text format (GameLogger.dumps). So the games can be listed by reading the
+# headers and the titles only, and a game is read by decompressing one
+# block.
+#
+# The file is only appended to, a block is written at once by a flush. If
+# the process is killed while a block is written, the rest of the file is
+# still valid: the incomplete last block is ignored by the readers and cut
+# off by CompressedLogWriter, which can append games to an existing file.
+# LogViewer reads both formats.
+#
+# On close the writer appends the index: the zlib-compressed JSON list of
+# all the blocks (as returned by read_index) and INDEX_FOOTER (its size and
+# INDEX_MAGIC). The readers get the list of games from it at once, walking
+# the block headers only if there is no valid index (the log has not been
+# closed). The index is cut off when games are appended to the file.
+import json
+import struct
+import zlib
+
+from durak.gamelogger.writer import LogWriter
+
+
+MAGIC = 'DURAKLZ1'
+BLOCK_HEADER = struct.Struct('<II')
+INDEX_MAGIC = 'DURAKIDX'
+INDEX_FOOTER = struct.Struct('<I8s')
+
+
+class InvalidCompressedLog(ValueError):
+    pass
+
+
+def is_compressed_log(f):
+    # f is an open file, it is read from the start
+    f.seek(0)
+    is_compressed = f.read(len(MAGIC)) == MAGIC
+    f.seek(0)
+    return is_compressed
+
+
+def read_index(f):
+    # (the end of the last complete block, the list of blocks), every block
+    # is [offset of the game logs, their size, titles of the games]
+    f.seek(0, 2)
+    file_size = f.tell()
+    f.seek(0)
+    if f.read(len(MAGIC)) != MAGIC:
+        raise InvalidCompressedLog('The file is not a compressed log')
+
+    index = _read_trailing_index(f, file_size)
+    if index is not None:
+        return index
+    return _walk_blocks(f, file_size)
+
+
+def _read_trailing_index(f, file_size):
+    # the index written on close, None if there is no valid one
+    if file_size < len(MAGIC) + INDEX_FOOTER.size:
+        return None
+    f.seek(file_size - INDEX_FOOTER.size)
+    index_size, index_magic = INDEX_FOOTER.unpack(f.read(INDEX_FOOTER.size))
+    end = file_size - INDEX_FOOTER.size - index_size
+    if index_magic != INDEX_MAGIC or end < len(MAGIC):
+        return None
+
+    f.seek(end)
+    try:
+        blocks = json.loads(zlib.decompress(f.read(index_size)))
+    except (zlib.error, ValueError):
+        return None
+
+    # the blocks must go one after another up to the index
+    block_end = len(MAGIC)
+    for offset, size, titles in blocks:
+        if offset < block_end + BLOCK_HEADER.size:
+            return None
+        block_end = offset + size
+    if block_end != end:
+        return None
+    return end, blocks
+
+
+def _walk_blocks(f, file_size):
+    end = len(MAGIC)
+    blocks = []
+    while end + BLOCK_HEADER.size <= file_size:
+        f.seek(end)
+        titles_size, size = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+        offset = end + BLOCK_HEADER.size + titles_size
+        if offset + size > file_size:
+            break
+        try:
+            titles = json.loads(zlib.decompress(f.read(titles_size)))
+        except (zlib.error, ValueError):
+            break
+        blocks.append([offset, size, titles])
+        end = offset + size
+    return end, blocks
+
+
+def read_block(f, block):
+    # the game logs of a block of the index as (title, JSON) pairs
+    offset, size, titles = block
+    f.seek(offset)
+    try:
+        data = zlib.decompress(f.read(size))
+    except zlib.error:
+        raise InvalidCompressedLog('Invalid block')
+
+    games = []
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith('####') and line.endswith('####'):
+            games.append((line.strip('#'), []))
+        elif games:
+            games[-1][1].append(line)
+    if len(games) != len(titles):
+        raise InvalidCompressedLog('Invalid block')
+    return [(title, '\n'.join(lines)) for title, lines in games]
+
+
+class CompressedLogWriter(LogWriter):
+    # LogWriter that writes blocks of games_per_block games
+
+    def __init__(self, filename, overwrite=False, games_per_block=100,
+                 flush_interval=None, level=6):
+        self._games_per_block = games_per_block
+        self._level = level
+        super(CompressedLogWriter, self).__init__(
+            filename, overwrite, flush_interval=flush_interval
+        )
+
+    def _open(self, filename, overwrite):
+        try:
+            f = open(filename, 'wb' if overwrite else 'r+b')
+        except IOError:
+            # there is no file to append to
+            f = open(filename, 'wb')
+
+        f.seek(0, 2)
+        if f.tell():
+            if not is_compressed_log(f):
+                f.close()
+                raise InvalidCompressedLog(
+                    '%s is not a compressed log' % filename
+                )
+            # the index and an incomplete block are cut off
+            self._end, self._blocks = read_index(f)
+            f.seek(self._end)
+            f.truncate()
+        else:
+            f.write(MAGIC)
+            f.flush()
+            self._end = len(MAGIC)
+            self._blocks = []
+        return f
+
+    def _is_buffer_full(self):
+        return len(self._buffer) >= self._games_per_block
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        data = zlib.compress(''.join(
+            log_str.encode('utf-8') if isinstance(log_str, unicode)
+            else log_str
+            for log_str in self._buffer
+        ), self._level)
+        titles = [
+            log_str[:log_str.index('\n')].strip().strip('#')
+            for log_str in self._buffer
+        ]
+        compressed_titles = zlib.compress(json.dumps(titles), self._level)
+        self._buffer = []
+        self._buffered_size = 0
+
+        f = self._file
+        f.seek(self._end)
+        f.write(
+            BLOCK_HEADER.pack(len(compressed_titles), len(data)) +
+            compressed_titles + data
+        )
+        f.flush()
+        offset = self._end + BLOCK_HEADER.size + len(compressed_titles)
+        self._blocks.append([offset, len(data), titles])
+        self._end = offset + len(data)
+
+    def _finish(self):
+        index = zlib.compress(json.dumps(self._blocks), self._level)
+        f = self._file
+        f.seek(self._end)
+        f.write(index + INDEX_FOOTER.pack(len(index), INDEX_MAGIC))
+        f.flush()
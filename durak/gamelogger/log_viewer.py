@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import json
 
+from durak.gamelogger.compressed import (
+    InvalidCompressedLog, is_compressed_log, read_block, read_index
+)
 from durak.utils.cards import CardSet, DurakCard
 
 
@@ -27,6 +30,10 @@ class LogViewer(object):
 
         self._filename = filename
         self._game_index = []
+        # blocks of a compressed log (see durak.gamelogger.compressed), None
+        # for a text one, and the last read block as (number, games)
+        self._blocks = None
+        self._block_cache = (None, None)
         self._fill_game_index()
 
     def iterindex(self):
@@ -34,6 +41,9 @@ class LogViewer(object):
 
     def load_game(self, index):
         self._current_game = None
+        if self._blocks is not None:
+            self._load_compressed_game(index)
+            return
 
         file_pos = self._game_index[index]['start_offset']
         size_to_read = -1
@@ -52,6 +62,28 @@ class LogViewer(object):
         except IOError:
             raise InvalidLogFormat(u'Hе могу прочитать файл')
 
+    def _load_compressed_game(self, index):
+        # only the block of the game is read and decompressed
+        game_index_item = self._game_index[index]
+        block_number, games = self._block_cache
+        if block_number != game_index_item['block']:
+            block_number = game_index_item['block']
+            try:
+                with open(self._filename, 'rb') as f:
+                    games = read_block(f, self._blocks[block_number])
+            except IOError:
+                raise InvalidLogFormat(u'Не могу прочитать файл')
+            except InvalidCompressedLog:
+                raise InvalidLogFormat(u'Неверный формат файла')
+            self._block_cache = (block_number, games)
+
+        try:
+            self._current_game = json.loads(
+                games[game_index_item['position']][1]
+            )
+        except ValueError:
+            raise InvalidLogFormat(u'Неверный формат файла')
+
     @property
     def has_game_loaded(self):
         return bool(self._current_game)
@@ -228,32 +260,52 @@ class LogViewer(object):
 
     def _fill_game_index(self):
         self._game_index = []
+        self._blocks = None
+        self._block_cache = (None, None)
 
         try:
             with open(self._filename, 'r') as f:
-                while True:
-                    line = f.readline()
-                    if not line:
-                        break
-
-                    initial_len = len(line)
-                    line = line.strip()
-                    if not line.startswith('####') or not line.endswith('####'):
-                        continue
-
-                    game_index_item = {}
-                    game_index_item['title'] = line.strip('#')
-                    game_index_item['start_offset'] = f.tell()
-                    game_index_item['prev_end_offset'] = (
-                        game_index_item['start_offset'] - initial_len
-                    )
-                    self._game_index.append(game_index_item)
+                if is_compressed_log(f):
+                    self._fill_compressed_game_index(f)
+                else:
+                    self._fill_text_game_index(f)
         except IOError:
             raise InvalidLogFormat(u'Не могу прочитать файл')
+        except InvalidCompressedLog:
+            raise InvalidLogFormat(u'Неверный формат файла')
 
         if not self._game_index:
             raise InvalidLogFormat(u'В файле не найдено игр')
 
+    def _fill_text_game_index(self, f):
+        while True:
+            line = f.readline()
+            if not line:
+                break
+
+            initial_len = len(line)
+            line = line.strip()
+            if not line.startswith('####') or not line.endswith('####'):
+                continue
+
+            game_index_item = {}
+            game_index_item['title'] = line.strip('#')
+            game_index_item['start_offset'] = f.tell()
+            game_index_item['prev_end_offset'] = (
+                game_index_item['start_offset'] - initial_len
+            )
+            self._game_index.append(game_index_item)
+
+    def _fill_compressed_game_index(self, f):
+        _, self._blocks = read_index(f)
+        for block_number, (_, _, titles) in enumerate(self._blocks):
+            for position, title in enumerate(titles):
+                self._game_index.append({
+                    'title': title,
+                    'block': block_number,
+                    'position': position,
+                })
+
     def _get_opposite_player(self, player):
         assert player in (self.PLAYER1, self.PLAYER2)
 
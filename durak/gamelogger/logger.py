@@ -21,9 +21,13 @@ class GameLogger(object):
         self._log['opened_trump'] = str(opened_trump)
         self._log['started_at'] = datetime.now().isoformat()
 
-    def log_after_game(self, winner):
+    def log_after_game(self, winner, lost_on_time=False, forfeited=False):
         self._log['result'] = self._get_result(winner)
         self._log['ended_at'] = datetime.now().isoformat()
+        if lost_on_time:
+            self._log['lost_on_time'] = True
+        if forfeited:
+            self._log['forfeited'] = True
 
     def log_before_move(self, player1_cards, player2_cards, to_move,
                         deck_count):
@@ -61,13 +65,16 @@ class GameLogger(object):
             self._log['result']
         )
 
+    def dumps(self):
+        return '####%s####\n%s\n' % (self._log_title, json.dumps(self._log))
+
     def write_to_file(self, filename, overwrite=False):
         if overwrite:
             open_mode = 'w'
         else:
             open_mode = 'a'
 
-        json_str = json.dumps(self._log)
+        log_str = self.dumps()
 
         with open(filename, open_mode) as f:
-            f.write('####%s####\n%s\n' % (self._log_title, json_str))
+            f.write(log_str)
@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 from cStringIO import StringIO
 from datetime import datetime, timedelta
+import gc
 import json
+import os.path
+import shutil
+import tempfile
+import time
 import unittest
 
 from mock import MagicMock, mock_open, patch
 
-from durak.gamelogger import GameLogger, LogViewer
+from durak.controller import GameController
+from durak.gamelogger import (CompressedLogWriter, GameLogger, LogViewer,
+                              LogWriter, compressed, writer)
 from durak.gamelogger.log_viewer import InvalidLogFormat
 from durak.utils.cards import CardSet, DurakCard
 
@@ -47,6 +54,20 @@ class GameLoggerTest(unittest.TestCase):
 
         self.assertEqual(self.logger._log['result'], '1-0')
         self.assertAlmostNow(self.logger._log['ended_at'])
+        self.assertFalse('lost_on_time' in self.logger._log)
+
+    def test_log_after_game_lost_on_time(self):
+        self.logger.log_after_game(self.logger.PLAYER2, lost_on_time=True)
+
+        self.assertEqual(self.logger._log['result'], '0-1')
+        self.assertTrue(self.logger._log['lost_on_time'])
+        self.assertFalse('forfeited' in self.logger._log)
+
+    def test_log_after_game_forfeited(self):
+        self.logger.log_after_game(self.logger.PLAYER1, forfeited=True)
+
+        self.assertEqual(self.logger._log['result'], '1-0')
+        self.assertTrue(self.logger._log['forfeited'])
 
     def test_log_before_move(self):
         self.logger.log_before_move(
@@ -395,3 +416,251 @@ class LogViewerTest(unittest.TestCase):
         while self.log_viewer.has_prev:
             log_event = self.log_viewer.get_prev()
             self.assertEqual(log_event, next(expected))
+
+
+class LogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'games.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _read(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_logs_are_buffered_till_close(self):
+        log_writer = LogWriter(self.filename)
+        log_writer.write('game1\n')
+        log_writer.write('game2\n')
+        self.assertEqual(self._read(), '')
+
+        log_writer.close()
+        self.assertEqual(self._read(), 'game1\ngame2\n')
+        self.assertTrue(log_writer.closed)
+        # closing again does nothing
+        log_writer.close()
+
+    def test_buffer_size(self):
+        with LogWriter(self.filename, buffer_size=10) as log_writer:
+            log_writer.write('game1\n')
+            self.assertEqual(self._read(), '')
+            log_writer.write('game2\n')
+            self.assertEqual(self._read(), 'game1\ngame2\n')
+            log_writer.write('game3\n')
+        self.assertEqual(self._read(), 'game1\ngame2\ngame3\n')
+
+    def test_overwrite(self):
+        for overwrite, expected in ((False, 'old\nnew\n'), (True, 'new\n')):
+            with open(self.filename, 'w') as f:
+                f.write('old\n')
+            with LogWriter(self.filename, overwrite=overwrite) as log_writer:
+                log_writer.write('new\n')
+            self.assertEqual(self._read(), expected)
+
+    def test_flush_interval(self):
+        with LogWriter(self.filename, flush_interval=0.01) as log_writer:
+            log_writer.write('game1\n')
+            for _ in xrange(100):
+                if self._read():
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self._read(), 'game1\n')
+
+    def test_writers_are_closed_at_exit(self):
+        log_writer = LogWriter(self.filename)
+        log_writer.write('game1\n')
+        writer._close_open_writers()
+        self.assertTrue(log_writer.closed)
+        self.assertEqual(self._read(), 'game1\n')
+
+    def test_dropped_writers_are_closed_at_exit(self):
+        log_writer = LogWriter(self.filename)
+        log_writer.write('game1\n')
+        del log_writer
+        gc.collect()
+        self.assertEqual(self._read(), '')
+        writer._close_open_writers()
+        self.assertEqual(self._read(), 'game1\n')
+
+    def test_controller_writes_finished_games(self):
+        with LogWriter(self.filename) as log_writer:
+            controller = GameController(seed=0, log_writer=log_writer)
+            for _ in xrange(2):
+                controller.start_new_game()
+                controller.register_loss_on_time(controller.PLAYER1)
+                self.assertEqual(self._read(), '')
+
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(len(list(log_viewer.iterindex())), 2)
+
+
+class CompressedLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'games.dlz')
+        # the logs of the written games
+        self.games = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_games(self, log_writer, count):
+        controller = GameController(
+            seed=len(self.games), log_writer=log_writer
+        )
+        for _ in xrange(count):
+            controller.start_new_game()
+            while not controller.is_game_over():
+                if controller.state == controller.States.DEALING:
+                    controller.deal()
+                else:
+                    controller.register_loss_on_time(controller.MOVER)
+            self.games.append(
+                json.loads(controller.dump_log().split('\n')[1])
+            )
+
+    @staticmethod
+    def _get_title(game):
+        logger = GameLogger()
+        logger._log = game
+        return logger._log_title
+
+    def test_log_viewer_reads_compressed_log(self):
+        with CompressedLogWriter(self.filename, games_per_block=2) as \
+                log_writer:
+            self._write_games(log_writer, 5)
+
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(len(list(log_viewer.iterindex())), 5)
+        with patch(
+                'durak.gamelogger.log_viewer.read_block',
+                wraps=compressed.read_block) as read_block_mock:
+            for index in (4, 2, 3):
+                log_viewer.load_game(index)
+                self.assertEqual(
+                    log_viewer._current_game, self.games[index]
+                )
+        # games 2 and 3 are in one block
+        self.assertEqual(read_block_mock.call_count, 2)
+
+    def test_file_is_valid_after_every_block_and_can_be_appended(self):
+        log_writer = CompressedLogWriter(self.filename, games_per_block=2)
+        with self.assertRaises(InvalidLogFormat):
+            # a valid file without games
+            LogViewer(self.filename)
+
+        self._write_games(log_writer, 3)
+        self.assertEqual(len(list(LogViewer(self.filename).iterindex())), 2)
+        log_writer.close()
+
+        with CompressedLogWriter(self.filename) as log_writer:
+            self._write_games(log_writer, 1)
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(
+            [item['title'] for item in log_viewer.iterindex()],
+            [self._get_title(game) for game in self.games]
+        )
+        log_viewer.load_game(3)
+        self.assertEqual(log_viewer._current_game, self.games[3])
+
+    def test_incomplete_block_is_ignored_and_cut_off(self):
+        with CompressedLogWriter(self.filename, games_per_block=2) as \
+                log_writer:
+            self._write_games(log_writer, 4)
+        # the process is killed in the middle of the second block
+        with open(self.filename, 'r+b') as f:
+            _, blocks = compressed.read_index(f)
+            offset, size, _ = blocks[1]
+            f.truncate(offset + size // 2)
+
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(len(list(log_viewer.iterindex())), 2)
+        log_viewer.load_game(1)
+        self.assertEqual(log_viewer._current_game, self.games[1])
+
+        del self.games[2:]
+        with CompressedLogWriter(self.filename) as log_writer:
+            self._write_games(log_writer, 1)
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(
+            [item['title'] for item in log_viewer.iterindex()],
+            [self._get_title(game) for game in self.games]
+        )
+        log_viewer.load_game(2)
+        self.assertEqual(log_viewer._current_game, self.games[2])
+
+    def _read_index(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(0, 2)
+            file_size = f.tell()
+            return (
+                compressed._read_trailing_index(f, file_size),
+                compressed._walk_blocks(f, file_size)
+            )
+
+    def test_closed_log_has_trailing_index(self):
+        with CompressedLogWriter(self.filename, games_per_block=2) as \
+                log_writer:
+            self._write_games(log_writer, 5)
+
+        index, walked_index = self._read_index()
+        self.assertEqual(index, walked_index)
+        self.assertEqual(len(index[1]), 3)
+
+        # the block headers are not read if there is the index
+        with open(self.filename, 'r+b') as f:
+            f.seek(len(compressed.MAGIC))
+            f.write('\0' * compressed.BLOCK_HEADER.size)
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(
+            [item['title'] for item in log_viewer.iterindex()],
+            [self._get_title(game) for game in self.games]
+        )
+        log_viewer.load_game(4)
+        self.assertEqual(log_viewer._current_game, self.games[4])
+
+    def test_index_is_cut_off_when_games_are_appended(self):
+        with CompressedLogWriter(self.filename, games_per_block=2) as \
+                log_writer:
+            self._write_games(log_writer, 3)
+        log_writer = CompressedLogWriter(self.filename, games_per_block=2)
+        self.assertTrue(self._read_index()[0] is None)
+
+        self._write_games(log_writer, 1)
+        log_writer.close()
+        index, walked_index = self._read_index()
+        self.assertEqual(index, walked_index)
+        self.assertEqual(len(index[1]), 3)
+
+    def test_broken_index_is_ignored(self):
+        with CompressedLogWriter(self.filename, games_per_block=2) as \
+                log_writer:
+            self._write_games(log_writer, 3)
+        index, _ = self._read_index()
+        with open(self.filename, 'r+b') as f:
+            f.seek(index[0])
+            f.write('\0')
+
+        self.assertTrue(self._read_index()[0] is None)
+        log_viewer = LogViewer(self.filename)
+        self.assertEqual(len(list(log_viewer.iterindex())), 3)
+
+        with CompressedLogWriter(self.filename) as log_writer:
+            self._write_games(log_writer, 1)
+        self.assertEqual(len(list(LogViewer(self.filename).iterindex())), 4)
+
+    def test_text_log_can_not_be_appended(self):
+        with open(self.filename, 'w') as f:
+            f.write('####title####\n{}\n')
+        with self.assertRaises(compressed.InvalidCompressedLog):
+            CompressedLogWriter(self.filename)
+
+    def test_broken_file_is_invalid_log_format_error(self):
+        with open(self.filename, 'wb') as f:
+            f.write(compressed.MAGIC + 'something else')
+        with self.assertRaises(InvalidLogFormat):
+            LogViewer(self.filename)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# LogWriter keeps a log file open for many games, unlike
+# GameLogger.write_to_file, which opens the file for every game. The game
+# logs (GameLogger.dumps) are buffered and written at once when the buffer
+# gets big enough, by a background thread every flush_interval seconds (if
+# it is set) and on close. The writers that are not closed are referenced
+# by the module and closed at exit, so neither an exception in the game
+# loop nor a writer dropped without close loses the buffered games.
+import atexit
+import os
+import threading
+
+
+_open_writers = set()
+
+
+class LogWriter(object):
+
+    def __init__(self, filename, overwrite=False, buffer_size=1 << 20,
+                 flush_interval=None):
+        self._file = self._open(filename, overwrite)
+        self._buffer = []
+        self._buffered_size = 0
+        self._buffer_size = buffer_size
+        self._lock = threading.Lock()
+        # a forked process (a worker of multiprocessing.Pool) must not write
+        # the buffer of the parent at exit
+        self._pid = os.getpid()
+
+        self._flush_interval = flush_interval
+        self._closed = threading.Event()
+        self._thread = None
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+        _open_writers.add(self)
+
+    def _open(self, filename, overwrite):
+        return open(filename, 'w' if overwrite else 'a')
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def write(self, log_str):
+        with self._lock:
+            self._buffer.append(log_str)
+            self._buffered_size += len(log_str)
+            if self._is_buffer_full():
+                self._flush()
+
+    def _is_buffer_full(self):
+        return self._buffered_size >= self._buffer_size
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered_size = 0
+        self._file.flush()
+
+    def _finish(self):
+        # called on close after the last flush
+        pass
+
+    def _run(self):
+        while not self._closed.wait(self._flush_interval):
+            self.flush()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if os.getpid() == self._pid:
+                self._flush()
+                self._finish()
+            self._file.close()
+        _open_writers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@atexit.register
+def _close_open_writers():
+    for writer in list(_open_writers):
+        writer.close()
@@ -3,7 +3,7 @@ import wx
 
 from durak import consts
 from durak.controller import GameController
-from durak.engine.wrapper import EngineWrapper
+from durak.engine.wrapper import create_engine_wrapper
 from durak.gui.frames.select_engine_dialog import SelectEngineDialog
 from durak.gui.widgets import (CardSizer, EnemyCardSizer, TablePanel,
                                DeckPanel, ControlSizer)
@@ -130,7 +130,7 @@ class PlayFrame(wx.Frame):
 
     def _start_new_game(self, event=None):
         self._stop_engine()
-        self._engine = EngineWrapper(self._get_engine_path())
+        self._engine = create_engine_wrapper(self._get_engine_path())
         self.SetTitle('Durak GUI (vs %s)' % self._get_engine_path())
 
         new_game_data = self._controller.start_new_game(
@@ -173,7 +173,7 @@ class PlayFrame(wx.Frame):
         if (self._controller.to_move == self.HUMAN and
                 self._controller.state == self._controller.States.MOVING):
             self._bottom_player_sizer.set_enabled_cards(
-                human_cards.cards_that_can_be_added_to(on_table)
+                self._controller.legal_cards()
             )
             if on_table:
                 self._control_sizer.show_button(self._control_sizer.DISCARD)
@@ -184,9 +184,11 @@ class PlayFrame(wx.Frame):
                 self._controller.state == self._controller.States.GIVING_MORE):
             self._control_sizer.show_button(self._control_sizer.ENOUGH)
             if self._remained_give_more > 0:
-                self._bottom_player_sizer.set_enabled_cards(
-                    human_cards.cards_that_can_be_added_to(on_table)
-                )
+                # the cards given more are not registered yet
+                self._bottom_player_sizer.set_enabled_cards([
+                    x for x in self._controller.legal_cards()
+                    if x in human_cards
+                ])
                 self.SetStatusText(
                     (u'Беру. Подкидывайте еще, если есть. '
                      u'Еще можно подкинуть карт: %d.') %
@@ -201,7 +203,7 @@ class PlayFrame(wx.Frame):
             assert on_table
 
             self._bottom_player_sizer.set_enabled_cards(
-                human_cards.cards_that_can_beat(on_table[-1])
+                self._controller.legal_cards()
             )
             self._control_sizer.show_button(self._control_sizer.TAKE)
             self.SetStatusText(u'Отбивайтесь')
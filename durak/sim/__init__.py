@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Headless simulator: GameController plays against Python policies, without
+# the engine protocol, logging and converting cards to strings.
+#
+# A policy is a callable policy(action, state), where action is MOVE,
+# RESPOND or GIVE_MORE and state is GameController.get_state_for of the
+# player (it must not be modified). For MOVE and RESPOND it returns a card
+# or None, for GIVE_MORE a list of cards.
+from collections import namedtuple
+from random import Random
+import time
+
+from durak.controller import GameController
+from durak.utils.cards import BitCardSet
+
+
+MOVE = 'move'
+RESPOND = 'respond'
+GIVE_MORE = 'give_more'
+
+
+class SimulationResult(namedtuple(
+        'SimulationResult', 'games wins_a wins_b draws')):
+
+    @property
+    def score_a(self):
+        if not self.games:
+            return 0.0
+        return (self.wins_a + self.draws * 0.5) / self.games
+
+
+def dummy_policy(action, state):
+    # the same as DummyEngine: the lowest card that can be played
+    cards = state['cards']
+    on_table = state['on_table']
+
+    if action == MOVE:
+        if on_table:
+            candidates = cards.cards_that_can_be_added_to(
+                on_table, including_trumps=False
+            )
+        else:
+            candidates = cards.cards_that_can_be_added_to(on_table)
+        return candidates[0] if candidates else None
+    elif action == RESPOND:
+        candidates = cards.cards_that_can_beat(on_table[-1])
+        return candidates[0] if candidates else None
+    elif action == GIVE_MORE:
+        return cards.cards_that_can_be_added_to(
+            on_table, including_trumps=False
+        )[:state['enemy_count'] - 1]
+
+
+class RandomPolicy(object):
+    # a random legal action
+
+    def __init__(self, seed=None):
+        self._random = Random(seed)
+
+    def __call__(self, action, state):
+        cards = state['cards']
+        on_table = state['on_table']
+
+        if action == MOVE:
+            candidates = cards.cards_that_can_be_added_to(on_table)
+            if on_table:
+                candidates.append(None)
+            return self._random.choice(candidates)
+        elif action == RESPOND:
+            return self._random.choice(
+                cards.cards_that_can_beat(on_table[-1]) + [None]
+            )
+        elif action == GIVE_MORE:
+            candidates = cards.cards_that_can_be_added_to(on_table)
+            count = self._random.randint(
+                0, min(len(candidates), state['enemy_count'] - 1)
+            )
+            return self._random.sample(candidates, count)
+
+
+def play_game(controller, policy1, policy2):
+    # plays one game, policy1 plays for PLAYER1; returns controller.winner
+    controller.start_new_game()
+    return play_out(controller, policy1, policy2)
+
+
+def play_out(controller, policy1, policy2):
+    # the same as play_game, but continues the current game
+    States = controller.States
+
+    while not controller.is_game_over():
+        state = controller.state
+        if state == States.MOVING:
+            policy = policy1 if controller.is_player1_to_move() else policy2
+            controller.register_move(
+                policy(MOVE, controller.get_state_for(controller.MOVER))
+            )
+        elif state == States.RESPONDING:
+            policy = policy2 if controller.is_player1_to_move() else policy1
+            controller.register_response(
+                policy(RESPOND, controller.get_state_for(controller.RESPONDER))
+            )
+        elif state == States.GIVING_MORE:
+            policy = policy1 if controller.is_player1_to_move() else policy2
+            controller.register_give_more(
+                policy(GIVE_MORE, controller.get_state_for(controller.MOVER))
+            )
+        elif state == States.DEALING:
+            controller.deal()
+
+    return controller.winner
+
+
+def simulate(policy_a, policy_b, n_games, seed=None):
+    # policy_a always plays for PLAYER1, the seats are the same anyway as
+    # the first move is chosen by trumps
+    controller = GameController(
+        card_set_class=BitCardSet, seed=seed, log_enabled=False
+    )
+    winners = {controller.PLAYER1: 0, controller.PLAYER2: 0, None: 0}
+    for _ in xrange(n_games):
+        winners[play_game(controller, policy_a, policy_b)] += 1
+
+    return SimulationResult(
+        games=n_games,
+        wins_a=winners[controller.PLAYER1],
+        wins_b=winners[controller.PLAYER2],
+        draws=winners[None],
+    )
+
+
+def benchmark(policy_a=dummy_policy, policy_b=dummy_policy, n_games=1000,
+              seed=0):
+    # returns games per second
+    started_at = time.time()
+    simulate(policy_a, policy_b, n_games, seed)
+    return n_games / (time.time() - started_at)
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+# Many games played in lockstep over NumPy arrays, for rollouts and for
+# generating training data, where the Python overhead of GameController per
+# game is the limit. Needs numpy, the rest of durak.sim does not.
+#
+# The rules are the same as in GameController.register_move,
+# register_response, register_give_more and deal, but every step advances
+# all the games at once. Card sets are 36-bit masks (bit N is the card with
+# DurakCard.ordinal N, as in BitCardSet) in np.uint64 arrays indexed by game.
+#
+# A batch policy is a callable policy(action, batch, games, legal): action
+# is MOVE, RESPOND or GIVE_MORE, games is an array of indices of the games
+# where the policy has to act and legal is an array of masks of the cards it
+# may play there. It returns an array of masks: one card or 0 (None) for
+# MOVE and RESPOND, the given cards for GIVE_MORE.
+import numpy as np
+
+from durak.controller import exceptions as exes
+from durak.sim import GIVE_MORE, MOVE, RESPOND, SimulationResult
+from durak.utils.cards import (
+    BEAT_MASKS, CARDS_BY_ORDINAL, DurakCard, RANK_MASKS, SUIT_MASKS,
+    SUITS_COUNT
+)
+
+
+MOVING, RESPONDING, GIVING_MORE, DEALING, GAME_OVER = range(5)
+
+PLAYER1 = 0
+PLAYER2 = 1
+DRAW = -1
+
+DECK_SIZE = len(CARDS_BY_ORDINAL)
+HAND_SIZE = 6
+
+# numpy mixes np.uint64 and int into float64, so the constants are np.uint64
+_ZERO = np.uint64(0)
+_ONE = np.uint64(1)
+_CARD_BITS = np.array([1 << x for x in xrange(DECK_SIZE)], dtype=np.uint64)
+_SUIT_MASKS = np.array(
+    [SUIT_MASKS[suit] for suit in DurakCard.SUITS], dtype=np.uint64
+)
+# indexed by [trump suit, card ordinal]
+_BEAT_MASKS = np.array(
+    [BEAT_MASKS[suit] for suit in DurakCard.SUITS], dtype=np.uint64
+)
+# the lowest bit of every rank
+_RANK_BITS = np.uint64(sum(mask & -mask for mask in RANK_MASKS))
+_RANK_MASK = np.uint64((1 << SUITS_COUNT) - 1)
+_SUIT_SHIFTS = tuple(np.uint64(x) for x in xrange(1, SUITS_COUNT))
+_BYTE = np.uint64(0xff)
+_BYTE_SHIFTS = tuple(np.uint64(x) for x in xrange(0, DECK_SIZE, 8))
+_BYTE_BIT_COUNTS = np.array(
+    [bin(x).count('1') for x in xrange(256)], dtype=np.int8
+)
+
+
+def bit_count(masks):
+    counts = np.zeros(len(masks), dtype=np.int8)
+    for shift in _BYTE_SHIFTS:
+        counts += _BYTE_BIT_COUNTS[(masks >> shift) & _BYTE]
+    return counts
+
+
+def lowest_bit(masks):
+    # 0 for empty masks
+    return masks & (~masks + _ONE)
+
+
+def bit_ordinals(masks):
+    # ordinals of one-card masks
+    return np.searchsorted(_CARD_BITS, masks).astype(np.int8)
+
+
+def lowest_cards(masks, trump_masks):
+    # the first card in CardSet.sorted_cards order, i.e. trumps last
+    not_trumps = masks & ~trump_masks
+    return np.where(
+        not_trumps != _ZERO,
+        lowest_bit(not_trumps),
+        lowest_bit(masks & trump_masks)
+    )
+
+
+def lowest_n_bits(masks, counts):
+    # at most counts lowest bits of every mask
+    results = np.zeros(len(masks), dtype=np.uint64)
+    masks = masks.copy()
+    counts = counts.copy()
+    while True:
+        selected = (counts > 0) & (masks != _ZERO)
+        if not selected.any():
+            return results
+        bits = lowest_bit(masks[selected])
+        results[selected] |= bits
+        masks[selected] ^= bits
+        counts[selected] -= 1
+
+
+def nth_bits(masks, indices):
+    # the bit number indices[i] (from the lowest) of masks[i], 0 if there
+    # are not enough bits
+    masks = masks.copy()
+    indices = indices.copy()
+    while True:
+        selected = indices > 0
+        if not selected.any():
+            return lowest_bit(masks)
+        masks[selected] ^= lowest_bit(masks[selected])
+        indices[selected] -= 1
+
+
+def same_rank_masks(masks):
+    # all the cards of the ranks that are in masks
+    folded = masks
+    for shift in _SUIT_SHIFTS:
+        folded = folded | (masks >> shift)
+    return (folded & _RANK_BITS) * _RANK_MASK
+
+
+class BatchGames(object):
+
+    def __init__(self, n_games, seed=None):
+        self.n_games = n_games
+        self._random = np.random.RandomState(seed)
+
+        # decks[i] are ordinals of the cards of game i in the dealing order,
+        # the last one is the trump, deck_positions[i] is the next to deal
+        self.decks = np.zeros((n_games, DECK_SIZE), dtype=np.int8)
+        self.deck_positions = np.zeros(n_games, dtype=np.int8)
+        self.trump_suits = np.zeros(n_games, dtype=np.int8)
+        self.trump_masks = np.zeros(n_games, dtype=np.uint64)
+        # hands[i, PLAYER1] and hands[i, PLAYER2]
+        self.hands = np.zeros((n_games, 2), dtype=np.uint64)
+        self.to_move = np.zeros(n_games, dtype=np.int8)
+        self.on_table = np.zeros(n_games, dtype=np.uint64)
+        self.given_more = np.zeros(n_games, dtype=np.uint64)
+        self.discarded = np.zeros(n_games, dtype=np.uint64)
+        # the card to beat, i.e. the last card on the table
+        self.last_cards = np.zeros(n_games, dtype=np.int8)
+        self.no_response = np.zeros(n_games, dtype=bool)
+        self.states = np.full(n_games, GAME_OVER, dtype=np.int8)
+        # DRAW until someone wins
+        self.winners = np.full(n_games, DRAW, dtype=np.int8)
+
+    def start(self, decks=None, to_move=None):
+        # Starts all the games. By default the decks are shuffled and the
+        # first move is chosen by trumps, as in GameController. decks (card
+        # ordinals, the first 6 go to player 1, the next 6 to player 2) and
+        # to_move can be given to replay known deals.
+        n_games = self.n_games
+        if decks is None:
+            decks = np.argsort(self._random.rand(n_games, DECK_SIZE), axis=1)
+        self.decks[:] = decks
+        self.deck_positions[:] = 2 * HAND_SIZE
+        self.trump_suits[:] = self.decks[:, -1] % SUITS_COUNT
+        self.trump_masks[:] = _SUIT_MASKS[self.trump_suits]
+
+        for player in (PLAYER1, PLAYER2):
+            dealt = self.decks[:, player * HAND_SIZE:(player + 1) * HAND_SIZE]
+            self.hands[:, player] = np.bitwise_or.reduce(
+                _CARD_BITS[dealt], axis=1
+            )
+
+        if to_move is None:
+            to_move = self._get_first_to_move_by_trump()
+        self.to_move[:] = to_move
+
+        self.on_table[:] = 0
+        self.given_more[:] = 0
+        self.discarded[:] = 0
+        self.last_cards[:] = 0
+        self.no_response[:] = False
+        self.states[:] = MOVING
+        self.winners[:] = DRAW
+
+    def _get_first_to_move_by_trump(self):
+        lowest_trumps = lowest_bit(self.hands & self.trump_masks[:, None])
+        lowest_trump1 = lowest_trumps[:, PLAYER1]
+        lowest_trump2 = lowest_trumps[:, PLAYER2]
+        has_trump1 = lowest_trump1 != _ZERO
+        has_trump2 = lowest_trump2 != _ZERO
+
+        to_move = np.where(
+            has_trump1 & has_trump2,
+            lowest_trump1 > lowest_trump2,
+            ~has_trump1
+        ).astype(np.int8)
+
+        no_trumps = ~(has_trump1 | has_trump2)
+        to_move[no_trumps] = self._random.randint(2, size=no_trumps.sum())
+        return to_move
+
+    def is_over(self):
+        return bool((self.states == GAME_OVER).all())
+
+    @property
+    def deck_counts(self):
+        return DECK_SIZE - self.deck_positions
+
+    def mover_hands(self, games):
+        return self.hands[games, self.to_move[games]]
+
+    def responder_hands(self, games):
+        return self.hands[games, 1 - self.to_move[games]]
+
+    def legal_masks(self, action, games):
+        on_table = self.on_table[games]
+        if action == MOVE:
+            hands = self.mover_hands(games)
+            return np.where(
+                on_table != _ZERO, hands & same_rank_masks(on_table), hands
+            )
+        elif action == RESPOND:
+            return self.responder_hands(games) & _BEAT_MASKS[
+                self.trump_suits[games], self.last_cards[games]
+            ]
+        elif action == GIVE_MORE:
+            return self.mover_hands(games) & same_rank_masks(on_table)
+
+    def run(self, policy1, policy2):
+        # plays the started games to the end, returns self.winners
+        while not self.is_over():
+            self.step(policy1, policy2)
+        return self.winners
+
+    def step(self, policy1, policy2):
+        # one action in every game that is not over
+        states = self.states
+        moving = np.flatnonzero(states == MOVING)
+        responding = np.flatnonzero(states == RESPONDING)
+        giving_more = np.flatnonzero(states == GIVING_MORE)
+        dealing = np.flatnonzero(states == DEALING)
+
+        if len(moving):
+            self._register_moves(
+                moving, self._ask(MOVE, moving, policy1, policy2)
+            )
+        if len(responding):
+            self._register_responses(
+                responding, self._ask(RESPOND, responding, policy1, policy2)
+            )
+        if len(giving_more):
+            self._register_give_more(
+                giving_more,
+                self._ask(GIVE_MORE, giving_more, policy1, policy2)
+            )
+        if len(dealing):
+            self._deal(dealing)
+
+    def _ask(self, action, games, policy1, policy2):
+        legal = self.legal_masks(action, games)
+        players = self.to_move[games]
+        if action == RESPOND:
+            players = 1 - players
+
+        cards = np.zeros(len(games), dtype=np.uint64)
+        for player, policy in ((PLAYER1, policy1), (PLAYER2, policy2)):
+            selected = players == player
+            if selected.any():
+                cards[selected] = policy(
+                    action, self, games[selected], legal[selected]
+                )
+
+        if (cards & ~legal).any():
+            raise exes.InvalidCard(
+                'Invalid cards for %s in games %s' % (
+                    action, games[(cards & ~legal) != _ZERO]
+                )
+            )
+        if action != GIVE_MORE and (bit_count(cards) > 1).any():
+            raise exes.InvalidCard('One card is expected for %s' % action)
+        return cards
+
+    def _register_moves(self, games, cards):
+        passed = cards == _ZERO
+        if (self.on_table[games[passed]] == _ZERO).any():
+            raise exes.CardIsExpected
+        self.states[games[passed]] = DEALING
+
+        games = games[~passed]
+        cards = cards[~passed]
+        movers = self.to_move[games]
+        self.hands[games, movers] &= ~cards
+        self.on_table[games] |= cards
+        self.last_cards[games] = bit_ordinals(cards)
+        self.states[games] = RESPONDING
+
+        self._check_for_game_over(games)
+
+    def _register_responses(self, games, cards):
+        passed = cards == _ZERO
+        taking = games[passed]
+        self.no_response[taking] = True
+        self.states[taking] = np.where(
+            self.mover_hands(taking) != _ZERO, GIVING_MORE, DEALING
+        )
+
+        games = games[~passed]
+        cards = cards[~passed]
+        responders = 1 - self.to_move[games]
+        self.hands[games, responders] &= ~cards
+        self.on_table[games] |= cards
+        self.last_cards[games] = bit_ordinals(cards)
+        self.states[games] = np.where(
+            (self.hands[games, responders] != _ZERO) &
+            (self.mover_hands(games) != _ZERO),
+            MOVING,
+            DEALING
+        )
+
+        self._check_for_game_over(games)
+
+    def _register_give_more(self, games, cards):
+        # нельзя давать больше карт, чем есть у отбивающегося
+        max_counts = bit_count(self.responder_hands(games)) - 1
+        too_much = bit_count(cards) > max_counts
+        if too_much.any():
+            index = np.flatnonzero(too_much)[0]
+            raise exes.TooMuchGiveMoreCards(
+                bit_count(cards[index:index + 1])[0], max_counts[index]
+            )
+        self.states[games] = DEALING
+
+        given = cards != _ZERO
+        games = games[given]
+        cards = cards[given]
+        self.hands[games, self.to_move[games]] &= ~cards
+        self.given_more[games] |= cards
+
+        self._check_for_game_over(games)
+
+    def _deal(self, games):
+        taking = self.no_response[games]
+
+        took = games[taking]
+        self.hands[took, 1 - self.to_move[took]] |= (
+            self.on_table[took] | self.given_more[took]
+        )
+        self.no_response[took] = False
+
+        beaten = games[~taking]
+        self.to_move[beaten] = 1 - self.to_move[beaten]
+        self.discarded[beaten] |= self.on_table[beaten]
+
+        self.on_table[games] = 0
+        self.given_more[games] = 0
+        self.states[games] = MOVING
+
+        # the responder takes cards from the deck first, one by one
+        for players in (1 - self.to_move[games], self.to_move[games]):
+            while True:
+                hands = self.hands[games, players]
+                positions = self.deck_positions[games]
+                selected = (
+                    (bit_count(hands) < HAND_SIZE) & (positions < DECK_SIZE)
+                )
+                if not selected.any():
+                    break
+                selected_games = games[selected]
+                self.hands[selected_games, players[selected]] = (
+                    hands[selected] |
+                    _CARD_BITS[self.decks[selected_games, positions[selected]]]
+                )
+                self.deck_positions[selected_games] += 1
+
+        self._check_for_game_over(games)
+
+    def _check_for_game_over(self, games):
+        hands1 = self.hands[games, PLAYER1]
+        hands2 = self.hands[games, PLAYER2]
+        over = (
+            (self.deck_positions[games] == DECK_SIZE) &
+            ((hands1 == _ZERO) | (hands2 == _ZERO))
+        )
+
+        # the responder still can beat the last card with the last card
+        responder_hands = self.responder_hands(games)
+        can_beat = (
+            (self.states[games] == RESPONDING) &
+            (self.mover_hands(games) == _ZERO) &
+            (bit_count(responder_hands) == 1) &
+            (responder_hands & _BEAT_MASKS[
+                self.trump_suits[games], self.last_cards[games]
+            ] != _ZERO)
+        )
+        over &= ~can_beat
+
+        self.winners[games[over]] = np.where(
+            (hands1[over] == _ZERO) & (hands2[over] == _ZERO),
+            DRAW,
+            np.where(hands1[over] == _ZERO, PLAYER1, PLAYER2)
+        )
+        self.states[games[over]] = GAME_OVER
+
+
+def lowest_batch_policy(action, batch, games, legal):
+    # the same as durak.sim.dummy_policy
+    trump_masks = batch.trump_masks[games]
+    if action == MOVE:
+        legal = np.where(
+            batch.on_table[games] != _ZERO, legal & ~trump_masks, legal
+        )
+        return lowest_cards(legal, trump_masks)
+    elif action == RESPOND:
+        return lowest_cards(legal, trump_masks)
+    elif action == GIVE_MORE:
+        return lowest_n_bits(
+            legal & ~trump_masks, bit_count(batch.responder_hands(games)) - 1
+        )
+
+
+class RandomBatchPolicy(object):
+    # a random legal action
+
+    def __init__(self, seed=None):
+        self._random = np.random.RandomState(seed)
+
+    def __call__(self, action, batch, games, legal):
+        if action == GIVE_MORE:
+            subsets = legal & self._random.randint(
+                0, 1 << DECK_SIZE, size=len(games), dtype=np.uint64
+            )
+            return lowest_n_bits(
+                subsets, bit_count(batch.responder_hands(games)) - 1
+            )
+
+        # one of the cards or None (the index after the last card)
+        counts = bit_count(legal)
+        if action == MOVE:
+            counts = counts + (batch.on_table[games] != _ZERO)
+        else:
+            counts = counts + 1
+        indices = (self._random.rand(len(games)) * counts).astype(np.int8)
+        return nth_bits(legal, indices)
+
+
+def simulate_batch(policy_a, policy_b, n_games, seed=None):
+    # the same as durak.sim.simulate, but for batch policies
+    batch = BatchGames(n_games, seed=seed)
+    batch.start()
+    winners = batch.run(policy_a, policy_b)
+    return SimulationResult(
+        games=n_games,
+        wins_a=int((winners == PLAYER1).sum()),
+        wins_b=int((winners == PLAYER2).sum()),
+        draws=int((winners == DRAW).sum()),
+    )
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import patch
+
+from durak.controller import GameController
+import durak.controller.exceptions as exes
+from durak.sim import (
+    benchmark, dummy_policy, play_game, RandomPolicy, simulate,
+    SimulationResult
+)
+from durak.utils.cards import BitCardSet, iter_mask, SUIT_MASKS, to_mask
+
+try:
+    from durak.sim import batch
+except ImportError:
+    batch = None
+
+
+class SimulationResultTest(unittest.TestCase):
+
+    def test_score_a(self):
+        self.assertEqual(SimulationResult(4, 2, 1, 1).score_a, 0.625)
+        self.assertEqual(SimulationResult(0, 0, 0, 0).score_a, 0.0)
+
+
+class SimulateTest(unittest.TestCase):
+
+    def test_results_add_up(self):
+        result = simulate(dummy_policy, RandomPolicy(seed=1), 20, seed=2)
+        self.assertEqual(result.games, 20)
+        self.assertEqual(
+            result.wins_a + result.wins_b + result.draws, result.games
+        )
+
+    def test_seeded_simulation_is_reproducible(self):
+        self.assertEqual(
+            simulate(RandomPolicy(seed=1), RandomPolicy(seed=2), 20, seed=3),
+            simulate(RandomPolicy(seed=1), RandomPolicy(seed=2), 20, seed=3)
+        )
+
+    def test_random_policies_play_legal_games(self):
+        controller = GameController(
+            card_set_class=BitCardSet, seed=4, log_enabled=False
+        )
+        for _ in xrange(30):
+            play_game(controller, RandomPolicy(seed=5), RandomPolicy(seed=6))
+            self.assertTrue(controller.is_game_over())
+
+    def test_nothing_is_logged(self):
+        with patch('durak.controller.GameLogger') as logger_class_mock:
+            simulate(dummy_policy, dummy_policy, 3, seed=7)
+            self.assertFalse([
+                call
+                for call in logger_class_mock.return_value.method_calls
+                if call[0].startswith('log_')
+            ])
+
+    def test_benchmark(self):
+        self.assertGreater(benchmark(n_games=3), 0)
+
+
+def _get_deal(controller):
+    # card ordinals in the dealing order and the first player to move
+    cards = (
+        sorted(controller._player1.cards) +
+        sorted(controller._player2.cards) +
+        controller._deck
+    )
+    return [x.ordinal for x in cards], int(not controller.is_player1_to_move())
+
+
+@unittest.skipIf(batch is None, 'numpy is not installed')
+class BatchGamesTest(unittest.TestCase):
+
+    def _start_controllers(self, n_games):
+        controllers = []
+        decks = []
+        to_move = []
+        for seed in xrange(n_games):
+            controller = GameController(
+                card_set_class=BitCardSet, seed=seed, log_enabled=False
+            )
+            controller.start_new_game()
+            deck, first_to_move = _get_deal(controller)
+            controllers.append(controller)
+            decks.append(deck)
+            to_move.append(first_to_move)
+
+        games = batch.BatchGames(n_games)
+        games.start(decks, to_move)
+        return controllers, games
+
+    def test_start(self):
+        controllers, games = self._start_controllers(50)
+        for index, controller in enumerate(controllers):
+            self.assertEqual(
+                games.hands[index, batch.PLAYER1],
+                to_mask(controller._player1.cards)
+            )
+            self.assertEqual(
+                games.hands[index, batch.PLAYER2],
+                to_mask(controller._player2.cards)
+            )
+            self.assertEqual(games.deck_counts[index], controller.deck_count)
+            self.assertEqual(
+                games.trump_masks[index], SUIT_MASKS[controller._trump.suit]
+            )
+        self.assertTrue((games.states == batch.MOVING).all())
+
+    def test_lowest_policy_plays_as_dummy_policy(self):
+        controllers, games = self._start_controllers(100)
+        games.run(batch.lowest_batch_policy, batch.lowest_batch_policy)
+
+        winners = {
+            controllers[0].PLAYER1: batch.PLAYER1,
+            controllers[0].PLAYER2: batch.PLAYER2,
+            None: batch.DRAW,
+        }
+        for index, controller in enumerate(controllers):
+            controller.set_seed(index)
+            self.assertEqual(
+                games.winners[index],
+                winners[play_game(controller, dummy_policy, dummy_policy)]
+            )
+
+    def test_random_games_follow_controller_rules(self):
+        # every action of the batch is replayed by GameController, which
+        # checks it, and the states must stay the same
+        controllers, games = self._start_controllers(100)
+        random_policy = batch.RandomBatchPolicy(seed=1)
+        actions = {}
+
+        def recording_policy(action, batch_games, game_indices, legal):
+            cards = random_policy(action, batch_games, game_indices, legal)
+            for index, card_mask in zip(game_indices, cards):
+                actions[index] = list(iter_mask(int(card_mask)))
+            return cards
+
+        states = {
+            batch.MOVING: GameController.States.MOVING,
+            batch.RESPONDING: GameController.States.RESPONDING,
+            batch.GIVING_MORE: GameController.States.GIVING_MORE,
+            batch.DEALING: GameController.States.DEALING,
+            batch.GAME_OVER: None,
+        }
+        while not games.is_over():
+            actions.clear()
+            games.step(recording_policy, recording_policy)
+
+            for index, controller in enumerate(controllers):
+                state = controller.state
+                cards = actions.get(index)
+                if state == controller.States.MOVING:
+                    controller.register_move(cards[0] if cards else None)
+                elif state == controller.States.RESPONDING:
+                    controller.register_response(cards[0] if cards else None)
+                elif state == controller.States.GIVING_MORE:
+                    controller.register_give_more(cards)
+                elif state == controller.States.DEALING:
+                    controller.deal()
+
+                self.assertEqual(states[games.states[index]], controller.state)
+                self.assertEqual(
+                    games.hands[index, batch.PLAYER1],
+                    to_mask(controller._player1.cards)
+                )
+                self.assertEqual(
+                    games.hands[index, batch.PLAYER2],
+                    to_mask(controller._player2.cards)
+                )
+                self.assertEqual(
+                    games.deck_counts[index], controller.deck_count
+                )
+
+        for index, controller in enumerate(controllers):
+            self.assertEqual(
+                games.winners[index],
+                {
+                    controller.PLAYER1: batch.PLAYER1,
+                    controller.PLAYER2: batch.PLAYER2,
+                    None: batch.DRAW,
+                }[controller.winner]
+            )
+
+    def test_invalid_card_is_error(self):
+        games = batch.BatchGames(2, seed=1)
+        games.start()
+
+        def invalid_policy(action, batch_games, game_indices, legal):
+            # a card that the player does not have
+            return batch.lowest_bit(~batch_games.mover_hands(game_indices))
+
+        with self.assertRaises(exes.InvalidCard):
+            games.step(invalid_policy, invalid_policy)
+
+    def test_simulate_batch(self):
+        result = batch.simulate_batch(
+            batch.lowest_batch_policy, batch.RandomBatchPolicy(seed=1), 50,
+            seed=2
+        )
+        self.assertEqual(result.games, 50)
+        self.assertEqual(
+            result.wins_a + result.wins_b + result.draws, result.games
+        )
+        self.assertEqual(
+            result,
+            batch.simulate_batch(
+                batch.lowest_batch_policy, batch.RandomBatchPolicy(seed=1),
+                50, seed=2
+            )
+        )
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+import durak
+from durak import autoplay
+from durak.controller import GameController
+from durak.utils.sprt import SPRT
+
+
+class AutoplayTest(unittest.TestCase):
+    ENGINE_PATH = 'py:durak.engine.dummy:DummyEngine'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # the same engine, but in its own process
+        self.script_path = os.path.join(self.directory, 'dummy.sh')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(
+            durak.__file__
+        )))
+        with open(self.script_path, 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('PYTHONPATH=%s exec %s -m durak.engine.dummy\n' % (
+                root, sys.executable
+            ))
+        os.chmod(self.script_path, 0755)
+        self._runs_count = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _autoplay(self, engine1_path, engine2_path, *options):
+        # runs durak-autoplay, returns its output and the logs of the games
+        self._runs_count += 1
+        log_filename = os.path.join(
+            self.directory, 'games%d.log' % self._runs_count
+        )
+        argv = [
+            'durak-autoplay', engine1_path, engine2_path,
+            '--log-file=%s' % log_filename
+        ]
+        argv.extend(options)
+        with patch.object(sys, 'argv', argv), \
+                patch.object(sys, 'stdout', StringIO()) as stdout_mock:
+            autoplay.main()
+
+        with open(log_filename) as f:
+            games = [
+                json.loads(line) for line in f
+                if line.strip() and not line.startswith('####')
+            ]
+        return stdout_mock.getvalue(), games
+
+    @staticmethod
+    def _get_matches(output):
+        return [
+            line for line in output.splitlines() if line.startswith('Match')
+        ]
+
+    @staticmethod
+    def _get_deal(game):
+        return game['deck'], game['moves']
+
+    def test_results_do_not_depend_on_jobs_and_concurrency(self):
+        options = ('--matches-number=2', '--match-size=4', '--seed=7')
+        output, games = self._autoplay(
+            self.ENGINE_PATH, self.script_path, *options
+        )
+        self.assertEqual(len(games), 8)
+        # the deals are different
+        self.assertEqual(len(set(str(game['deck']) for game in games)), 8)
+
+        for parallel_option in ('--jobs=2', '--concurrency=2'):
+            parallel_output, parallel_games = self._autoplay(
+                self.ENGINE_PATH, self.script_path,
+                parallel_option, *options
+            )
+            self.assertEqual(
+                self._get_matches(parallel_output), self._get_matches(output)
+            )
+            self.assertEqual(
+                [(game['result'], self._get_deal(game))
+                 for game in parallel_games],
+                [(game['result'], self._get_deal(game)) for game in games]
+            )
+
+    def test_game_seed(self):
+        self.assertEqual(autoplay._get_game_seed(0, 5), 5)
+        self.assertEqual(autoplay._get_game_seed(3, 5), 3 * 2 ** 32 + 5)
+        self.assertNotEqual(
+            autoplay._get_game_seed(1, 0),
+            autoplay._get_game_seed(0, 1)
+        )
+
+        _, games = self._autoplay(
+            self.ENGINE_PATH, self.ENGINE_PATH,
+            '--matches-number=1', '--match-size=3', '--seed=5'
+        )
+        for game_index, game in enumerate(games):
+            controller = GameController(
+                seed=autoplay._get_game_seed(5, game_index)
+            )
+            controller.start_new_game()
+            self.assertEqual(controller._logger._log['deck'], game['deck'])
+
+    def test_duplicate_games_swap_seats_with_the_same_deal(self):
+        output, games = self._autoplay(
+            self.ENGINE_PATH, self.script_path,
+            '--matches-number=1', '--match-size=6', '--duplicate'
+        )
+        self.assertEqual(len(games), 6)
+        for game, swapped_game in zip(games[::2], games[1::2]):
+            self.assertEqual(swapped_game['deck'], game['deck'])
+            self.assertEqual(
+                (game['player1_name'], game['player2_name']),
+                (self.ENGINE_PATH, self.script_path)
+            )
+            self.assertEqual(
+                (swapped_game['player1_name'], swapped_game['player2_name']),
+                (self.script_path, self.ENGINE_PATH)
+            )
+        self.assertEqual(len(set(str(game['deck']) for game in games)), 3)
+
+        # the chosen seed is printed and gives the same deals
+        seed_lines = [
+            line for line in output.splitlines() if line.startswith('Seed:')
+        ]
+        self.assertEqual(len(seed_lines), 1)
+        _, seeded_games = self._autoplay(
+            self.ENGINE_PATH, self.script_path,
+            '--matches-number=1', '--match-size=6', '--duplicate',
+            '--seed=%s' % seed_lines[0].split()[1]
+        )
+        self.assertEqual(
+            [game['deck'] for game in seeded_games],
+            [game['deck'] for game in games]
+        )
+
+    def test_seed_is_printed_only_if_chosen(self):
+        output, _ = self._autoplay(
+            self.ENGINE_PATH, self.ENGINE_PATH,
+            '--matches-number=1', '--match-size=2', '--duplicate', '--seed=3'
+        )
+        self.assertFalse('Seed:' in output)
+
+    def test_latency_file(self):
+        latency_filename = os.path.join(self.directory, 'latency.json')
+        self._autoplay(
+            self.ENGINE_PATH, self.script_path,
+            '--matches-number=1', '--match-size=3',
+            '--latency-file=%s' % latency_filename
+        )
+
+        with open(latency_filename) as f:
+            latency = json.load(f)
+        self.assertEqual(latency['games'], 3)
+        self.assertTrue(latency['wall_time'] > 0)
+        self.assertEqual(
+            [engine['path'] for engine in latency['engines']],
+            [self.ENGINE_PATH, self.script_path]
+        )
+        for engine in latency['engines']:
+            init_stats = engine['commands']['init']
+            self.assertEqual(init_stats['count'], 3)
+            self.assertEqual(
+                len(init_stats['histogram']),
+                len(engine['latency_buckets']) + 1
+            )
+            self.assertEqual(
+                engine['commands_count'],
+                sum(command_stats['count']
+                    for command_stats in engine['commands'].itervalues())
+            )
+
+    def _autoplay_with_sprt(self, *options):
+        # returns the output, the logs of the games and the SPRT object
+        sprts = []
+
+        class RecordingSPRT(SPRT):
+
+            def __init__(self, *args):
+                super(RecordingSPRT, self).__init__(*args)
+                sprts.append(self)
+
+        with patch('durak.autoplay.SPRT', RecordingSPRT):
+            output, games = self._autoplay(
+                self.ENGINE_PATH, self.script_path,
+                '--matches-number=2', '--match-size=50', '--seed=1',
+                '--sprt=0,400,0.2,0.2', *options
+            )
+        self.assertEqual(len(sprts), 1)
+        return output, games, sprts[0]
+
+    def test_sprt_stops_autoplay(self):
+        output, games, sprt = self._autoplay_with_sprt()
+
+        self.assertEqual(sprt.decision, SPRT.H0)
+        self.assertTrue(len(games) < 100)
+        self.assertEqual(sprt.count, len(games))
+        self.assertTrue(
+            'H0 accepted after %d games, %d games saved' % (
+                len(games), 100 - len(games)
+            ) in output
+        )
+        self.assertEqual(len(self._get_matches(output)), 1)
+
+    def test_sprt_is_updated_by_pairs_in_duplicate_mode(self):
+        output, games, sprt = self._autoplay_with_sprt('--duplicate')
+
+        self.assertEqual(sprt.decision, SPRT.H0)
+        self.assertEqual(len(games) % 2, 0)
+        self.assertEqual(sprt.count, len(games) // 2)
+        self.assertTrue('H0 accepted after %d games' % len(games) in output)
+
+    def test_update_sprt(self):
+        sprt = SPRT(0, 400)
+        results = [autoplay.ENGINE1]
+        autoplay._update_sprt(sprt, results, duplicate=True)
+        self.assertEqual(sprt.count, 0)
+
+        results.append(autoplay.DRAW)
+        autoplay._update_sprt(sprt, results, duplicate=True)
+        self.assertEqual(sprt.count, 1)
+        self.assertEqual(sprt._sum, 0.75)
+
+        autoplay._update_sprt(sprt, results, duplicate=False)
+        self.assertEqual(sprt.count, 2)
+        self.assertEqual(sprt._sum, 1.25)
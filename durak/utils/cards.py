@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from collections import namedtuple
+from collections import MutableSet, namedtuple
 from itertools import product, groupby
 
 
@@ -12,14 +12,30 @@ class DurakCard(DurakCardTuple):
     SUITS = ('C', 'D', 'H', 'S')
 
     _INSTANCE_REGISTRY = {}
+    _STRING_REGISTRY = {}
 
     def __new__(cls, *args, **kwargs):
+        # fast path: an existing card or one of its 2-char codes like '7H'
+        if len(args) == 1 and not kwargs:
+            value = args[0]
+            if type(value) is cls:
+                return value
+            try:
+                return cls._STRING_REGISTRY[value]
+            except (KeyError, TypeError):
+                pass
+
         rank, suit = cls._parse_suit_and_rank(*args, **kwargs)
         if (rank, suit) in cls._INSTANCE_REGISTRY:
             return cls._INSTANCE_REGISTRY[(rank, suit)]
 
         instance = super(DurakCard, cls).__new__(cls, rank, suit)
+        # position of the card in the sorted deck, 0 (6C) .. 35 (AS)
+        instance.ordinal = rank * len(cls.SUITS) + cls.SUITS.index(suit)
+        instance._hash = hash(str(instance))
+
         cls._INSTANCE_REGISTRY[(rank, suit)] = instance
+        cls._STRING_REGISTRY[str(instance)] = instance
         return instance
 
     @classmethod
@@ -45,7 +61,8 @@ class DurakCard(DurakCardTuple):
         else:
             raise ValueError('Invalid arguments')
 
-        if suit.upper() not in cls.SUITS:
+        suit = suit.upper()
+        if suit not in cls.SUITS:
             raise ValueError('Invalid suit')
 
         try:
@@ -68,24 +85,28 @@ class DurakCard(DurakCardTuple):
         return self.SUITS.index(self.suit)
 
     def is_less_than(self, other, trump=None):
-        if not isinstance(other, type(self)):
-            raise ValueError(
-                u'Can not compare DurakCard and %s instances' % type(other)
-            )
+        try:
+            if trump is None:
+                return self.ordinal < other.ordinal
 
-        if trump is not None:
-            if not isinstance(trump, type(self)):
+            sort_keys = TRUMP_SORT_KEYS[trump.suit]
+            return sort_keys[self.ordinal] < sort_keys[other.ordinal]
+        except (AttributeError, KeyError, TypeError):
+            if not isinstance(other, type(self)):
                 raise ValueError(
-                    u'Trump should be DurakCard instance, not %s' % type(trump)
+                    u'Can not compare DurakCard and %s instances' % type(other)
                 )
+            raise ValueError(
+                u'Trump should be DurakCard instance, not %s' % type(trump)
+            )
 
-            if (self.suit == trump.suit and other.suit != trump.suit):
-                return False
-
-            if (self.suit != trump.suit and other.suit == trump.suit):
-                return True
+    def can_beat(self, other, trump):
+        return bool(BEAT_MASKS[trump.suit][other.ordinal] >> self.ordinal & 1)
 
-        return (self < other)
+    def can_be_added_to(self, cards):
+        if not cards:
+            return True
+        return bool(to_mask(cards) & SAME_RANK_MASKS[self.ordinal])
 
     def __str__(self):
         return '%s%s' % (self.rank, self.suit)
@@ -94,7 +115,11 @@ class DurakCard(DurakCardTuple):
     __unicode__ = __str__
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
+
+    def __reduce__(self):
+        # copies and unpickled cards are the interned instances too
+        return (type(self), (str(self),))
 
     def __cmp__(self, other):
         if not isinstance(other, type(self)):
@@ -129,10 +154,10 @@ class CardSet(set):
             return []
 
         results = [
-            x for x in self.sorted_cards() if x.suit == card.suit and x > card
+            x for x in BEAT_CARDS[self._trump.suit][card.ordinal] if x in self
         ]
-        if not self._is_trump(card) and including_trumps:
-            results.extend(sorted(self.trumps()))
+        if not including_trumps:
+            results = [x for x in results if x.suit == card.suit]
 
         return results
 
@@ -140,8 +165,10 @@ class CardSet(set):
         if not cards:
             return self.sorted_cards()
 
-        ranks = {DurakCard(x).rank for x in cards}
-        results = [x for x in self.sorted_cards() if x.rank in ranks]
+        mask = 0
+        for card in cards:
+            mask |= SAME_RANK_MASKS[DurakCard(card).ordinal]
+        results = [x for x in self.sorted_cards() if mask >> x.ordinal & 1]
         if not including_trumps:
             results = [x for x in results if not self._is_trump(x)]
         return results
@@ -174,9 +201,8 @@ class CardSet(set):
         return {x for x in self if not self._is_trump(x)}
 
     def sorted_cards(self):
-        results = list(sorted(self.not_trumps()))
-        results.extend(sorted(self.trumps()))
-        return results
+        sort_keys = TRUMP_SORT_KEYS[self._trump.suit]
+        return sorted(self, key=lambda x: sort_keys[x.ordinal])
 
     def lowest_trump(self):
         trumps = list(sorted(self.trumps()))
@@ -184,5 +210,296 @@ class CardSet(set):
             return None
         return trumps[0]
 
-    def update(self, iterable):
-        return super(CardSet, self).update(map(DurakCard, iterable))
+    def update(self, *iterables):
+        return super(CardSet, self).update(
+            *[map(DurakCard, iterable) for iterable in iterables]
+        )
+
+
+SUITS_COUNT = len(DurakCard.SUITS)
+CARDS_BY_ORDINAL = tuple(sorted(DurakCard.all()))
+SUIT_MASKS = {
+    suit: sum(1 << x.ordinal for x in CARDS_BY_ORDINAL if x.suit == suit)
+    for suit in DurakCard.SUITS
+}
+RANK_MASKS = tuple(
+    ((1 << SUITS_COUNT) - 1) << (rank * SUITS_COUNT)
+    for rank in xrange(len(DurakCard.RANKS))
+)
+
+
+def bit_count(mask):
+    return bin(mask).count('1')
+
+
+def iter_mask(mask):
+    while mask:
+        lowest_bit = mask & -mask
+        yield CARDS_BY_ORDINAL[lowest_bit.bit_length() - 1]
+        mask ^= lowest_bit
+
+
+def to_mask(cards):
+    if isinstance(cards, BitCardSet):
+        return cards.mask
+
+    mask = 0
+    for card in cards:
+        mask |= 1 << DurakCard(card).ordinal
+    return mask
+
+
+def _build_beat_masks(trump_suit):
+    results = []
+    for card in CARDS_BY_ORDINAL:
+        mask = SUIT_MASKS[card.suit] & ~((2 << card.ordinal) - 1)
+        if card.suit != trump_suit:
+            mask |= SUIT_MASKS[trump_suit]
+        results.append(mask)
+    return tuple(results)
+
+
+def _build_sort_keys(trump_suit):
+    return tuple(
+        x.ordinal + (len(CARDS_BY_ORDINAL) if x.suit == trump_suit else 0)
+        for x in CARDS_BY_ORDINAL
+    )
+
+
+def _build_beat_cards(trump_suit):
+    trump_mask = SUIT_MASKS[trump_suit]
+    return tuple(
+        tuple(iter_mask(mask & ~trump_mask)) +
+        tuple(iter_mask(mask & trump_mask))
+        for mask in BEAT_MASKS[trump_suit]
+    )
+
+
+# The tables below are indexed by DurakCard.ordinal. BEAT_MASKS[trump_suit]
+# gives the mask of cards that beat the card, BEAT_CARDS[trump_suit] - the
+# same cards in CardSet.sorted_cards order, TRUMP_SORT_KEYS[trump_suit] -
+# sort keys that put trumps last.
+BEAT_MASKS = {suit: _build_beat_masks(suit) for suit in DurakCard.SUITS}
+BEAT_CARDS = {suit: _build_beat_cards(suit) for suit in DurakCard.SUITS}
+TRUMP_SORT_KEYS = {suit: _build_sort_keys(suit) for suit in DurakCard.SUITS}
+SAME_RANK_MASKS = tuple(
+    RANK_MASKS[x.numeric_rank] for x in CARDS_BY_ORDINAL
+)
+
+
+class BitCardSet(MutableSet):
+    """CardSet with the same API, stored as a 36-bit integer.
+
+    Bit N is set if the card with ordinal N is in the set, so bits are
+    ordered exactly like sorted cards. The set methods accept any
+    iterables of cards, like the ones of set.
+    """
+
+    def __init__(self, cards, trump):
+        self._trump = DurakCard(trump)
+        self._trump_mask = SUIT_MASKS[self._trump.suit]
+        self._beat_masks = BEAT_MASKS[self._trump.suit]
+        self._mask = to_mask(cards)
+
+    @classmethod
+    def from_mask(cls, mask, trump):
+        # the same as __init__, without converting cards to a mask
+        instance = cls.__new__(cls)
+        instance._trump = trump = DurakCard(trump)
+        instance._trump_mask = SUIT_MASKS[trump.suit]
+        instance._beat_masks = BEAT_MASKS[trump.suit]
+        instance._mask = mask
+        return instance
+
+    def _from_iterable(self, iterable):
+        return self.from_mask(to_mask(iterable), self._trump)
+
+    @property
+    def mask(self):
+        return self._mask
+
+    def __contains__(self, card):
+        try:
+            return bool(self._mask & (1 << DurakCard(card).ordinal))
+        except ValueError:
+            return False
+
+    def __iter__(self):
+        return iter_mask(self._mask)
+
+    def __len__(self):
+        return bit_count(self._mask)
+
+    def __nonzero__(self):
+        return bool(self._mask)
+
+    def __eq__(self, other):
+        if isinstance(other, BitCardSet):
+            return self._mask == other.mask
+        return super(BitCardSet, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self))
+
+    def __or__(self, other):
+        return self.from_mask(self._mask | to_mask(other), self._trump)
+
+    __ror__ = __or__
+
+    def __and__(self, other):
+        return self.from_mask(self._mask & to_mask(other), self._trump)
+
+    __rand__ = __and__
+
+    def __sub__(self, other):
+        return self.from_mask(self._mask & ~to_mask(other), self._trump)
+
+    def __rsub__(self, other):
+        return self.from_mask(to_mask(other) & ~self._mask, self._trump)
+
+    def __xor__(self, other):
+        return self.from_mask(self._mask ^ to_mask(other), self._trump)
+
+    __rxor__ = __xor__
+
+    def __ior__(self, other):
+        self._mask |= to_mask(other)
+        return self
+
+    def __iand__(self, other):
+        self._mask &= to_mask(other)
+        return self
+
+    def __isub__(self, other):
+        self._mask &= ~to_mask(other)
+        return self
+
+    def __ixor__(self, other):
+        self._mask ^= to_mask(other)
+        return self
+
+    def add(self, card):
+        self._mask |= 1 << DurakCard(card).ordinal
+
+    def discard(self, card):
+        self._mask &= ~(1 << DurakCard(card).ordinal)
+
+    def remove(self, card):
+        bit = 1 << DurakCard(card).ordinal
+        if not self._mask & bit:
+            raise KeyError(card)
+        self._mask ^= bit
+
+    def clear(self):
+        self._mask = 0
+
+    def copy(self):
+        return self.from_mask(self._mask, self._trump)
+
+    def update(self, *iterables):
+        for iterable in iterables:
+            self._mask |= to_mask(iterable)
+
+    def intersection_update(self, *iterables):
+        for iterable in iterables:
+            self._mask &= to_mask(iterable)
+
+    def difference_update(self, *iterables):
+        for iterable in iterables:
+            self._mask &= ~to_mask(iterable)
+
+    def symmetric_difference_update(self, iterable):
+        self._mask ^= to_mask(iterable)
+
+    def union(self, *iterables):
+        result = self.copy()
+        result.update(*iterables)
+        return result
+
+    def intersection(self, *iterables):
+        result = self.copy()
+        result.intersection_update(*iterables)
+        return result
+
+    def difference(self, *iterables):
+        result = self.copy()
+        result.difference_update(*iterables)
+        return result
+
+    symmetric_difference = __xor__
+
+    def issubset(self, iterable):
+        return not self._mask & ~to_mask(iterable)
+
+    def issuperset(self, iterable):
+        mask = to_mask(iterable)
+        return self._mask & mask == mask
+
+    def isdisjoint(self, iterable):
+        return not self._mask & to_mask(iterable)
+
+    def cards_that_can_beat(self, card, including_trumps=True):
+        card = DurakCard(card)
+        mask = self._mask & self._beat_masks[card.ordinal]
+
+        if not including_trumps:
+            if self._trump_mask >> card.ordinal & 1:
+                return []
+            mask &= ~self._trump_mask
+
+        return self._sorted_cards(mask)
+
+    def cards_that_can_be_added_to(self, cards, including_trumps=True):
+        if not cards:
+            return self.sorted_cards()
+
+        ranks_mask = 0
+        for card in cards:
+            ranks_mask |= SAME_RANK_MASKS[DurakCard(card).ordinal]
+
+        mask = self._mask & ranks_mask
+        if not including_trumps:
+            mask &= ~self._trump_mask
+        return self._sorted_cards(mask)
+
+    def card_groups(self, including_trumps=True):
+        results = []
+
+        mask = self._mask
+        if not including_trumps:
+            mask &= ~self._trump_mask
+
+        for rank_mask in RANK_MASKS:
+            group_mask = mask & rank_mask
+            if group_mask & (group_mask - 1):  # more than one bit
+                results.append(set(iter_mask(group_mask)))
+
+        return results
+
+    def _is_trump(self, card):
+        return bool(self._trump_mask & (1 << DurakCard(card).ordinal))
+
+    def trumps(self):
+        return self.from_mask(self._mask & self._trump_mask, self._trump)
+
+    def not_trumps(self):
+        return self.from_mask(self._mask & ~self._trump_mask, self._trump)
+
+    def _sorted_cards(self, mask):
+        results = list(iter_mask(mask & ~self._trump_mask))
+        results.extend(iter_mask(mask & self._trump_mask))
+        return results
+
+    def sorted_cards(self):
+        return self._sorted_cards(self._mask)
+
+    def lowest_trump(self):
+        trumps_mask = self._mask & self._trump_mask
+        if not trumps_mask:
+            return None
+        return CARDS_BY_ORDINAL[(trumps_mask & -trumps_mask).bit_length() - 1]
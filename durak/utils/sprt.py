@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import math
+
+
+def elo_to_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+class SPRT(object):
+    # Sequential probability ratio test of H0: "engine is elo0 stronger"
+    # against H1: "engine is elo1 stronger". Every sample is a score from 0
+    # to 1 (a game or an average of a pair of games), the log-likelihood
+    # ratio uses the normal approximation of the score distribution. The
+    # variance is estimated with one win and one loss added to the samples,
+    # so it is not 0 when one engine wins (or loses) every game.
+
+    H0 = 'H0'
+    H1 = 'H1'
+
+    def __init__(self, elo0, elo1, alpha=0.05, beta=0.05):
+        if not elo0 < elo1:
+            raise ValueError('elo0 must be less than elo1')
+        if not (0 < alpha < 1 and 0 < beta < 1):
+            raise ValueError('alpha and beta must be between 0 and 1')
+
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self._score0 = elo_to_score(elo0)
+        self._score1 = elo_to_score(elo1)
+
+        self.lower_bound = math.log(beta / (1.0 - alpha))
+        self.upper_bound = math.log((1.0 - beta) / alpha)
+
+        self._count = 0
+        self._sum = 0.0
+        self._sum_of_squares = 0.0
+
+    def add(self, score):
+        assert 0.0 <= score <= 1.0
+
+        self._count += 1
+        self._sum += score
+        self._sum_of_squares += score * score
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def llr(self):
+        if not self._count:
+            return 0.0
+
+        mean = self._sum / self._count
+        count = self._count + 2
+        prior_mean = (self._sum + 1) / count
+        variance = (
+            (self._sum_of_squares + 1) / count - prior_mean * prior_mean
+        )
+
+        return (
+            self._count * (self._score1 - self._score0) *
+            (2 * mean - self._score0 - self._score1) / (2 * variance)
+        )
+
+    @property
+    def decision(self):
+        llr = self.llr
+        if llr >= self.upper_bound:
+            return self.H1
+        if llr <= self.lower_bound:
+            return self.H0
+        return None
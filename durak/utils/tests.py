@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+import copy
 import json
 import os
+import pickle
 import unittest
 
 from mock import mock_open, patch
 
 from durak.consts import HOME_DIR
 from durak.utils import get_filename, get_setting, set_setting
-from durak.utils.cards import DurakCard, CardSet
+from durak.utils.sprt import SPRT, elo_to_score
+from durak.utils.cards import (BEAT_CARDS, BEAT_MASKS, CARDS_BY_ORDINAL,
+                               SAME_RANK_MASKS, BitCardSet, DurakCard,
+                               CardSet, iter_mask)
 
 
 class DurakCardTest(unittest.TestCase):
@@ -131,6 +136,65 @@ class DurakCardTest(unittest.TestCase):
         # let's remove invalid value from global cache
         DurakCard._INSTANCE_REGISTRY.pop((0, 'H'), None)
 
+    def test_is_less_than_without_trump_compares_cards(self):
+        self.assertTrue(DurakCard('6S').is_less_than(DurakCard('7C')))
+        self.assertTrue(DurakCard('6C').is_less_than(DurakCard('6D')))
+        self.assertFalse(DurakCard('AC').is_less_than(DurakCard('KS')))
+
+    def test_is_less_than_with_trump_puts_trumps_last(self):
+        trump = DurakCard('9H')
+        self.assertTrue(DurakCard('AS').is_less_than(DurakCard('6H'), trump))
+        self.assertFalse(DurakCard('6H').is_less_than(DurakCard('AS'), trump))
+        self.assertTrue(DurakCard('6H').is_less_than(DurakCard('7H'), trump))
+        self.assertTrue(DurakCard('6S').is_less_than(DurakCard('7C'), trump))
+
+    def test_is_less_than_raises_exception_on_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            DurakCard('6S').is_less_than(None)
+
+        with self.assertRaises(ValueError):
+            DurakCard('6S').is_less_than(DurakCard('7S'), trump='H')
+
+    def test_can_beat(self):
+        trump = DurakCard('9H')
+        self.assertTrue(DurakCard('7S').can_beat(DurakCard('6S'), trump))
+        self.assertTrue(DurakCard('6H').can_beat(DurakCard('AS'), trump))
+        self.assertTrue(DurakCard('7H').can_beat(DurakCard('6H'), trump))
+        self.assertFalse(DurakCard('6S').can_beat(DurakCard('6S'), trump))
+        self.assertFalse(DurakCard('AS').can_beat(DurakCard('6H'), trump))
+        self.assertFalse(DurakCard('AS').can_beat(DurakCard('6C'), trump))
+
+    def test_can_be_added_to(self):
+        self.assertTrue(DurakCard('7S').can_be_added_to([]))
+        self.assertTrue(
+            DurakCard('7S').can_be_added_to([DurakCard('7H'), 'AS'])
+        )
+        self.assertFalse(DurakCard('7S').can_be_added_to([DurakCard('8S')]))
+
+    def test_new_returns_same_instance_for_card(self):
+        card = DurakCard('7S')
+        self.assertTrue(DurakCard(card) is card)
+
+    def test_new_interns_two_chars_codes(self):
+        card = DurakCard('7', 'S')
+        self.assertTrue(DurakCard('7S') is card)
+        self.assertTrue(DurakCard(u'7S') is card)
+        self.assertTrue(DurakCard._STRING_REGISTRY['7S'] is card)
+
+    def test_new_normalizes_suit_case(self):
+        self.assertTrue(DurakCard('7s') is DurakCard('7S'))
+
+    def test_ordinal(self):
+        self.assertEqual(DurakCard('6C').ordinal, 0)
+        self.assertEqual(DurakCard('6S').ordinal, 3)
+        self.assertEqual(DurakCard('7C').ordinal, 4)
+        self.assertEqual(DurakCard('AS').ordinal, 35)
+
+    def test_copies_are_the_same_instance(self):
+        card = DurakCard('QD')
+        self.assertTrue(copy.deepcopy(card) is card)
+        self.assertTrue(pickle.loads(pickle.dumps(card, 2)) is card)
+
     def test_durak_card_instances_are_immutable(self):
         card = DurakCard('7', 'S')
 
@@ -142,6 +206,7 @@ class DurakCardTest(unittest.TestCase):
 
 
 class CardSetTest(unittest.TestCase):
+    CARD_SET_CLASS = CardSet
 
     def setUp(self):
         self.trump = DurakCard('6', 'H')
@@ -152,32 +217,38 @@ class CardSetTest(unittest.TestCase):
             'TD',
             DurakCard('KC')
         ]
-        card_set = CardSet(cards, self.trump)
+        card_set = self.CARD_SET_CLASS(cards, self.trump)
         self.assertEqual(card_set._trump, self.trump)
         self.assertItemsEqual(card_set, {
             DurakCard('7S'), DurakCard('TD'), DurakCard('KC')
         })
 
     def test_is_trump(self):
-        card_set = CardSet([], self.trump)
+        card_set = self.CARD_SET_CLASS([], self.trump)
         self.assertTrue(card_set._is_trump('7H'))
         self.assertFalse(card_set._is_trump('8S'))
         self.assertFalse(card_set._is_trump('9C'))
         self.assertFalse(card_set._is_trump('TD'))
 
     def test_trumps(self):
-        card_set = CardSet(['7H', '8S', '9C', 'TD', '6H'], self.trump)
+        card_set = self.CARD_SET_CLASS(
+            ['7H', '8S', '9C', 'TD', '6H'], self.trump
+        )
         self.assertEqual(card_set.trumps(), {DurakCard('6H'), DurakCard('7H')})
 
     def test_not_trumps(self):
-        card_set = CardSet(['7H', '8S', '9C', 'TD', '6H'], self.trump)
+        card_set = self.CARD_SET_CLASS(
+            ['7H', '8S', '9C', 'TD', '6H'], self.trump
+        )
         self.assertEqual(
             card_set.not_trumps(),
             {DurakCard('8S'), DurakCard('9C'), DurakCard('TD')}
         )
 
     def test_sorted_cards_returns_trumps_last(self):
-        card_set = CardSet(['7H', '8S', 'TC', '9C', '6H'], self.trump)
+        card_set = self.CARD_SET_CLASS(
+            ['7H', '8S', 'TC', '9C', '6H'], self.trump
+        )
         self.assertEqual(card_set.sorted_cards(), [
             DurakCard('8S'),
             DurakCard('9C'),
@@ -187,7 +258,7 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_card_groups_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', '8S', '8C', '9C', '6H', '6C', '6D'], self.trump
         )
         self.assertEqual(card_set.card_groups(), [
@@ -196,7 +267,7 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_card_groups_not_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', '8S', '8C', '9C', '6H', '6C', '6D'], self.trump
         )
         self.assertEqual(card_set.card_groups(including_trumps=False), [
@@ -205,7 +276,7 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_cards_that_can_beat_trump_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', 'KH', 'AH', '6S', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         self.assertEqual(card_set.cards_that_can_beat('TH'), [
@@ -213,14 +284,14 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_cards_that_can_beat_trump_not_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', 'KH', 'AH', '6S', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         results = card_set.cards_that_can_beat('TH', including_trumps=False)
         self.assertEqual(results, [])
 
     def test_cards_that_can_beat_not_trump_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', 'KH', 'AH', '6S', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         self.assertEqual(card_set.cards_that_can_beat('8S'), [
@@ -232,14 +303,14 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_cards_that_can_beat_not_trump_not_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', 'KH', 'AH', '6S', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         results = card_set.cards_that_can_beat('8S', including_trumps=False)
         self.assertEqual(results, [DurakCard('TS'), DurakCard('QS')])
 
     def test_cards_that_can_be_added_to_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', '7S', 'AH', 'AD', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         results = card_set.cards_that_can_be_added_to(['9C', '7D', 'AS'])
@@ -252,7 +323,7 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_cards_that_can_be_added_to_not_including_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', '7S', 'AH', 'AD', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         results = card_set.cards_that_can_be_added_to(
@@ -265,25 +336,244 @@ class CardSetTest(unittest.TestCase):
         ])
 
     def test_cards_that_can_be_added_to_returns_all_cards_if_to_is_empty(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7H', '7S', 'AH', 'AD', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         results = card_set.cards_that_can_be_added_to([])
         self.assertEqual(results, card_set.sorted_cards())
 
     def test_lowest_trump(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7S', 'AH', 'AD', 'TS', '7H', 'QS', '8D', 'AC'], self.trump
         )
         self.assertEqual(card_set.lowest_trump(), DurakCard('7H'))
 
     def test_lowest_trump_is_none_if_no_trumps(self):
-        card_set = CardSet(
+        card_set = self.CARD_SET_CLASS(
             ['7S', 'AD', 'TS', 'QS', '8D', 'AC'], self.trump
         )
         self.assertTrue(card_set.lowest_trump() is None)
 
 
+    def _cards(self, *cards):
+        return [DurakCard(card) for card in cards]
+
+    def test_set_comparisons(self):
+        card_set = self.CARD_SET_CLASS(['7H', '8S'], self.trump)
+        self.assertTrue(card_set.issubset(self._cards('7H', '8S', '9C')))
+        self.assertFalse(card_set.issubset(self._cards('7H')))
+        self.assertTrue(card_set.issuperset(self._cards('7H')))
+        self.assertFalse(card_set.issuperset(self._cards('7H', '9C')))
+        self.assertTrue(card_set.isdisjoint(self._cards('9C')))
+        self.assertFalse(card_set.isdisjoint(self._cards('8S', '9C')))
+
+    def test_set_operations_with_many_arguments(self):
+        card_set = self.CARD_SET_CLASS(['7H', '8S', '9C'], self.trump)
+        self.assertEqual(
+            set(card_set.union(self._cards('TD'), self._cards('JD'))),
+            set(self._cards('7H', '8S', '9C', 'TD', 'JD'))
+        )
+        self.assertEqual(
+            set(card_set.intersection(
+                self._cards('7H', '8S'), self._cards('8S', '9C')
+            )),
+            set(self._cards('8S'))
+        )
+        self.assertEqual(
+            set(card_set.difference(self._cards('7H'), self._cards('9C'))),
+            set(self._cards('8S'))
+        )
+        self.assertEqual(
+            set(card_set.symmetric_difference(self._cards('7H', 'TD'))),
+            set(self._cards('8S', '9C', 'TD'))
+        )
+        self.assertEqual(
+            set(card_set), set(self._cards('7H', '8S', '9C'))
+        )
+
+    def test_set_updates_with_many_arguments(self):
+        card_set = self.CARD_SET_CLASS(['7H'], self.trump)
+        card_set.update(self._cards('8S'), self._cards('9C', 'TD'))
+        self.assertEqual(
+            set(card_set), set(self._cards('7H', '8S', '9C', 'TD'))
+        )
+
+        card_set.intersection_update(
+            self._cards('7H', '8S', '9C'), self._cards('8S', '9C')
+        )
+        self.assertEqual(set(card_set), set(self._cards('8S', '9C')))
+
+        card_set.symmetric_difference_update(self._cards('9C', 'JD'))
+        self.assertEqual(set(card_set), set(self._cards('8S', 'JD')))
+
+        card_set.difference_update(self._cards('8S'), self._cards('JD'))
+        self.assertFalse(card_set)
+
+
+class BitCardSetTest(CardSetTest):
+    CARD_SET_CLASS = BitCardSet
+
+    def test_mask_has_bit_per_card_ordinal(self):
+        card_set = BitCardSet(['6C', '6D', 'AS'], self.trump)
+        self.assertEqual(card_set.mask, 1 | 2 | (1 << 35))
+
+    def test_from_mask(self):
+        card_set = BitCardSet.from_mask(1 | (1 << 35), self.trump)
+        self.assertItemsEqual(card_set, [DurakCard('6C'), DurakCard('AS')])
+        self.assertEqual(card_set._trump, self.trump)
+
+    def test_iteration_is_sorted(self):
+        card_set = BitCardSet(['AS', '7H', '6D', 'TC'], self.trump)
+        self.assertEqual(list(card_set), [
+            DurakCard('6D'), DurakCard('7H'), DurakCard('TC'), DurakCard('AS')
+        ])
+
+    def test_len_and_contains(self):
+        card_set = BitCardSet(['AS', '7H'], self.trump)
+        self.assertEqual(len(card_set), 2)
+        self.assertTrue(DurakCard('AS') in card_set)
+        self.assertTrue('7H' in card_set)
+        self.assertFalse(DurakCard('7S') in card_set)
+        self.assertFalse(None in card_set)
+        self.assertFalse(BitCardSet([], self.trump))
+
+    def test_remove_raises_key_error_if_card_is_absent(self):
+        card_set = BitCardSet(['AS'], self.trump)
+        with self.assertRaises(KeyError):
+            card_set.remove(DurakCard('7S'))
+
+        card_set.remove(DurakCard('AS'))
+        self.assertEqual(card_set, set())
+
+    def test_set_operations_with_builtin_sets(self):
+        card_set = BitCardSet(['AS', '7H', '6D'], self.trump)
+        other = {DurakCard('AS'), DurakCard('8C')}
+
+        self.assertEqual(card_set - other, {DurakCard('7H'), DurakCard('6D')})
+        self.assertEqual(other - card_set, {DurakCard('8C')})
+        self.assertEqual(card_set & other, {DurakCard('AS')})
+        self.assertEqual(len(card_set | other), 4)
+        self.assertEqual(card_set, {
+            DurakCard('AS'), DurakCard('7H'), DurakCard('6D')
+        })
+        self.assertTrue(isinstance(card_set - other, BitCardSet))
+
+    def test_update_and_difference_update(self):
+        card_set = BitCardSet([], self.trump)
+        card_set.update(['AS', DurakCard('7H')])
+        self.assertEqual(card_set, {DurakCard('AS'), DurakCard('7H')})
+
+        card_set.difference_update({DurakCard('AS')})
+        self.assertEqual(card_set, {DurakCard('7H')})
+
+    def test_matches_card_set(self):
+        cards = list(DurakCard.all())
+        for trump in ('6C', '7D', '8H', '9S'):
+            for start in xrange(0, 36, 7):
+                hand = cards[start:start + 9]
+                card_set = CardSet(hand, trump)
+                bit_card_set = BitCardSet(hand, trump)
+
+                self.assertEqual(
+                    bit_card_set.sorted_cards(), card_set.sorted_cards()
+                )
+                self.assertEqual(
+                    bit_card_set.lowest_trump(), card_set.lowest_trump()
+                )
+                for card in cards:
+                    self.assertEqual(
+                        bit_card_set.cards_that_can_beat(card),
+                        card_set.cards_that_can_beat(card)
+                    )
+                    self.assertEqual(
+                        bit_card_set.cards_that_can_be_added_to([card]),
+                        card_set.cards_that_can_be_added_to([card])
+                    )
+
+
+class LookupTablesTest(unittest.TestCase):
+
+    def test_beat_tables_match_brute_force(self):
+        for trump_suit in DurakCard.SUITS:
+            for card in CARDS_BY_ORDINAL:
+                expected = [
+                    x for x in CARDS_BY_ORDINAL
+                    if (x.suit == card.suit and x > card) or
+                    (x.suit == trump_suit and card.suit != trump_suit)
+                ]
+                self.assertItemsEqual(
+                    iter_mask(BEAT_MASKS[trump_suit][card.ordinal]), expected
+                )
+                self.assertItemsEqual(
+                    BEAT_CARDS[trump_suit][card.ordinal], expected
+                )
+
+    def test_same_rank_masks(self):
+        for card in CARDS_BY_ORDINAL:
+            self.assertItemsEqual(
+                iter_mask(SAME_RANK_MASKS[card.ordinal]),
+                [x for x in CARDS_BY_ORDINAL if x.rank == card.rank]
+            )
+
+
+class SPRTTest(unittest.TestCase):
+
+    def test_elo_to_score(self):
+        self.assertAlmostEqual(elo_to_score(0), 0.5)
+        self.assertAlmostEqual(elo_to_score(400), 10.0 / 11)
+        self.assertAlmostEqual(elo_to_score(-400), 1.0 / 11)
+
+    def test_bounds(self):
+        sprt = SPRT(0, 10, alpha=0.05, beta=0.05)
+        self.assertAlmostEqual(sprt.lower_bound, -2.944, places=3)
+        self.assertAlmostEqual(sprt.upper_bound, 2.944, places=3)
+
+    def test_no_decision_without_samples(self):
+        sprt = SPRT(0, 10)
+        self.assertEqual(sprt.llr, 0.0)
+        self.assertTrue(sprt.decision is None)
+        self.assertEqual(sprt.count, 0)
+
+    def test_invalid_arguments_raise_value_error(self):
+        self.assertRaises(ValueError, SPRT, 20, 0)
+        self.assertRaises(ValueError, SPRT, 0, 20, alpha=0)
+        self.assertRaises(ValueError, SPRT, 0, 20, beta=1)
+
+    def test_all_wins_accept_h1(self):
+        sprt = SPRT(0, 20)
+        sprt.add(1.0)
+        self.assertTrue(sprt.llr > 0)
+        self.assertTrue(sprt.decision is None)
+
+        while sprt.decision is None:
+            sprt.add(1.0)
+        self.assertEqual(sprt.decision, SPRT.H1)
+        self.assertTrue(sprt.count < 100)
+
+    def test_all_losses_accept_h0(self):
+        sprt = SPRT(0, 20)
+        while sprt.decision is None:
+            sprt.add(0.0)
+        self.assertEqual(sprt.decision, SPRT.H0)
+        self.assertTrue(sprt.count < 100)
+
+    def test_stronger_engine_accepts_h1(self):
+        sprt = SPRT(0, 50)
+        while sprt.decision is None:
+            for score in (1.0, 1.0, 0.0, 0.5):  # 62.5%, about +89 elo
+                sprt.add(score)
+        self.assertEqual(sprt.decision, SPRT.H1)
+        self.assertTrue(sprt.llr >= sprt.upper_bound)
+
+    def test_equal_engines_accept_h0(self):
+        sprt = SPRT(0, 50)
+        while sprt.decision is None:
+            for score in (1.0, 0.0, 0.5):
+                sprt.add(score)
+        self.assertEqual(sprt.decision, SPRT.H0)
+        self.assertTrue(sprt.llr <= sprt.lower_bound)
+
+
 class GetFilenameFunctionTest(unittest.TestCase):
     def setUp(self):
         self.filename = 'filename'
@@ -30,6 +30,9 @@ setup(
             'durak-dummy=durak.engine.dummy:main',
             'durak-gui=durak.gui.play_app:main',
             'durak-logviewer=durak.gui.view_log_app:main',
+            'durak-ismcts=durak.engine.ismcts:main',
+            'durak-mc=durak.engine.mc:main',
+            'durak-tablebase=durak.engine.tablebase:main',
         ],
     },
     install_requires=[